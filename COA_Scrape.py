@@ -9,9 +9,13 @@ import os
 import time
 import logging
 from pathlib import Path
-from datetime import datetime, timedelta
+from datetime import datetime, date
 from typing import Dict, List, Any, Optional
 import re
+import random
+import bisect
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from urllib.parse import urljoin
 
 from selenium import webdriver
@@ -31,31 +35,62 @@ from reportlab.lib import colors
 import anthropic
 from dotenv import load_dotenv
 import argparse
+import threading
+import hashlib
+import asyncio
+import contextvars
+import contextlib
 
 # Load environment variables
 load_dotenv()
 
+# Name suffixes recognized when matching party names (Jr, Sr, II, III, IV, etc.)
+NAME_SUFFIXES = frozenset({'jr', 'sr', 'ii', 'iii', 'iv', 'v', 'junior', 'senior'})
+NAME_SUFFIX_EQUIVALENTS = {'senior': 'sr', 'junior': 'jr'}
+
+# Precompiled patterns for name normalization
+NAME_COMMA_PATTERN = re.compile(r'[,]')
+NAME_WHITESPACE_PATTERN = re.compile(r'\s+')
+
+# Upper bound on distinct names kept in the normalization caches
+NAME_CACHE_SIZE = 65536
+
+# Fuzzy PD party matching (phonetic keys + bounded edit distance on last names).
+# Off by default - the strict names_match rules decide concurrency unless enabled.
+FUZZY_NAME_MATCHING = False
+FUZZY_NAME_MIN_CONFIDENCE = 0.85
+FUZZY_MAX_EDIT_DISTANCE = 2
+NAME_NON_LETTER_PATTERN = re.compile(r'[^a-z]')
+
 def normalize_name_for_matching(name):
     """
     Normalize a name for matching purposes, handling different formats:
     - "Smith, John A. Jr." -> "john a smith jr"
     - "John A. Smith Jr." -> "john a smith jr"
     - "SMITH, JOHN ALAN JR" -> "john alan smith jr"
+    
+    Results are memoized in a bounded LRU cache since the same PD party names
+    are normalized for every COA party they are compared against.
     """
     if not name or not isinstance(name, str):
         return ""
     
+    return normalize_name_cached(name)
+
+@lru_cache(maxsize=NAME_CACHE_SIZE)
+def normalize_name_cached(name):
+    """Memoized body of normalize_name_for_matching (expects a non-empty string)"""
     # Store original to check for comma format
     original = name.strip()
     
     # Remove extra whitespace and convert to lowercase
-    name = name.strip().lower()
+    name = original.lower()
     
     # Remove common punctuation except periods in middle initials
-    name = re.sub(r'[,]', ' ', name)
+    name = NAME_COMMA_PATTERN.sub(' ', name)
     
     # Normalize multiple spaces to single space
-    name = re.sub(r'\s+', ' ', name).strip()
+    name = NAME_WHITESPACE_PATTERN.sub(' ', name).strip()
     
     # Split into parts
     parts = name.split()
@@ -63,13 +98,12 @@ def normalize_name_for_matching(name):
         return name
     
     # Handle suffixes (Jr, Sr, II, III, IV, etc.)
-    suffixes = {'jr', 'sr', 'ii', 'iii', 'iv', 'v', 'junior', 'senior'}
     suffix_parts = []
     name_parts = []
     
     for part in parts:
         clean_part = part.replace('.', '')  # Remove periods for suffix check
-        if clean_part in suffixes:
+        if clean_part in NAME_SUFFIXES:
             suffix_parts.append(clean_part)
         else:
             name_parts.append(part)
@@ -94,74 +128,46 @@ def normalize_name_for_matching(name):
     
     return normalized.strip()
 
-def names_match(name1, name2):
+def normalize_names_for_matching(names):
+    """Normalize a whole party list in one pass, returning normalized names in the same order"""
+    cached = normalize_name_cached
+    return [cached(name) if name and isinstance(name, str) else "" for name in names]
+
+@lru_cache(maxsize=NAME_CACHE_SIZE)
+def name_match_components(normalized):
     """
-    Check if two names refer to the same person, handling different formats:
-    - "Smith, John A. Jr." matches "John A. Smith Jr."
-    - Case insensitive matching
-    - Handles suffixes and middle names/initials
-    - Middle names/initials are included in first name comparison
+    Split a normalized name into the components names_match compares:
+    (first and middle names, last name, normalized suffix set), or None if the
+    name doesn't have both a first and a last name
     """
-    if not name1 or not name2:
-        return False
-    
-    norm1 = normalize_name_for_matching(name1)
-    norm2 = normalize_name_for_matching(name2)
-    
-    # Direct match
-    if norm1 == norm2:
-        return True
-    
-    # Split into components for more flexible matching
-    parts1 = norm1.split()
-    parts2 = norm2.split()
-    
-    if len(parts1) < 2 or len(parts2) < 2:
-        return False
+    parts = normalized.split()
+    if len(parts) < 2:
+        return None
     
-    # Extract components
-    suffixes = {'jr', 'sr', 'ii', 'iii', 'iv', 'v', 'junior', 'senior'}
+    name_parts = tuple(p for p in parts if p not in NAME_SUFFIXES)
+    suffix_parts = [p for p in parts if p in NAME_SUFFIXES]
     
-    def extract_name_components(parts):
-        name_parts = [p for p in parts if p not in suffixes]
-        suffix_parts = [p for p in parts if p in suffixes]
-        
-        if len(name_parts) >= 2:
-            # Last part is last name, everything else is first + middle
-            last = name_parts[-1]
-            first_and_middle = name_parts[:-1]
-            return first_and_middle, last, suffix_parts
-        return [], None, suffix_parts
+    if len(name_parts) < 2:
+        return None
     
-    first_middle1, last1, suffix1 = extract_name_components(parts1)
-    first_middle2, last2, suffix2 = extract_name_components(parts2)
+    # Normalize suffix equivalents
+    normalized_suffixes = frozenset(NAME_SUFFIX_EQUIVALENTS.get(s, s) for s in suffix_parts)
     
-    if not first_middle1 or not last1 or not first_middle2 or not last2:
-        return False
+    # Last part is last name, everything else is first + middle
+    return name_parts[:-1], name_parts[-1], normalized_suffixes
+
+def name_components_compatible(components1, components2):
+    """Check whether two name_match_components results refer to the same person"""
+    first_middle1, last1, suffix1 = components1
+    first_middle2, last2, suffix2 = components2
     
     # Last names must match
     if last1 != last2:
         return False
     
     # Suffixes should match if both have them (allow equivalent forms)
-    if suffix1 and suffix2:
-        # Normalize suffix equivalents
-        def normalize_suffixes(suffix_list):
-            normalized = []
-            for s in suffix_list:
-                if s in ['sr', 'senior']:
-                    normalized.append('sr')
-                elif s in ['jr', 'junior']:
-                    normalized.append('jr')
-                else:
-                    normalized.append(s)
-            return set(normalized)
-        
-        norm_suffix1 = normalize_suffixes(suffix1)
-        norm_suffix2 = normalize_suffixes(suffix2)
-        
-        if norm_suffix1 != norm_suffix2:
-            return False
+    if suffix1 and suffix2 and suffix1 != suffix2:
+        return False
     
     # Check first name + middle name compatibility
     # At minimum, first names must match
@@ -193,6 +199,332 @@ def names_match(name1, name2):
     # If we get here, names are compatible
     return True
 
+def names_match(name1, name2):
+    """
+    Check if two names refer to the same person, handling different formats:
+    - "Smith, John A. Jr." matches "John A. Smith Jr."
+    - Case insensitive matching
+    - Handles suffixes and middle names/initials
+    - Middle names/initials are included in first name comparison
+    """
+    if not name1 or not name2:
+        return False
+    
+    norm1 = normalize_name_for_matching(name1)
+    norm2 = normalize_name_for_matching(name2)
+    
+    # Direct match
+    if norm1 == norm2:
+        return True
+    
+    components1 = name_match_components(norm1)
+    components2 = name_match_components(norm2)
+    
+    if not components1 or not components2:
+        return False
+    
+    return name_components_compatible(components1, components2)
+
+def build_name_match_index(names):
+    """
+    Precompute normalized components once per name and bucket them by last name
+    and suffix, so a lookup only compares against names that can possibly match.
+    Lookups via find_name_matches give exactly the same results as names_match.
+    """
+    index = {
+        'names': [],     # Indexed names in insertion order
+        'exact': {},     # normalized name -> positions
+        'buckets': {},   # last name -> suffix set -> [(position, components)]
+    }
+    
+    names = [name for name in names if name]
+    for name, normalized in zip(names, normalize_names_for_matching(names)):
+        position = len(index['names'])
+        index['names'].append(name)
+        
+        index['exact'].setdefault(normalized, []).append(position)
+        
+        components = name_match_components(normalized)
+        if components:
+            last, suffixes = components[1], components[2]
+            index['buckets'].setdefault(last, {}).setdefault(suffixes, []).append((position, components))
+    
+    return index
+
+def find_name_matches(index, name):
+    """Return every indexed name that names_match(name, indexed_name) accepts, in insertion order"""
+    if not name:
+        return []
+    
+    normalized = normalize_name_for_matching(name)
+    positions = set(index['exact'].get(normalized, []))
+    
+    components = name_match_components(normalized)
+    if components:
+        last, suffixes = components[1], components[2]
+        suffix_buckets = index['buckets'].get(last, {})
+        if suffixes:
+            # Only names with the same suffix or no suffix at all can match
+            candidate_lists = [suffix_buckets.get(suffixes, []), suffix_buckets.get(frozenset(), [])]
+        else:
+            candidate_lists = suffix_buckets.values()
+        
+        for candidates in candidate_lists:
+            for position, other_components in candidates:
+                if position not in positions and name_components_compatible(components, other_components):
+                    positions.add(position)
+    
+    return [index['names'][position] for position in sorted(positions)]
+
+def encode_names_for_matching(names, vocabulary):
+    """
+    Encode names into parallel integer columns for bulk matching. IDs come from the
+    shared vocabulary so both sides of a comparison use the same codes:
+    - normalized: whole normalized name (-1 for empty names)
+    - last / first: last and first name (-1 if the name has no components)
+    - middle: first character of the first middle name (0 = no middle name)
+    - suffix: normalized suffix set (0 = no suffix)
+    """
+    columns = {key: [] for key in ('normalized', 'last', 'first', 'middle', 'suffix')}
+    components_list = []
+    
+    def lookup(table, value):
+        return vocabulary[table].setdefault(value, len(vocabulary[table]))
+    
+    for name, normalized in zip(names, normalize_names_for_matching(names)):
+        columns['normalized'].append(lookup('normalized', normalized) if name else -1)
+        components = name_match_components(normalized) if name else None
+        components_list.append(components)
+        
+        if not components:
+            for key in ('last', 'first', 'middle', 'suffix'):
+                columns[key].append(-1 if key in ('last', 'first') else 0)
+            continue
+        
+        first_middle, last, suffixes = components
+        columns['last'].append(lookup('last', last))
+        columns['first'].append(lookup('first', first_middle[0]))
+        if len(first_middle) > 1:
+            clean_middle = first_middle[1].replace('.', '')
+            # 1 marks a middle name that is only punctuation
+            columns['middle'].append(ord(clean_middle[0]) if clean_middle else 1)
+        else:
+            columns['middle'].append(0)
+        columns['suffix'].append(lookup('suffix', suffixes) if suffixes else 0)
+    
+    return columns, components_list
+
+def match_all(coa_names, pd_names, chunk_size=2000):
+    """
+    Return every (coa_name, pd_name, reason) pair that names_match accepts, ordered
+    by COA name then PD name. Candidate pairs are found with vectorized NumPy
+    comparisons on encoded name columns, then confirmed with the exact middle name
+    rules; without NumPy the last name/suffix blocking index is used instead.
+    """
+    coa_names = list(coa_names)
+    pd_names = list(pd_names)
+    if not coa_names or not pd_names:
+        return []
+    
+    try:
+        import numpy as np
+    except ImportError:
+        print("    ⚠️  NumPy not available, matching names with the blocking index")
+        return match_all_with_index(coa_names, pd_names)
+    
+    # Suffix code 0 is reserved for "no suffix"
+    vocabulary = {'normalized': {}, 'last': {}, 'first': {}, 'suffix': {None: 0}}
+    coa_columns, coa_components = encode_names_for_matching(coa_names, vocabulary)
+    pd_columns, pd_components = encode_names_for_matching(pd_names, vocabulary)
+    
+    coa_arrays = {key: np.asarray(values, dtype=np.int32) for key, values in coa_columns.items()}
+    pd_arrays = {key: np.asarray(values, dtype=np.int32)[np.newaxis, :] for key, values in pd_columns.items()}
+    
+    matches = []
+    for start in range(0, len(coa_names), chunk_size):
+        chunk = {key: values[start:start + chunk_size, np.newaxis] for key, values in coa_arrays.items()}
+        
+        exact = (chunk['normalized'] >= 0) & (chunk['normalized'] == pd_arrays['normalized'])
+        
+        # Necessary conditions for a component match; middle initials must agree
+        # whenever both names have a middle name, and suffixes whenever both have one
+        candidates = (
+            (chunk['last'] >= 0)
+            & (chunk['last'] == pd_arrays['last'])
+            & (chunk['first'] == pd_arrays['first'])
+            & ((chunk['suffix'] == 0) | (pd_arrays['suffix'] == 0) | (chunk['suffix'] == pd_arrays['suffix']))
+            & ((chunk['middle'] == 0) | (pd_arrays['middle'] == 0) | (chunk['middle'] == pd_arrays['middle']))
+        )
+        
+        rows, cols = np.nonzero(exact | candidates)
+        for row, col in zip(rows.tolist(), cols.tolist()):
+            coa_index = start + row
+            if exact[row, col]:
+                matches.append((coa_names[coa_index], pd_names[col], 'exact normalized name'))
+            elif name_components_compatible(coa_components[coa_index], pd_components[col]):
+                matches.append((coa_names[coa_index], pd_names[col], 'compatible first/middle/last name and suffix'))
+    
+    return matches
+
+def match_all_with_index(coa_names, pd_names):
+    """Pure-Python match_all fallback built on the last name/suffix blocking index"""
+    index = build_name_match_index(pd_names)
+    matches = []
+    for coa_name in coa_names:
+        normalized = normalize_name_for_matching(coa_name)
+        for pd_name in find_name_matches(index, coa_name):
+            if normalize_name_for_matching(pd_name) == normalized:
+                matches.append((coa_name, pd_name, 'exact normalized name'))
+            else:
+                matches.append((coa_name, pd_name, 'compatible first/middle/last name and suffix'))
+    return matches
+
+def soundex(word):
+    """American Soundex code for a lowercase word (empty string if it has no letters)"""
+    word = NAME_NON_LETTER_PATTERN.sub('', word)
+    if not word:
+        return ""
+    
+    codes = {}
+    for letters, digit in (('bfpv', '1'), ('cgjkqsxz', '2'), ('dt', '3'), ('l', '4'), ('mn', '5'), ('r', '6')):
+        for ch in letters:
+            codes[ch] = digit
+    
+    result = word[0].upper()
+    previous = codes.get(word[0], '')
+    for ch in word[1:]:
+        digit = codes.get(ch, '')
+        if digit and digit != previous:
+            result += digit
+            if len(result) == 4:
+                break
+        # 'h' and 'w' don't separate letters with the same code; vowels do
+        if ch not in 'hw':
+            previous = digit
+    
+    return result.ljust(4, '0')
+
+def bounded_edit_distance(word1, word2, max_distance):
+    """
+    Optimal string alignment distance (insertions, deletions, substitutions and
+    adjacent transpositions), or max_distance + 1 once it is known to exceed the bound
+    """
+    if abs(len(word1) - len(word2)) > max_distance:
+        return max_distance + 1
+    
+    previous_previous = None
+    previous = list(range(len(word2) + 1))
+    for i in range(1, len(word1) + 1):
+        current = [i] + [0] * len(word2)
+        for j in range(1, len(word2) + 1):
+            cost = 0 if word1[i - 1] == word2[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if (previous_previous is not None and i > 1 and j > 1 and
+                    word1[i - 1] == word2[j - 2] and word1[i - 2] == word2[j - 1]):
+                current[j] = min(current[j], previous_previous[j - 2] + 1)
+        if min(current) > max_distance:
+            return max_distance + 1
+        previous_previous, previous = previous, current
+    
+    return previous[-1] if previous[-1] <= max_distance else max_distance + 1
+
+def fuzzy_last_name_variants(components):
+    """
+    Last name forms used for fuzzy matching, as (compact last name, first and middle
+    names, is_joined). "Johnson-Liu" and "Johnson Liu" both yield "johnsonliu" - the
+    second by joining the last two name parts.
+    """
+    first_middle, last, suffixes = components
+    variants = [(NAME_NON_LETTER_PATTERN.sub('', last), first_middle, False)]
+    if len(first_middle) >= 2:
+        joined = NAME_NON_LETTER_PATTERN.sub('', first_middle[-1] + last)
+        variants.append((joined, first_middle[:-1], True))
+    return [variant for variant in variants if variant[0]]
+
+def fuzzy_lookup_keys(compact_last):
+    """Index keys for a compact last name: its Soundex code and its single-deletion neighbors"""
+    keys = {('soundex', soundex(compact_last)), ('delete', compact_last)}
+    for i in range(len(compact_last)):
+        keys.add(('delete', compact_last[:i] + compact_last[i + 1:]))
+    return keys
+
+def build_fuzzy_name_index(names):
+    """
+    Index names for fuzzy lookup. Each last name variant is bucketed by Soundex code
+    and by single-character deletions, so a lookup only scores names that sound alike
+    or are within one typo/transposition, never the whole roster.
+    """
+    index = {
+        'strict': build_name_match_index(names),
+        'entries': [],   # (name, variant) pairs
+        'buckets': {},   # lookup key -> entry positions
+    }
+    
+    for position, (name, normalized) in enumerate(zip(index['strict']['names'],
+                                                      normalize_names_for_matching(index['strict']['names']))):
+        components = name_match_components(normalized)
+        if not components:
+            continue
+        for variant in fuzzy_last_name_variants(components):
+            entry_position = len(index['entries'])
+            index['entries'].append((position, variant, components[2]))
+            for key in fuzzy_lookup_keys(variant[0]):
+                index['buckets'].setdefault(key, []).append(entry_position)
+    
+    return index
+
+def fuzzy_name_confidence(query_variant, query_suffixes, entry_variant, entry_suffixes):
+    """Confidence (0-1) that two last name variants with their first/middle names are the same person"""
+    compact1, first_middle1, joined1 = query_variant
+    compact2, first_middle2, joined2 = entry_variant
+    
+    distance = bounded_edit_distance(compact1, compact2, FUZZY_MAX_EDIT_DISTANCE)
+    if distance > FUZZY_MAX_EDIT_DISTANCE:
+        return 0.0
+    
+    # Apply the strict first/middle/suffix rules with the last names treated as equal
+    if not name_components_compatible((first_middle1, compact1, query_suffixes),
+                                      (first_middle2, compact1, entry_suffixes)):
+        # Allow an initial in place of a first name at reduced confidence
+        first1 = first_middle1[0].replace('.', '')
+        first2 = first_middle2[0].replace('.', '')
+        if not first1 or not first2 or first1[0] != first2[0] or min(len(first1), len(first2)) != 1:
+            return 0.0
+        initial_penalty = 0.1
+    else:
+        initial_penalty = 0.0
+    
+    confidence = 1.0 - 0.06 * distance - initial_penalty
+    if joined1 != joined2:
+        confidence -= 0.04  # Hyphenated vs. space-separated surname
+    return round(confidence, 2)
+
+def find_fuzzy_name_matches(index, name, min_confidence=None):
+    """
+    Return [(indexed_name, confidence)] for names that plausibly refer to the same
+    person, best first. Strict names_match hits always score 1.0.
+    """
+    if min_confidence is None:
+        min_confidence = FUZZY_NAME_MIN_CONFIDENCE
+    
+    best = {name_match: 1.0 for name_match in find_name_matches(index['strict'], name)}
+    
+    components = name_match_components(normalize_name_for_matching(name)) if name else None
+    if components:
+        for query_variant in fuzzy_last_name_variants(components):
+            entry_positions = set()
+            for key in fuzzy_lookup_keys(query_variant[0]):
+                entry_positions.update(index['buckets'].get(key, []))
+            
+            for entry_position in entry_positions:
+                position, entry_variant, entry_suffixes = index['entries'][entry_position]
+                indexed_name = index['strict']['names'][position]
+                confidence = fuzzy_name_confidence(query_variant, components[2], entry_variant, entry_suffixes)
+                if confidence >= min_confidence and confidence > best.get(indexed_name, 0.0):
+                    best[indexed_name] = confidence
+    
+    return sorted(best.items(), key=lambda item: -item[1])
+
 # Base directory for output files
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
@@ -214,6 +546,218 @@ SPA_LAWYERS = {
 # (15 Courts of Appeals + Supreme Court + Court of Criminal Appeals)
 USE_ALL_COURTS = True
 
+# Raw case page HTML is cached here (under the output folder) so derived fields can be
+# re-extracted without a browser
+CASE_PAGE_CACHE_FOLDER = "case_pages"
+
+# Parallel HTTP fetches when refreshing case pages outside the browser
+CASE_FETCH_WORKERS = 4
+
+# Number of cases analyzed by Claude at the same time
+ANALYSIS_CONCURRENCY = 4
+
+# Submit analysis through the Message Batches API instead of interactive calls
+BATCH_ANALYSIS = False
+MESSAGE_BATCH_POLL_SECONDS = 60
+MESSAGE_BATCH_MAX_BYTES = 200 * 1024 * 1024  # API limit is 256 MB per batch
+
+# Rate limit scheduler: retries per request on 429/overload, backoff bounds (seconds),
+# retries per brief batch after that, and the per-page estimate used for token admission
+RATE_LIMIT_MAX_RETRIES = 6
+RATE_LIMIT_BASE_BACKOFF = 2
+RATE_LIMIT_MAX_BACKOFF = 120
+MAX_BATCH_RETRIES = 2
+TOKENS_PER_PDF_PAGE = 2000
+
+# Brief batch planning: pack by "pages" (API limit of 100 PDF pages per request) or also
+# by estimated "tokens" (--pack-by tokens); exact packing is used for cases with up to
+# EXACT_PACKING_MAX_BRIEFS briefs
+BATCH_PACK_BY = "pages"
+MAX_BATCH_PAGES = 100
+MAX_BATCH_TOKENS = 150000
+EXACT_PACKING_MAX_BRIEFS = 10
+
+# Cross-case packing: cases whose only new brief has at most SMALL_CASE_MAX_PAGES pages (and
+# no issues from earlier runs) share requests, up to MAX_CASES_PER_PACK cases per request
+PACK_SMALL_CASES = False
+SMALL_CASE_MAX_PAGES = 30
+MAX_CASES_PER_PACK = 8
+
+# Timeout (seconds) for each Claude API call made through the AnalysisGateway
+ANALYSIS_REQUEST_TIMEOUT_SECONDS = 300
+
+# A response cut off at max_tokens is retried with double the max_tokens, up to this many
+ANALYSIS_MAX_OUTPUT_TOKENS = 8192
+
+# Model used for brief analysis (also used when counting tokens); ANALYSIS_MODEL in .env overrides it
+ANALYSIS_MODEL = os.getenv('ANALYSIS_MODEL', "claude-3-5-sonnet-20241022")
+
+# Triage: a cheap model classifies each new brief from its first TRIAGE_MAX_PAGES pages and
+# lists its issues presented; only SUBSTANTIVE_DOCUMENT_TYPES go on to ANALYSIS_MODEL.
+# TRIAGE_MODEL in .env overrides the model.
+TRIAGE_BRIEFS = False
+TRIAGE_MODEL = os.getenv('TRIAGE_MODEL', "claude-3-5-haiku-20241022")
+TRIAGE_MAX_PAGES = 8
+DOCUMENT_TYPES = ("merits_brief", "reply_brief", "anders_brief", "motion", "non_substantive")
+# Anders cases are filtered out at download, so an Anders brief found by triage isn't analyzed either
+SUBSTANTIVE_DOCUMENT_TYPES = ("merits_brief", "reply_brief")
+
+# Claude pricing in USD per million (input, output) tokens, matched by model name prefix
+# (unlisted models are priced as DEFAULT_MODEL_PRICING). Cache writes/reads and Message
+# Batches requests are priced relative to these.
+MODEL_PRICING_USD_PER_MTOK = {
+    "claude-3-5-haiku": (0.80, 4.00),
+    "claude-3-haiku": (0.25, 1.25),
+    "claude-3-5-sonnet": (3.00, 15.00),
+    "claude-3-7-sonnet": (3.00, 15.00),
+    "claude-sonnet-4": (3.00, 15.00),
+    "claude-3-opus": (15.00, 75.00),
+    "claude-opus-4": (15.00, 75.00),
+}
+DEFAULT_MODEL_PRICING = (3.00, 15.00)
+CACHE_WRITE_PRICE_MULTIPLIER = 1.25
+CACHE_READ_PRICE_MULTIPLIER = 0.1
+BATCH_PRICE_MULTIPLIER = 0.5
+
+# Stop starting new Claude requests once this run has spent this many USD (None = no budget).
+# Briefs that weren't analyzed stay pending for the next run.
+ANALYSIS_BUDGET_USD = None
+
+# Measure each brief's input tokens once with the token counting endpoint and keep the
+# result in the brief manifest; briefs are truncated to stay under MAX_BRIEF_INPUT_TOKENS
+COUNT_TOKENS_WITH_API = True
+MAX_BRIEF_INPUT_TOKENS = 180000
+
+# Text-first analysis: send extracted text for born-digital pages and a PDF of only the
+# scanned (image-only) pages. A page counts as scanned when it has images and fewer than
+# MIN_TEXT_CHARS_PER_PAGE non-whitespace characters of extractable text.
+TEXT_FIRST_ANALYSIS = False
+MIN_TEXT_CHARS_PER_PAGE = 200
+
+# Send only a brief's Issues Presented / Points of Error / Summary of the Argument /
+# Argument sections when they can be found (text inputs, and PDFs over the page limit)
+SECTION_BRIEFS = False
+MIN_SECTION_CHARS = 200
+
+# Section headings must sit on a line of their own (table of contents entries with dot
+# leaders or page numbers don't match). A bare "Issue" line isn't a heading - only a
+# numbered one ("Issue One", "Issue No. 2") starts a Points of Error section.
+BRIEF_SECTION_PATTERNS = [
+    ('Issues Presented', re.compile(r'(?:issues?|questions?)\s+presented(?:\s+for\s+review)?', re.IGNORECASE)),
+    ('Points of Error', re.compile(
+        r'points?\s+of\s+error(?:\s+(?:no\.?\s*)?(?:\d+|[ivx]+|one|two|three|four|five|six|seven|eight|nine|ten))?|'
+        r'issues?\s+(?:no\.?\s*)?(?:\d+|[ivx]+|one|two|three|four|five|six|seven|eight|nine|ten)',
+        re.IGNORECASE
+    )),
+    ('Summary of the Argument', re.compile(r'summary\s+of\s+(?:the\s+)?arguments?', re.IGNORECASE)),
+    ('Argument', re.compile(r'arguments?(?:\s+and\s+authorit(?:y|ies))?', re.IGNORECASE)),
+]
+BRIEF_SECTION_BOUNDARY_PATTERN = re.compile(
+    r'statement\s+of\s+(?:the\s+)?(?:facts|case)|statement\s+regarding\s+oral\s+argument|'
+    r'prayer(?:\s+for\s+relief)?|conclusion(?:\s+and\s+prayer)?|certificate\s+of\s+(?:service|compliance)|'
+    r'table\s+of\s+contents|(?:index|table)\s+of\s+authorities|identity\s+of\s+(?:the\s+)?parties(?:\s+and\s+counsel)?|'
+    r'appendix|signature',
+    re.IGNORECASE
+)
+BRIEF_HEADING_PREFIX_PATTERN = re.compile(r'^(?:[IVX]+\.|[A-Z]\.|\d+\.)?\s*')
+# Boundary headings only end a section at the top level: in capitals, with no prefix or a
+# roman numeral one, so a "Conclusion" or "B. Conclusion" subheading inside the argument
+# doesn't cut the argument off
+BRIEF_TOP_LEVEL_PREFIX_PATTERN = re.compile(r'^(?:[IVX]+\.)?\s*')
+
+# Claude responses are cached here, keyed by the full request (brief bytes, prompt,
+# model, max_tokens) plus PROMPT_VERSION. Bump PROMPT_VERSION when the way responses
+# are parsed changes; prompt text edits change the key on their own.
+ANALYSIS_CACHE_FOLDER = os.path.join(BASE_DIR, "data", "analysis_cache")
+ANALYSIS_CACHE_MAX_BYTES = 500 * 1024 * 1024
+PROMPT_VERSION = 3
+
+# Upload each brief once through the Files API and reference it by file_id
+# (falls back to inline base64 when an upload fails)
+USE_FILES_API = True
+FILES_API_BETA = "files-api-2025-04-14"
+BRIEF_MANIFEST_FILENAME = "manifest.json"
+
+# Stable instructions sent as the system prompt of every analysis request. Together with
+# the brief documents that follow it, it forms the cached prompt prefix.
+ANALYSIS_SYSTEM_PROMPT = (
+    "You are a legal expert analyzing criminal appellate briefs from Texas courts. "
+    "Identify the distinct legal issues the briefs raise, focusing on substantive legal "
+    "arguments rather than procedural matters, and record them with the record_legal_issues tool."
+)
+
+# Analysis output comes back as the input of this tool, so it arrives as validated JSON
+ISSUES_TOOL = {
+    "name": "record_legal_issues",
+    "description": "Record the distinct legal issues raised in the briefs.",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "issues": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "description": {"type": "string", "description": "Concise description of the issue (1-2 sentences)"},
+                        "legal_area": {"type": "string", "description": "Specific area of law"},
+                        "source_briefs": {"type": "array", "items": {"type": "string"}, "description": "Brief(s) that raised the issue"},
+                        "status": {"type": "string", "enum": ["new", "expanded"], "description": "For follow-up analyses: new issue or expansion of a known one"}
+                    },
+                    "required": ["description", "legal_area"]
+                }
+            }
+        },
+        "required": ["issues"]
+    }
+}
+ISSUES_TOOL_CHOICE = {"type": "tool", "name": "record_legal_issues"}
+ISSUE_STATUSES = ("new", "expanded")
+
+# Packed requests cover several cases, so their issues come back keyed by case number
+CASE_ISSUES_TOOL = {
+    "name": "record_case_legal_issues",
+    "description": "Record the distinct legal issues raised in each case's brief.",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "cases": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "case_number": {"type": "string", "description": "Case number exactly as given"},
+                        "issues": ISSUES_TOOL["input_schema"]["properties"]["issues"]
+                    },
+                    "required": ["case_number", "issues"]
+                }
+            }
+        },
+        "required": ["cases"]
+    }
+}
+CASE_ISSUES_TOOL_CHOICE = {"type": "tool", "name": "record_case_legal_issues"}
+
+# Triage output: what kind of filing a brief is and the issues it presents
+TRIAGE_TOOL = {
+    "name": "classify_brief",
+    "description": "Record what kind of filing the document is and the issues it presents.",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "document_type": {
+                "type": "string",
+                "enum": list(DOCUMENT_TYPES),
+                "description": ("merits_brief: appellant's or State's brief on the merits; reply_brief: a reply brief; "
+                                "anders_brief: counsel's brief stating the appeal is frivolous; motion: a motion or other "
+                                "request to the court; non_substantive: notices, letters and other filings without legal argument")
+            },
+            "issues_presented": {"type": "array", "items": {"type": "string"}, "description": "Issues or points of error as the document states them (empty if none)"}
+        },
+        "required": ["document_type", "issues_presented"]
+    }
+}
+TRIAGE_TOOL_CHOICE = {"type": "tool", "name": "classify_brief"}
+
 def setup_browser(headless=False):
     """Configure and return a Chrome browser instance"""
     import tempfile
@@ -472,7 +1016,10 @@ def is_case_closed_mandate_issued(soup):
     return False
 
 def has_judgment(soup):
-    """Check if a case has a judgment by examining events and documents"""
+    """
+    Check if a case has a judgment by examining events and documents
+    (None if the page has no events table to tell from)
+    """
     # Check events table for judgment-related events
     events_table = soup.find('table', {'id': 'ctl00_ContentPlaceHolder1_grdEvents_ctl00'})
     if events_table:
@@ -522,26 +1069,28 @@ def has_judgment(soup):
                                 # Check for opinion with final indicators
                                 if 'opinion' in doc_description and any(keyword in doc_description for keyword in final_keywords):
                                     return True
+        return False
     
-    return False
+    return None
+
+def brief_filepath(case_number, event_type, index, output_folder):
+    """Path a brief is saved under: briefs/{case_number} {event_type} {index}.pdf"""
+    # Clean up event_type by removing ' FILED'
+    clean_event_type = event_type.replace(' FILED', '').replace(' filed', '')
+    
+    # Replace invalid filename characters
+    safe_case_number = re.sub(r'[<>:"/\\|?*]', '_', case_number)
+    safe_event_type = re.sub(r'[<>:"/\\|?*]', '_', clean_event_type)
+    filename = f"{safe_case_number} {safe_event_type} {index}.pdf"
+    return os.path.join(output_folder, "briefs", filename)
 
 def download_brief_with_driver(driver, url, case_number, event_type, index, output_folder):
     """Download a brief document using the same browser session and save with formatted filename"""
+    filepath = brief_filepath(case_number, event_type, index, output_folder)
+    filename = os.path.basename(filepath)
     try:
-        # Clean up event_type by removing ' FILED'
-        clean_event_type = event_type.replace(' FILED', '').replace(' filed', '')
-        
-        # Create filename: {case_number} {event_type} {index}
-        # Replace invalid filename characters
-        safe_case_number = re.sub(r'[<>:"/\\|?*]', '_', case_number)
-        safe_event_type = re.sub(r'[<>:"/\\|?*]', '_', clean_event_type)
-        filename = f"{safe_case_number} {safe_event_type} {index}.pdf"
-        
         # Create briefs subdirectory
-        briefs_folder = os.path.join(output_folder, "briefs")
-        os.makedirs(briefs_folder, exist_ok=True)
-        
-        filepath = os.path.join(briefs_folder, filename)
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
         
         # Get current page URL to use as referer
         current_page_url = driver.current_url
@@ -617,6 +1166,158 @@ def download_brief_with_driver(driver, url, case_number, event_type, index, outp
         print(f"❌ Error downloading brief {filename}: {str(e)}")
         return None
 
+def case_page_cache_path(output_folder, case_number):
+    """Path of the cached case page HTML for a case"""
+    safe_case_number = re.sub(r'[<>:"/\\|?*]', '_', case_number)
+    return os.path.join(output_folder, CASE_PAGE_CACHE_FOLDER, f"{safe_case_number}.html")
+
+def is_complete_case_page(html):
+    """True if case page HTML has the events grid (error and partially loaded pages don't)"""
+    return 'ctl00_ContentPlaceHolder1_grdEvents_ctl00' in html
+
+def save_case_page(output_folder, case_number, html):
+    """Save raw case page HTML to the page cache (pages without the events grid aren't cached)"""
+    if not is_complete_case_page(html):
+        return
+    try:
+        cache_path = case_page_cache_path(output_folder, case_number)
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        with open(cache_path, 'w', encoding='utf-8') as f:
+            f.write(html)
+    except Exception as e:
+        print(f"⚠️  Could not cache case page for {case_number}: {str(e)}")
+
+def load_cached_case_page(output_folder, case_number):
+    """Return cached case page HTML, or None if the page hasn't been cached (or was cached incomplete)"""
+    cache_path = case_page_cache_path(output_folder, case_number)
+    if not os.path.exists(cache_path):
+        return None
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            html = f.read()
+    except Exception as e:
+        print(f"⚠️  Could not read cached case page for {case_number}: {str(e)}")
+        return None
+    # Pages cached before incomplete ones were skipped are fetched again
+    return html if is_complete_case_page(html) else None
+
+def fetch_case_page(session, case_number):
+    """Fetch a case page over plain HTTP (no browser)"""
+    url = f"https://search.txcourts.gov/Case.aspx?cn={case_number}"
+    response = session.get(url, timeout=30)
+    response.raise_for_status()
+    return response.text
+
+def iter_case_page_soups(case_numbers, output_folder, allow_network=True, max_workers=CASE_FETCH_WORKERS):
+    """
+    Yield (case_number, soup) for the given cases, reading the page cache first and
+    then fetching the remaining pages in parallel (as they complete) when network
+    access is allowed. Cases whose page can't be obtained are skipped.
+    """
+    to_fetch = []
+    for case_number in case_numbers:
+        html = load_cached_case_page(output_folder, case_number)
+        if html:
+            yield case_number, BeautifulSoup(html, 'html.parser')
+        else:
+            to_fetch.append(case_number)
+    
+    if not to_fetch:
+        return
+    if not allow_network:
+        print(f"⚠️  {len(to_fetch)} case pages are not cached and network access is disabled")
+        return
+    
+    print(f"🌐 Fetching {len(to_fetch)} case pages ({max_workers} at a time)...")
+    session = requests.Session()
+    session.headers.update({'User-Agent': 'Mozilla/5.0 (compatible; SPA_Scrape)'})
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(fetch_case_page, session, case_number): case_number
+                   for case_number in to_fetch}
+        for future in as_completed(futures):
+            case_number = futures[future]
+            try:
+                html = future.result()
+            except Exception as e:
+                print(f"⚠️  Error fetching case page for {case_number}: {str(e)}")
+                continue
+            save_case_page(output_folder, case_number, html)
+            yield case_number, BeautifulSoup(html, 'html.parser')
+
+# Field extractors available to --backfill. 'missing' decides whether a case needs the
+# extractor; 'extract' returns the case fields to update from a parsed case page.
+BACKFILL_EXTRACTORS = {
+    'trial_court': {
+        'missing': lambda case: not case.get('trial_court_info', {}).get('county'),
+        'extract': lambda soup, case_number: {'trial_court_info': extract_trial_court_info(soup, case_number)},
+    },
+    'calendar': {
+        'missing': lambda case: 'calendar_events' not in case,
+        'extract': lambda soup, case_number: {'calendar_events': extract_calendar_events(soup, case_number)},
+    },
+    'judgment': {
+        'missing': lambda case: case.get('has_judgment') is None,
+        'extract': lambda soup, case_number: {'has_judgment': has_judgment(soup)},
+    },
+    'mandate': {
+        'missing': lambda case: 'mandate_issued' not in case,
+        'extract': lambda soup, case_number: {'mandate_issued': is_case_closed_mandate_issued(soup)},
+    },
+    'documents': {
+        'missing': lambda case: not case.get('documents'),
+        'extract': lambda soup, case_number: {'documents': extract_document_links(soup, case_number)},
+    },
+}
+
+def save_case_details(all_case_details, output_folder):
+    """Write all case details to case_details.json"""
+    details_file = os.path.join(output_folder, "case_details.json")
+    with open(details_file, 'w') as f:
+        json.dump(all_case_details, f, indent=2)
+    return details_file
+
+def backfill_case_fields(cases, fields, output_folder, all_case_details=None, allow_network=True,
+                         max_workers=CASE_FETCH_WORKERS):
+    """
+    Fill in extracted fields for cases that are missing them. Only cases missing at
+    least one of the requested fields are loaded (from the page cache, or fetched in
+    parallel), only the needed extractors run, and all_case_details is saved after
+    each case when given. Returns the number of cases updated.
+    """
+    needed = {}
+    for case in cases:
+        missing_fields = [field for field in fields if BACKFILL_EXTRACTORS[field]['missing'](case)]
+        if missing_fields:
+            needed[case['case_number']] = (case, missing_fields)
+    
+    if not needed:
+        return 0
+    
+    print(f"🔄 Backfilling {', '.join(fields)} for {len(needed)} cases...")
+    updated = 0
+    backfill_progress = tqdm(total=len(needed), desc="🔄 Backfilling", unit="case")
+    
+    for case_number, soup in iter_case_page_soups(list(needed), output_folder, allow_network, max_workers):
+        case, missing_fields = needed[case_number]
+        try:
+            for field in missing_fields:
+                case.update(BACKFILL_EXTRACTORS[field]['extract'](soup, case_number))
+            if 'calendar' in missing_fields or 'documents' in missing_fields:
+                compute_case_activity_dates(case)
+            updated += 1
+            if all_case_details is not None:
+                save_case_details(all_case_details, output_folder)
+        except Exception as e:
+            backfill_progress.write(f"❌ Error backfilling {case_number}: {str(e)}")
+        backfill_progress.update(1)
+    
+    backfill_progress.close()
+    
+    if updated < len(needed):
+        print(f"⚠️  {len(needed) - updated} cases could not be backfilled")
+    
+    return updated
+
 def extract_case_details(driver, soup, case_number, output_folder=None, all_case_numbers=None):
     """Extract case details including parties, attorney information, calendar events, and trial court info"""
     case_info = {
@@ -707,10 +1408,68 @@ def extract_case_details(driver, soup, case_number, output_folder=None, all_case
     # Extract trial court information
     case_info['trial_court_info'] = extract_trial_court_info(soup, case_number)
     
+    # Derive activity dates once at ingest so eligibility checks don't re-parse events
+    compute_case_activity_dates(case_info)
+    
     return case_info
 
+@lru_cache(maxsize=4096)
+def parse_tames_date(date_str):
+    """Parse a TAMES MM/DD/YYYY date into a date ordinal, or None if it isn't a date"""
+    try:
+        return datetime.strptime(date_str.strip(), '%m/%d/%Y').toordinal()
+    except (ValueError, AttributeError):
+        return None
+
+def compute_case_activity_dates(case):
+    """
+    Store derived activity dates on the case as date ordinals (None when unknown):
+    - last_event: most recent event on the case docket
+    - filed: earliest event on the docket
+    - last_brief: most recent brief filing
+    - last_calendar: most recent calendar setting
+    - last_activity: latest of the above
+    """
+    event_dates = []
+    brief_dates = []
+    for document in case.get('documents', []):
+        ordinal = parse_tames_date(document.get('date', ''))
+        if ordinal is None:
+            continue
+        if document.get('table_type') == 'briefs':
+            brief_dates.append(ordinal)
+        else:
+            event_dates.append(ordinal)
+    
+    for brief in case.get('briefs_downloaded', []):
+        ordinal = parse_tames_date(brief.get('date', ''))
+        if ordinal is not None:
+            brief_dates.append(ordinal)
+    
+    calendar_dates = [parse_tames_date(event.get('set_date', '')) for event in case.get('calendar_events', [])]
+    calendar_dates = [ordinal for ordinal in calendar_dates if ordinal is not None]
+    
+    activity_dates = {
+        'last_event': max(event_dates) if event_dates else None,
+        'filed': min(event_dates) if event_dates else None,
+        'last_brief': max(brief_dates) if brief_dates else None,
+        'last_calendar': max(calendar_dates) if calendar_dates else None,
+    }
+    known_dates = [ordinal for ordinal in activity_dates.values() if ordinal is not None]
+    activity_dates['last_activity'] = max(known_dates) if known_dates else None
+    
+    case['activity_dates'] = activity_dates
+    return activity_dates
+
+def format_ordinal_date(ordinal):
+    """Format a date ordinal as MM/DD/YYYY"""
+    return date.fromordinal(ordinal).strftime('%m/%d/%Y')
+
 def download_briefs_for_case(driver, soup, case_number, output_folder):
-    """Download all briefs for a case with proper naming (excluding notices)"""
+    """
+    Download all briefs for a case with proper naming (excluding notices). Briefs already
+    on disk from an earlier run are kept, so only newly filed briefs are downloaded.
+    """
     downloaded_briefs = []
     
     # Process briefs table
@@ -774,14 +1533,18 @@ def download_briefs_for_case(driver, soup, case_number, output_folder):
         
         # Download each brief with proper index
         for index, brief in enumerate(brief_events, 1):
-            filepath = download_brief_with_driver(
-                driver,
-                brief['url'], 
-                case_number, 
-                brief['event_type'], 
-                index, 
-                output_folder
-            )
+            filepath = brief_filepath(case_number, brief['event_type'], index, output_folder)
+            if os.path.exists(filepath) and os.path.getsize(filepath) > 0:
+                print(f"📁 Already downloaded: {os.path.basename(filepath)}")
+            else:
+                filepath = download_brief_with_driver(
+                    driver,
+                    brief['url'], 
+                    case_number, 
+                    brief['event_type'], 
+                    index, 
+                    output_folder
+                )
             if filepath:
                 downloaded_briefs.append({
                     'index': index,
@@ -1088,95 +1851,6 @@ def generate_pdf_report(all_case_details, output_folder):
     print(f"✅ Generated PDF report: {pdf_file}")
     return pdf_file
 
-def parse_claude_json_response(response_text, case_number):
-    """Enhanced JSON parsing for Claude responses with multiple fallback methods"""
-    import json
-    import re
-    
-    try:
-        # First try to find JSON in markdown code blocks
-        if "```json" in response_text:
-            json_start = response_text.find("```json") + 7
-            json_end = response_text.find("```", json_start)
-            if json_end != -1:
-                response_text = response_text[json_start:json_end].strip()
-        elif "```" in response_text:
-            json_start = response_text.find("```") + 3
-            json_end = response_text.rfind("```")
-            if json_end != -1:
-                response_text = response_text[json_start:json_end].strip()
-        
-        # If no markdown blocks, try to extract complete JSON using regex
-        if not response_text.strip().startswith('{'):
-            # Look for complete JSON object from { to matching }
-            json_match = re.search(r'\{(?:[^{}]|{[^{}]*})*\}', response_text, re.DOTALL)
-            if json_match:
-                response_text = json_match.group(0)
-        
-        # Clean up the JSON text
-        response_text = response_text.strip()
-        
-        # Try parsing the JSON directly
-        result = json.loads(response_text)
-        return result.get('issues', [])
-        
-    except json.JSONDecodeError as e:
-        print(f"    ⚠️  JSON parsing error for {case_number}: {str(e)}")
-        
-        # Enhanced fallback parsing
-        try:
-            # Method 1: Try to fix common JSON issues
-            fixed_response = response_text
-            
-            # Remove trailing commas before closing brackets/braces
-            fixed_response = re.sub(r',(\s*[\]\}])', r'\1', fixed_response)
-            
-            # Try parsing the fixed version
-            result = json.loads(fixed_response)
-            print(f"    ✅ Fixed JSON parsing for {case_number}")
-            return result.get('issues', [])
-            
-        except json.JSONDecodeError:
-            # Method 2: Extract issues array with more robust regex
-            try:
-                # Look for the issues array specifically, handling nested objects
-                issues_pattern = r'"issues"\s*:\s*\[((?:[^[\]]|\[[^\]]*\])*)\]'
-                issues_match = re.search(issues_pattern, response_text, re.DOTALL)
-                
-                if issues_match:
-                    issues_content = issues_match.group(1).strip()
-                    
-                    # Split individual issue objects
-                    issue_objects = []
-                    brace_count = 0
-                    current_object = ""
-                    
-                    for char in issues_content:
-                        current_object += char
-                        if char == '{':
-                            brace_count += 1
-                        elif char == '}':
-                            brace_count -= 1
-                            if brace_count == 0:
-                                # Complete object found
-                                try:
-                                    issue_obj = json.loads(current_object.strip().rstrip(','))
-                                    issue_objects.append(issue_obj)
-                                except:
-                                    pass
-                                current_object = ""
-                    
-                    if issue_objects:
-                        print(f"    ✅ Extracted {len(issue_objects)} issues using fallback parsing for {case_number}")
-                        return issue_objects
-            
-            except Exception as fallback_error:
-                print(f"    ⚠️  Fallback parsing also failed for {case_number}: {str(fallback_error)}")
-        
-        # Last resort: show truncated response for debugging
-        print(f"    📝 Response preview: {response_text[:200]}...")
-        return []
-
 def count_pdf_pages(pdf_path):
     """Count the number of pages in a PDF file"""
     try:
@@ -1227,11 +1901,10 @@ def extract_pdf_text(pdf_path, max_pages=30):
         print(f"    ⚠️  Error extracting text from {pdf_path}: {e}")
         return None
 
-def truncate_pdf_to_pages(pdf_path, max_pages=100):
-    """Create a base64 encoded PDF with only the first max_pages"""
+def truncate_pdf_bytes(pdf_path, max_pages=100):
+    """Return (PDF bytes with only the first max_pages, page count), or (None, 0) on error"""
     try:
         import PyPDF2
-        import base64
         import io
         
         with open(pdf_path, 'rb') as f:
@@ -1240,8 +1913,8 @@ def truncate_pdf_to_pages(pdf_path, max_pages=100):
             
             if total_pages <= max_pages:
                 # PDF is already within limit, return as-is
-                pdf_content = f.read()
-                return base64.b64encode(pdf_content).decode('utf-8'), total_pages
+                f.seek(0)
+                return f.read(), total_pages
             
             # Create new PDF with only first max_pages
             from PyPDF2 import PdfWriter
@@ -1253,99 +1926,824 @@ def truncate_pdf_to_pages(pdf_path, max_pages=100):
             # Write to bytes
             output_buffer = io.BytesIO()
             writer.write(output_buffer)
-            truncated_pdf = output_buffer.getvalue()
             
             print(f"    ✂️  Truncated PDF from {total_pages} to {max_pages} pages")
-            return base64.b64encode(truncated_pdf).decode('utf-8'), max_pages
+            return output_buffer.getvalue(), max_pages
             
     except Exception as e:
         print(f"    ⚠️  Error truncating PDF {pdf_path}: {e}")
         return None, 0
 
-def create_optimal_batches(briefs_with_pages, max_pages=100):
-    """Create optimal batches of briefs that stay under the page limit"""
-    batches = []
-    current_batch = []
-    current_pages = 0
+def truncate_pdf_to_pages(pdf_path, max_pages=100):
+    """Create a base64 encoded PDF with only the first max_pages"""
+    import base64
+    pdf_bytes, page_count = truncate_pdf_bytes(pdf_path, max_pages)
+    if pdf_bytes is None:
+        return None, 0
+    return base64.b64encode(pdf_bytes).decode('utf-8'), page_count
+
+# SDK exceptions worth retrying: overloaded/unavailable servers and dropped or timed-out
+# connections (OverloadedError and ServiceUnavailableError only exist in newer SDKs)
+RETRYABLE_API_ERRORS = (anthropic.InternalServerError, anthropic.APIConnectionError) + tuple(
+    getattr(anthropic, name) for name in ('OverloadedError', 'ServiceUnavailableError') if hasattr(anthropic, name)
+)
+REQUEST_TOO_LARGE_ERRORS = tuple(getattr(anthropic, name) for name in ('RequestTooLargeError',) if hasattr(anthropic, name))
+
+class AnalysisGateway:
+    """
+    Owns the Anthropic clients used for analysis: one synchronous client and one
+    AsyncAnthropic client per event loop, each keeping its connections alive between
+    calls. Also holds the shared error classification and the latency hooks every
+    timed call reports to.
+    """
     
-    for brief_path, brief_description, page_count in briefs_with_pages:
-        # If this single brief exceeds the limit, put it in its own batch
-        if page_count > max_pages:
-            if current_batch:
-                batches.append(current_batch)
-                current_batch = []
-                current_pages = 0
-            batches.append([(brief_path, brief_description, page_count)])
-            continue
+    def __init__(self, timeout=None):
+        self.timeout = timeout
+        self.latency_hooks = []
+        self._sync_client = None
+        self._async_clients = {}
+        self._lock = threading.Lock()
+    
+    @property
+    def api_key(self):
+        return os.getenv('ANTHROPIC_API_KEY')
+    
+    def client_options(self):
+        return {'api_key': self.api_key, 'timeout': self.timeout or ANALYSIS_REQUEST_TIMEOUT_SECONDS}
+    
+    def sync_client(self):
+        """Shared synchronous client (Files API uploads, token counting, Message Batches)"""
+        with self._lock:
+            if self._sync_client is None:
+                self._sync_client = anthropic.Anthropic(**self.client_options())
+            return self._sync_client
+    
+    def async_client(self):
+        """The running event loop's AsyncAnthropic client (SDK retries are off - send_claude_request retries)"""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            client = self._async_clients.get(loop)
+            if client is None:
+                client = anthropic.AsyncAnthropic(max_retries=0, **self.client_options())
+                self._async_clients[loop] = client
+            return client
+    
+    async def close_async_client(self):
+        """Close the running event loop's client and its connections"""
+        with self._lock:
+            client = self._async_clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.close()
+    
+    def run(self, analysis_function, *args):
+        """Run an async analysis function to completion, passing it this loop's client"""
+        async def run():
+            try:
+                return await analysis_function(self.async_client(), *args)
+            finally:
+                await self.close_async_client()
         
-        # If adding this brief would exceed the limit, start a new batch
-        if current_pages + page_count > max_pages:
-            if current_batch:
-                batches.append(current_batch)
-            current_batch = [(brief_path, brief_description, page_count)]
-            current_pages = page_count
-        else:
-            # Add to current batch
-            current_batch.append((brief_path, brief_description, page_count))
-            current_pages += page_count
-    
-    # Add the last batch if it has content
-    if current_batch:
-        batches.append(current_batch)
+        return asyncio.run(run())
     
-    return batches
-
-def analyze_briefs_with_claude(brief_paths_and_descriptions, case_number, prior_issues=None):
-    """Analyze multiple legal brief PDFs with Claude to extract legal issues"""
+    @contextlib.contextmanager
+    def timed(self, operation, label=None):
+        """Time an API call (sync or awaited inside the block) and report it to the latency hooks"""
+        started = time.monotonic()
+        error = None
+        try:
+            yield
+        except Exception as e:
+            error = type(e).__name__
+            raise
+        finally:
+            call_latency = {
+                'operation': operation,
+                'label': label,
+                'seconds': time.monotonic() - started,
+                'error': error
+            }
+            for hook in self.latency_hooks:
+                hook(call_latency)
+    
+    @staticmethod
+    def classify_error(error):
+        """
+        Sort an exception into 'rate_limited', 'retryable', 'not_found', 'too_large', 'pdf',
+        'invalid_request', 'api' (other API errors) or 'local' (not from the API at all)
+        """
+        if isinstance(error, anthropic.RateLimitError):
+            return 'rate_limited'
+        if isinstance(error, RETRYABLE_API_ERRORS):
+            return 'retryable'
+        if isinstance(error, anthropic.NotFoundError):
+            return 'not_found'
+        if REQUEST_TOO_LARGE_ERRORS and isinstance(error, REQUEST_TOO_LARGE_ERRORS):
+            return 'too_large'
+        if isinstance(error, anthropic.BadRequestError):
+            # Every invalid request is a 400 - the API's message tells a bad document from an oversized prompt
+            message = str(error.message).lower()
+            if 'pdf' in message or 'document' in message:
+                return 'pdf'
+            if 'too long' in message or 'too large' in message or 'maximum' in message:
+                return 'too_large'
+            return 'invalid_request'
+        if isinstance(error, anthropic.APIError):
+            return 'api'
+        return 'local'
+
+CLAUDE_CALL_LATENCIES = []
+
+def record_claude_latency(call_latency):
+    """Latency hook keeping every timed call for print_latency_metrics"""
+    CLAUDE_CALL_LATENCIES.append(call_latency)
+
+def print_latency_metrics():
+    """Print call count, median/95th percentile latency and errors per API operation"""
+    operations = {}
+    for call_latency in CLAUDE_CALL_LATENCIES:
+        operations.setdefault(call_latency['operation'], []).append(call_latency)
+    for operation, calls in sorted(operations.items()):
+        seconds = sorted(call['seconds'] for call in calls)
+        errors = sum(1 for call in calls if call['error'])
+        print(f"⏱️  {operation}: {len(calls)} call(s), p50 {seconds[len(seconds) // 2]:.2f}s, "
+              f"p95 {seconds[min(len(seconds) - 1, int(len(seconds) * 0.95))]:.2f}s, {errors} failed")
+
+ANALYSIS_GATEWAY = AnalysisGateway()
+ANALYSIS_GATEWAY.latency_hooks.append(record_claude_latency)
+
+BRIEF_MANIFESTS = {}
+BRIEF_MANIFEST_LOCK = threading.Lock()
+# file_id -> {'sha256', 'pages'} for every brief upload known this run
+UPLOADED_FILES = {}
+
+def brief_manifest_path(briefs_folder):
+    """Path of the brief manifest for a briefs folder"""
+    return os.path.join(briefs_folder, BRIEF_MANIFEST_FILENAME)
+
+def load_brief_manifest(briefs_folder):
+    """Return the brief manifest for a folder ({filename: entry}), loading it once per run"""
+    if briefs_folder not in BRIEF_MANIFESTS:
+        manifest = {}
+        manifest_path = brief_manifest_path(briefs_folder)
+        if os.path.exists(manifest_path):
+            try:
+                with open(manifest_path, 'r') as f:
+                    manifest = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"⚠️  Error loading brief manifest {manifest_path}: {e}")
+        BRIEF_MANIFESTS[briefs_folder] = manifest
+        for entry in manifest.values():
+            remember_uploaded_files(entry)
+    return BRIEF_MANIFESTS[briefs_folder]
+
+def save_brief_manifest(briefs_folder):
+    """Write a folder's brief manifest (call with BRIEF_MANIFEST_LOCK held)"""
+    manifest_path = brief_manifest_path(briefs_folder)
+    temp_path = f"{manifest_path}.tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(BRIEF_MANIFESTS[briefs_folder], f, indent=2)
+    os.replace(temp_path, manifest_path)
+
+def remember_uploaded_files(entry):
+    """Index a manifest entry's uploads by file_id"""
+    uploads = dict(entry.get('truncated_file_ids', {}))
+    if entry.get('file_id'):
+        uploads['full'] = entry['file_id']
+    for key, file_id in uploads.items():
+        pages = entry.get('pages', 0) if key == 'full' else min(entry.get('pages', 0), int(key))
+        uploaded = {'sha256': f"{entry.get('sha256')}:{key}", 'pages': pages}
+        if entry.get('tokens_per_page'):
+            uploaded['tokens'] = round(entry['tokens_per_page'] * pages)
+        UPLOADED_FILES[file_id] = uploaded
+
+def file_sha256(path):
+    """SHA-256 of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def brief_manifest_entry(brief_path):
+    """Return the manifest entry for a brief, rehashing it (and dropping its uploads) if the file changed"""
+    briefs_folder = os.path.dirname(os.path.abspath(brief_path))
+    filename = os.path.basename(brief_path)
+    stat = os.stat(brief_path)
+    
+    with BRIEF_MANIFEST_LOCK:
+        manifest = load_brief_manifest(briefs_folder)
+        entry = manifest.get(filename)
+        if entry and entry.get('size') == stat.st_size and entry.get('mtime') == stat.st_mtime:
+            return briefs_folder, entry
+    
+    # Hash outside the lock - other briefs can be registered meanwhile
+    sha256 = file_sha256(brief_path)
+    pages = count_pdf_pages(brief_path)
+    
+    with BRIEF_MANIFEST_LOCK:
+        entry = manifest.get(filename)
+        if not entry or entry.get('sha256') != sha256:
+            entry = {'sha256': sha256}
+        entry.update({'size': stat.st_size, 'mtime': stat.st_mtime, 'pages': pages})
+        manifest[filename] = entry
+        save_brief_manifest(briefs_folder)
+    return briefs_folder, entry
+
+def register_brief_file(brief_path, max_pages=None):
+    """
+    Return the Files API file_id for a brief (or for its first max_pages pages),
+    uploading it the first time it's needed. Returns None if the upload fails.
+    """
+    briefs_folder, entry = brief_manifest_entry(brief_path)
+    truncate = max_pages is not None and entry.get('pages', 0) > max_pages
+    
+    with BRIEF_MANIFEST_LOCK:
+        file_id = entry.get('truncated_file_ids', {}).get(str(max_pages)) if truncate else entry.get('file_id')
+    if file_id:
+        return file_id
+    
+    filename = os.path.basename(brief_path)
     try:
-        # Get API key from environment variable
-        api_key = os.getenv('ANTHROPIC_API_KEY')
-        if not api_key:
-            print("❌ ANTHROPIC_API_KEY not found in .env file")
-            return []
-        
-        client = anthropic.Anthropic(api_key=api_key)
-        
-        # Prepare content array with all briefs
-        content = []
-        brief_descriptions = []
+        client = ANALYSIS_GATEWAY.sync_client()
+        if truncate:
+            pdf_bytes, _ = truncate_pdf_bytes(brief_path, max_pages)
+            if pdf_bytes is None:
+                return None
+            with ANALYSIS_GATEWAY.timed('files.upload', filename):
+                uploaded = client.beta.files.upload(file=(filename, pdf_bytes, "application/pdf"), betas=[FILES_API_BETA])
+        else:
+            with open(brief_path, 'rb') as f, ANALYSIS_GATEWAY.timed('files.upload', filename):
+                uploaded = client.beta.files.upload(file=(filename, f, "application/pdf"), betas=[FILES_API_BETA])
+    except Exception as e:
+        print(f"    ⚠️  Files API upload failed for {filename}, sending inline: {e}")
+        return None
+    
+    with BRIEF_MANIFEST_LOCK:
+        if truncate:
+            entry.setdefault('truncated_file_ids', {})[str(max_pages)] = uploaded.id
+        else:
+            entry['file_id'] = uploaded.id
+        entry['uploaded_at'] = datetime.now().isoformat()
+        remember_uploaded_files(entry)
+        save_brief_manifest(briefs_folder)
+    
+    print(f"    ☁️  Uploaded {filename} ({uploaded.id})")
+    return uploaded.id
+
+def forget_uploaded_files(request):
+    """Drop a request's file_ids from the manifests (e.g. after the API reports them missing)"""
+    file_ids = set(request_file_ids(request))
+    if not file_ids:
+        return
+    with BRIEF_MANIFEST_LOCK:
+        for briefs_folder, manifest in BRIEF_MANIFESTS.items():
+            changed = False
+            for entry in manifest.values():
+                if entry.get('file_id') in file_ids:
+                    entry.pop('file_id')
+                    changed = True
+                truncated = entry.get('truncated_file_ids', {})
+                for key in [key for key, file_id in truncated.items() if file_id in file_ids]:
+                    truncated.pop(key)
+                    changed = True
+            if changed:
+                save_brief_manifest(briefs_folder)
+    for file_id in file_ids:
+        UPLOADED_FILES.pop(file_id, None)
+
+def request_file_ids(request):
+    """file_ids referenced by a Messages API request's document blocks"""
+    file_ids = []
+    for message in request.get('messages', []):
+        content = message['content']
+        if isinstance(content, str):
+            continue
+        for block in content:
+            if block.get('type') == 'document' and block['source'].get('type') == 'file':
+                file_ids.append(block['source']['file_id'])
+    return file_ids
+
+def files_api_request_options(request):
+    """Extra request options needed when a request references uploaded files"""
+    if request_file_ids(request):
+        return {'extra_headers': {'anthropic-beta': FILES_API_BETA}}
+    return {}
+
+def pdf_document_block(brief_path, max_pages=None):
+    """
+    Document content block for a brief PDF: a Files API reference when possible,
+    inline base64 otherwise. Returns None if the PDF couldn't be truncated to max_pages.
+    """
+    if USE_FILES_API:
+        file_id = register_brief_file(brief_path, max_pages)
+        if file_id:
+            return {
+                "type": "document",
+                "source": {
+                    "type": "file",
+                    "file_id": file_id
+                }
+            }
+    
+    import base64
+    if max_pages is not None:
+        pdf_content, _ = truncate_pdf_to_pages(brief_path, max_pages)
+        if pdf_content is None:
+            return None
+    else:
+        # Read the PDF file as binary and encode as base64
+        with open(brief_path, 'rb') as f:
+            pdf_content = base64.b64encode(f.read()).decode('utf-8')
+    
+    return {
+        "type": "document",
+        "source": {
+            "type": "base64",
+            "media_type": "application/pdf",
+            "data": pdf_content
+        }
+    }
+
+# Token counting state for this run: 'failed' holds briefs whose count failed, which use
+# the estimate instead of being counted again
+TOKEN_COUNTING = {'available': True, 'baseline': None, 'failed': set()}
+
+# Parallel token counting calls when measuring briefs before planning
+TOKEN_COUNT_WORKERS = 4
+
+def count_message_tokens(content):
+    """Input tokens of a single user message, measured by the token counting endpoint (None if it couldn't be measured)"""
+    if not (COUNT_TOKENS_WITH_API and TOKEN_COUNTING['available']):
+        return None
+    request = {'messages': [{"role": "user", "content": content}]}
+    try:
+        with ANALYSIS_GATEWAY.timed('messages.count_tokens'):
+            result = ANALYSIS_GATEWAY.sync_client().messages.count_tokens(
+                model=ANALYSIS_MODEL,
+                messages=request['messages'],
+                **files_api_request_options(request)
+            )
+        return result.input_tokens
+    except Exception as e:
+        error_kind = ANALYSIS_GATEWAY.classify_error(e)
+        if error_kind == 'not_found' and request_file_ids(request):
+            # An uploaded brief expired - it's re-uploaded when next needed
+            forget_uploaded_files(request)
+        elif isinstance(e, (anthropic.AuthenticationError, anthropic.PermissionDeniedError)) or error_kind == 'not_found':
+            # The endpoint itself can't be used - don't keep paying for failed calls this run
+            print(f"    ⚠️  Token counting unavailable, using estimates: {e}")
+            TOKEN_COUNTING['available'] = False
+            return None
+        print(f"    ⚠️  Token counting failed, using an estimate: {e}")
+        return None
+
+def token_count_baseline():
+    """Tokens of a message with no document (subtracted from measured documents); None if it can't be counted"""
+    if TOKEN_COUNTING['baseline'] is None:
+        TOKEN_COUNTING['baseline'] = count_message_tokens([{"type": "text", "text": "."}])
+    return TOKEN_COUNTING['baseline']
+
+def measure_brief_tokens(brief_path, page_count):
+    """Measure the input tokens of a brief PDF (its first MAX_BATCH_PAGES pages); returns (tokens, pages) or None"""
+    measured_pages = min(page_count, MAX_BATCH_PAGES)
+    if token_count_baseline() is None:
+        return None
+    
+    # Count the same document block analysis sends - the uploaded file when the Files API is on
+    document_block = pdf_document_block(brief_path, measured_pages if page_count > measured_pages else None)
+    if document_block is None:
+        return None
+    document_tokens = count_message_tokens([document_block, {"type": "text", "text": "."}])
+    if document_tokens is None:
+        return None
+    return document_tokens - TOKEN_COUNTING['baseline'], measured_pages
+
+def calibrated_tokens_per_page():
+    """Average tokens per PDF page over every measured brief, or TOKENS_PER_PDF_PAGE before any are measured"""
+    measured_tokens = 0
+    measured_pages = 0
+    with BRIEF_MANIFEST_LOCK:
+        for manifest in BRIEF_MANIFESTS.values():
+            for entry in manifest.values():
+                if entry.get('input_tokens') and entry.get('measured_pages'):
+                    measured_tokens += entry['input_tokens']
+                    measured_pages += entry['measured_pages']
+    if not measured_pages:
+        return TOKENS_PER_PDF_PAGE
+    return measured_tokens / measured_pages
+
+def brief_token_count(brief_path, page_count=None):
+    """
+    Input tokens of a whole brief PDF: measured once and cached in the brief manifest,
+    or estimated at the calibrated tokens-per-page rate when it can't be measured.
+    """
+    if not os.path.exists(brief_path):
+        return estimate_brief_tokens(page_count or 0)
+    
+    briefs_folder, entry = brief_manifest_entry(brief_path)
+    if 'tokens_per_page' not in entry and brief_path not in TOKEN_COUNTING['failed']:
+        measured = measure_brief_tokens(brief_path, entry['pages'])
+        if not measured:
+            TOKEN_COUNTING['failed'].add(brief_path)
+        else:
+            input_tokens, measured_pages = measured
+            with BRIEF_MANIFEST_LOCK:
+                entry['input_tokens'] = input_tokens
+                entry['measured_pages'] = measured_pages
+                entry['tokens_per_page'] = input_tokens / max(1, measured_pages)
+                remember_uploaded_files(entry)
+                save_brief_manifest(briefs_folder)
+    
+    if 'tokens_per_page' in entry:
+        return round(entry['tokens_per_page'] * entry['pages'])
+    return estimate_brief_tokens(entry['pages'])
+
+def measure_briefs_tokens(brief_paths, max_workers=TOKEN_COUNT_WORKERS):
+    """
+    Measure (and cache) the input tokens of many briefs in parallel, so the batch planners
+    find them in the brief manifest instead of counting one brief at a time
+    """
+    brief_paths = [path for path in dict.fromkeys(brief_paths) if os.path.exists(path)]
+    if not brief_paths or token_count_baseline() is None:
+        return
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(brief_token_count, brief_paths))
+
+def brief_page_limit(brief_path, page_count):
+    """Most pages of a brief that fit in one request (page limit and MAX_BRIEF_INPUT_TOKENS)"""
+    page_limit = min(page_count, MAX_BATCH_PAGES)
+    total_tokens = brief_token_count(brief_path, page_count)
+    if page_count and total_tokens > MAX_BRIEF_INPUT_TOKENS:
+        tokens_per_page = total_tokens / page_count
+        page_limit = min(page_limit, max(1, int(MAX_BRIEF_INPUT_TOKENS // tokens_per_page)))
+    return page_limit
+
+def count_text_tokens(text):
+    """Input tokens of a block of text (measured when possible, else the word-count estimate)"""
+    measured = count_message_tokens([{"type": "text", "text": text}])
+    if measured is None:
+        return estimate_tokens(text)
+    return measured - (TOKEN_COUNTING['baseline'] or 0)
+
+def estimate_brief_tokens(page_count):
+    """Estimated input tokens for a brief PDF of page_count pages"""
+    return round(page_count * calibrated_tokens_per_page())
+
+def batch_fits(batch_load, brief_load, limits):
+    """True if a brief's load fits in a batch under every limit"""
+    return all(used + needed <= limit for used, needed, limit in zip(batch_load, brief_load, limits))
+
+def add_loads(batch_load, brief_load):
+    """Element-wise sum of two load tuples"""
+    return tuple(used + needed for used, needed in zip(batch_load, brief_load))
+
+def pack_first_fit_decreasing(loads, limits):
+    """First-fit decreasing bin packing; returns lists of item indexes"""
+    batches = []  # [load, [item indexes]]
+    for i in sorted(range(len(loads)), key=lambda i: loads[i], reverse=True):
+        for batch in batches:
+            if batch_fits(batch[0], loads[i], limits):
+                batch[0] = add_loads(batch[0], loads[i])
+                batch[1].append(i)
+                break
+        else:
+            batches.append([loads[i], [i]])
+    return [items for _, items in batches]
+
+def pack_exact(loads, limits):
+    """Fewest-batches packing by branch and bound (small inputs only); returns lists of item indexes"""
+    best = pack_first_fit_decreasing(loads, limits)
+    lower_bound = max(-(-sum(load[d] for load in loads) // limits[d]) for d in range(len(limits)))
+    if len(best) <= lower_bound:
+        return best
+    
+    order = sorted(range(len(loads)), key=lambda i: loads[i], reverse=True)
+    batches = []
+    
+    def search(k):
+        nonlocal best
+        if len(batches) >= len(best):
+            return
+        if k == len(order):
+            best = [list(items) for _, items in batches]
+            return
         
-        # Read all PDF files and add them to content
-        import base64
-        for brief_path, brief_description in brief_paths_and_descriptions:
-            try:
-                with open(brief_path, 'rb') as f:
-                    pdf_content = base64.b64encode(f.read()).decode('utf-8')
-                
-                content.append({
-                    "type": "document",
-                    "source": {
-                        "type": "base64",
-                        "media_type": "application/pdf",
-                        "data": pdf_content
-                    }
-                })
-                brief_descriptions.append(brief_description)
-            except Exception as e:
-                print(f"    ⚠️  Error reading {brief_path}: {e}")
+        i = order[k]
+        tried_loads = set()
+        for batch in batches:
+            # Batches with the same load are interchangeable - try only one of them
+            if batch[0] in tried_loads or not batch_fits(batch[0], loads[i], limits):
                 continue
+            tried_loads.add(batch[0])
+            previous_load = batch[0]
+            batch[0] = add_loads(previous_load, loads[i])
+            batch[1].append(i)
+            search(k + 1)
+            batch[1].pop()
+            batch[0] = previous_load
+            if len(best) <= lower_bound:
+                return
         
-        if not content:
-            print(f"    ⚠️  No valid briefs to analyze for {case_number}")
-            return []
-        
-        # Create the analysis prompt
-        brief_list = "\n".join([f"- {desc}" for desc in brief_descriptions])
+        batches.append([loads[i], [i]])
+        search(k + 1)
+        batches.pop()
+    
+    search(0)
+    return best
+
+def create_optimal_batches(briefs_with_pages, max_pages=None, max_tokens=None):
+    """
+    Pack briefs into the fewest batches under the page limit (and the token limit when
+    packing by tokens). Uses an exact search for up to EXACT_PACKING_MAX_BRIEFS briefs,
+    first-fit decreasing above that. Briefs keep their filing order within a batch, and
+    batches are ordered by their earliest brief so prior-issues follow-ups run forward in time.
+    """
+    if max_pages is None:
+        max_pages = MAX_BATCH_PAGES
+    if max_tokens is None and BATCH_PACK_BY == "tokens":
+        max_tokens = MAX_BATCH_TOKENS
+    
+    limits = (max_pages,) if max_tokens is None else (max_pages, max_tokens)
+    
+    def brief_load(brief):
+        brief_path, _, page_count = brief
+        if max_tokens is None:
+            return (page_count,)
+        return (page_count, brief_token_count(brief_path, page_count))
+    
+    # A brief over the limit goes in its own batch (and gets truncated when analyzed)
+    groups = []
+    packable = []
+    for position, brief in enumerate(briefs_with_pages):
+        load = brief_load(brief)
+        if batch_fits((0,) * len(limits), load, limits):
+            packable.append((position, load))
+        else:
+            groups.append([position])
+    
+    loads = [load for _, load in packable]
+    if len(packable) <= EXACT_PACKING_MAX_BRIEFS:
+        packed = pack_exact(loads, limits)
+    else:
+        packed = pack_first_fit_decreasing(loads, limits)
+    groups.extend([packable[i][0] for i in items] for items in packed)
+    
+    groups = sorted((sorted(group) for group in groups), key=lambda group: group[0])
+    return [[briefs_with_pages[position] for position in group] for group in groups]
+
+def next_fit_batch_count(briefs_with_pages, max_pages=None):
+    """Number of batches the old sequential next-fit planner would have made"""
+    if max_pages is None:
+        max_pages = MAX_BATCH_PAGES
+    batch_count = 0
+    current_pages = None
+    for _, _, page_count in briefs_with_pages:
+        if page_count > max_pages:
+            batch_count += 1
+            current_pages = None
+        elif current_pages is None or current_pages + page_count > max_pages:
+            batch_count += 1
+            current_pages = page_count
+        else:
+            current_pages += page_count
+    return batch_count
+
+def cache_breakpoint(block):
+    """Mark a content block as the end of a cacheable prompt prefix"""
+    return dict(block, cache_control={"type": "ephemeral"})
+
+def analysis_system_prompt():
+    """System prompt blocks shared by every analysis request"""
+    return [{"type": "text", "text": ANALYSIS_SYSTEM_PROMPT}]
+
+def page_has_images(page):
+    """True if a PDF page draws any image XObjects"""
+    try:
+        resources = page.get('/Resources')
+        if resources is None:
+            return False
+        xobjects = resources.get_object().get('/XObject')
+        if xobjects is None:
+            return False
+        xobjects = xobjects.get_object()
+        return any(xobjects[name].get_object().get('/Subtype') == '/Image' for name in xobjects)
+    except Exception:
+        return False
+
+@lru_cache(maxsize=64)
+def score_pdf_pages(pdf_path, mtime=None):
+    """
+    Extract each page's text and classify it: returns a tuple of (text, is_scanned) per page.
+    mtime is only part of the cache key, so an edited brief is scored again.
+    """
+    import PyPDF2
+    pages = []
+    with open(pdf_path, 'rb') as f:
+        reader = PyPDF2.PdfReader(f)
+        for page in reader.pages:
+            try:
+                text = page.extract_text() or ""
+            except Exception:
+                text = ""
+            text_chars = len(NAME_WHITESPACE_PATTERN.sub('', text))
+            pages.append((text, text_chars < MIN_TEXT_CHARS_PER_PAGE and page_has_images(page)))
+    return tuple(pages)
+
+def classify_brief_heading(line):
+    """Return the section name a heading line starts, 'boundary' for other brief sections, or None"""
+    heading = BRIEF_HEADING_PREFIX_PATTERN.sub('', line.strip()).rstrip(' :.')
+    if not heading or len(heading) > 60:
+        return None
+    for section_name, pattern in BRIEF_SECTION_PATTERNS:
+        if pattern.fullmatch(heading):
+            return section_name
+    if BRIEF_SECTION_BOUNDARY_PATTERN.fullmatch(heading) and heading.isupper() and \
+       BRIEF_TOP_LEVEL_PREFIX_PATTERN.sub('', line.strip()).rstrip(' :.') == heading:
+        return 'boundary'
+    return None
+
+def section_brief_pages(pages):
+    """
+    Pull the Issues Presented, Points of Error, Summary of the Argument and Argument
+    sections out of a brief's page texts. Returns (compact text, 0-based page numbers
+    the sections span), or None when no argument section could be found.
+    """
+    lines = []
+    for page_num, (text, _) in enumerate(pages):
+        for line in text.splitlines():
+            lines.append((page_num, line))
+    
+    headings = []
+    for line_index, (_, line) in enumerate(lines):
+        section_name = classify_brief_heading(line)
+        if section_name:
+            headings.append((line_index, section_name))
+    
+    sections = []
+    for position, (line_index, section_name) in enumerate(headings):
+        if section_name == 'boundary':
+            continue
+        end_index = headings[position + 1][0] if position + 1 < len(headings) else len(lines)
+        body_lines = lines[line_index + 1:end_index]
+        body = "\n".join(line for _, line in body_lines).strip()
+        # Table of contents entries leave only a line or two before the next heading
+        if len(body) < MIN_SECTION_CHARS:
+            continue
+        heading = lines[line_index][1].strip()
+        sections.append((section_name, heading, body, {page_num for page_num, _ in lines[line_index:end_index]}))
+    
+    if not any(section_name != 'Issues Presented' for section_name, _, _, _ in sections):
+        return None
+    
+    compact_text = "\n\n".join(f"{heading}\n{body}" for _, heading, body, _ in sections)
+    section_pages = sorted(set().union(*(page_nums for _, _, _, page_nums in sections)))
+    return compact_text, section_pages
+
+def brief_sections(brief_path):
+    """Sectioned text and pages of a brief PDF (see section_brief_pages), or None"""
+    try:
+        return section_brief_pages(score_pdf_pages(brief_path, os.path.getmtime(brief_path)))
+    except Exception as e:
+        print(f"    ⚠️  Error sectioning {brief_path}: {e}")
+        return None
+
+def extract_brief_analysis_text(brief_path, max_pages=30):
+    """Text to analyze for a brief: its argument sections when found, else its first max_pages pages"""
+    if SECTION_BRIEFS:
+        sections = brief_sections(brief_path)
+        if sections:
+            print(f"    📑 Using {len(sections[1])} page(s) of argument sections")
+            return sections[0]
+    return extract_pdf_text(brief_path, max_pages)
+
+def pdf_pages_document_block(pdf_path, page_numbers):
+    """Inline PDF document block containing only the given (0-based) pages"""
+    import PyPDF2
+    import base64
+    import io
+    
+    with open(pdf_path, 'rb') as f:
+        reader = PyPDF2.PdfReader(f)
+        writer = PyPDF2.PdfWriter()
+        for page_num in page_numbers:
+            writer.add_page(reader.pages[page_num])
+        output_buffer = io.BytesIO()
+        writer.write(output_buffer)
+    
+    return {
+        "type": "document",
+        "source": {
+            "type": "base64",
+            "media_type": "application/pdf",
+            "data": base64.b64encode(output_buffer.getvalue()).decode('utf-8')
+        }
+    }
+
+def text_first_brief_blocks(brief_path, brief_description, max_pages=None):
+    """
+    Content blocks for a brief in text-first mode: its extracted text, plus a PDF of only
+    its scanned pages. A fully scanned brief is sent as the PDF itself.
+    """
+    all_pages = score_pdf_pages(brief_path, os.path.getmtime(brief_path))
+    pages = all_pages[:max_pages] if max_pages is not None else all_pages
+    
+    scanned_pages = [page_num for page_num, (_, is_scanned) in enumerate(pages) if is_scanned]
+    text_pages = len(pages) - len(scanned_pages)
+    print(f"    📝 {brief_description}: {text_pages} text page(s), {len(scanned_pages)} scanned page(s)")
+    
+    if not text_pages or not any(text.strip() for text, _ in pages):
+        block = pdf_document_block(brief_path, max_pages)
+        return [block] if block else None
+    
+    # The argument sections are short enough to send whole, wherever they are in the brief
+    sections = section_brief_pages(all_pages) if SECTION_BRIEFS else None
+    if sections:
+        brief_text = sections[0]
+        print(f"    📑 {brief_description}: sending argument sections from {len(sections[1])} page(s)")
+    else:
+        brief_text = "\n\n".join(
+            f"[Page {page_num + 1}]\n{text.strip()}"
+            for page_num, (text, is_scanned) in enumerate(pages)
+            if not is_scanned and text.strip()
+        )
+    blocks = [{
+        "type": "text",
+        "text": f"=== BRIEF: {brief_description} ===\n\n" + brief_text
+    }]
+    if scanned_pages:
+        pages_list = ", ".join(str(page_num + 1) for page_num in scanned_pages)
+        blocks.append({
+            "type": "text",
+            "text": f"The scanned pages of {brief_description} (pages {pages_list}) follow as a PDF:"
+        })
+        blocks.append(pdf_pages_document_block(brief_path, scanned_pages))
+    return blocks
+
+def brief_content_blocks(brief_path, brief_description, max_pages=None):
+    """Content blocks carrying one brief (PDF, or text-first when enabled); None if it couldn't be prepared"""
+    if TEXT_FIRST_ANALYSIS:
+        try:
+            return text_first_brief_blocks(brief_path, brief_description, max_pages)
+        except Exception as e:
+            print(f"    ⚠️  Text extraction failed for {brief_description}, sending PDF: {e}")
+    
+    block = pdf_document_block(brief_path, max_pages)
+    return [block] if block else None
+
+def mark_brief_cache_breakpoints(brief_block_groups):
+    """
+    Join the briefs' content blocks, adding cache breakpoints after the first and the
+    last brief so retries and prior-issues follow-ups reuse the whole batch prefix and
+    the individual fallback reuses the first brief's.
+    """
+    content = []
+    last_group = len(brief_block_groups) - 1
+    for group_index, blocks in enumerate(brief_block_groups):
+        blocks = list(blocks)
+        if group_index in (0, last_group):
+            blocks[-1] = cache_breakpoint(blocks[-1])
+        content.extend(blocks)
+    return content
+
+def build_briefs_request(brief_paths_and_descriptions, case_number, prior_issues=None):
+    """Build the Messages API request analyzing several brief PDFs together (None if no brief could be read)"""
+    # Prepare content blocks for all briefs
+    brief_block_groups = []
+    brief_descriptions = []
+    
+    # Reference (or read) all briefs and add them to content. A brief sent on its own
+    # (e.g. an oversized brief in a follow-up batch) is cut to the page limit first.
+    single_brief = len(brief_paths_and_descriptions) == 1
+    for brief_path, brief_description in brief_paths_and_descriptions:
+        try:
+            if single_brief:
+                blocks = page_limited_brief_blocks(brief_path, brief_description)
+            else:
+                blocks = brief_content_blocks(brief_path, brief_description)
+        except Exception as e:
+            print(f"    ⚠️  Error reading {brief_path}: {e}")
+            continue
+        if blocks:
+            brief_block_groups.append(blocks)
+            brief_descriptions.append(brief_description)
+    
+    if not brief_block_groups:
+        return None
+    
+    content = mark_brief_cache_breakpoints(brief_block_groups)
+    
+    # Create the analysis prompt
+    brief_list = "\n".join([f"- {desc}" for desc in brief_descriptions])
+    
+    # Build prompt based on whether we have prior issues
+    if prior_issues and len(prior_issues) > 0:
+        # Format prior issues for Claude
+        prior_issues_text = "\n".join([
+            f"- {issue.get('legal_area', 'General')}: {issue.get('description', 'No description')}"
+            for issue in prior_issues
+        ])
         
-        # Build prompt based on whether we have prior issues
-        if prior_issues and len(prior_issues) > 0:
-            # Format prior issues for Claude
-            prior_issues_text = "\n".join([
-                f"- {issue.get('legal_area', 'General')}: {issue.get('description', 'No description')}"
-                for issue in prior_issues
-            ])
-            
-            prompt_text = f"""You are a legal expert analyzing criminal appellate briefs from Texas courts. 
+        prompt_text = f"""You are a legal expert analyzing criminal appellate briefs from Texas courts. 
 
 CONTEXT: I have already analyzed some briefs for case {case_number} and identified the following legal issues:
 
@@ -1366,21 +2764,10 @@ For each NEW or CHANGED issue, provide:
 3. Which brief(s) raised this issue
 4. Whether this is "new" or "expanded" (if it adds detail to an existing issue)
 
-Focus on substantive legal arguments, not procedural matters. Return your analysis in JSON format:
-
-{{
-  "issues": [
-    {{
-      "description": "Brief description of the legal issue",
-      "legal_area": "Specific area of law",
-      "source_briefs": ["brief description 1", "brief description 2"],
-      "status": "new" or "expanded"
-    }}
-  ]
-}}"""
-        else:
-            # First batch - analyze normally
-            prompt_text = f"""You are a legal expert analyzing criminal appellate briefs from Texas courts. Please analyze ALL the briefs provided for case {case_number} and identify the distinct legal issues raised across all briefs.
+Focus on substantive legal arguments, not procedural matters. Record only the new or expanded issues, each with its source_briefs and status, using the record_legal_issues tool (use an empty issues list when there are none)."""
+    else:
+        # First batch - analyze normally
+        prompt_text = f"""You are a legal expert analyzing criminal appellate briefs from Texas courts. Please analyze ALL the briefs provided for case {case_number} and identify the distinct legal issues raised across all briefs.
 
 The briefs included are:
 {brief_list}
@@ -1390,67 +2777,580 @@ For each legal issue, provide:
 2. The specific legal area (e.g., "Fourth Amendment Search and Seizure", "Ineffective Assistance of Counsel", "Sufficiency of Evidence", etc.)
 3. Which brief(s) raised this issue
 
-Focus on substantive legal arguments, not procedural matters. Consolidate similar issues from different briefs. Return your analysis in JSON format with an array of issues:
+Focus on substantive legal arguments, not procedural matters. Consolidate similar issues from different briefs. Record the issues, each with its source_briefs, using the record_legal_issues tool (use an empty issues list when the briefs raise none)."""
+    
+    content.append({
+        "type": "text",
+        "text": prompt_text
+    })
+    
+    return {
+        "model": ANALYSIS_MODEL,
+        "max_tokens": 4000,
+        "system": analysis_system_prompt(),
+        "tools": [ISSUES_TOOL],
+        "tool_choice": ISSUES_TOOL_CHOICE,
+        "messages": [
+            {
+                "role": "user",
+                "content": content
+            }
+        ]
+    }
 
-{{
-  "issues": [
-    {{
-      "description": "Brief description of the legal issue",
-      "legal_area": "Specific area of law",
-      "source_briefs": ["brief description 1", "brief description 2"]
-    }}
-  ]
-}}"""
-        
-        content.append({
-            "type": "text",
-            "text": prompt_text
-        })
+def new_rate_limit_state():
+    """Fresh rate limit scheduler state (limits are learned from the API's response headers)"""
+    return {
+        'requests_remaining': None,
+        'requests_reset': 0.0,
+        'tokens_remaining': None,
+        'tokens_reset': 0.0,
+        'blocked_until': 0.0,
+        'reserved_tokens': 0,
+        'requests_sent': 0,
+        'rate_limited': 0,
+        'retries': 0,
+        'wait_seconds': 0.0
+    }
+
+RATE_LIMIT_STATE = new_rate_limit_state()
+
+def parse_rate_limit_reset(value):
+    """Convert an anthropic-ratelimit-*-reset header (RFC 3339) to epoch seconds"""
+    if not value:
+        return 0.0
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+    except ValueError:
+        return 0.0
+
+def update_rate_limits(headers, state=None):
+    """Record the remaining request/token allowance reported by the API"""
+    if state is None:
+        state = RATE_LIMIT_STATE
+    if headers is None:
+        return
+    
+    requests_remaining = headers.get('anthropic-ratelimit-requests-remaining')
+    if requests_remaining is not None:
+        state['requests_remaining'] = int(requests_remaining)
+        state['requests_reset'] = parse_rate_limit_reset(headers.get('anthropic-ratelimit-requests-reset'))
+    
+    tokens_remaining = headers.get('anthropic-ratelimit-input-tokens-remaining')
+    if tokens_remaining is not None:
+        state['tokens_remaining'] = int(tokens_remaining)
+        state['tokens_reset'] = parse_rate_limit_reset(headers.get('anthropic-ratelimit-input-tokens-reset'))
+
+def rate_limit_backoff_seconds(attempt, retry_after=None):
+    """Delay before a retry: the server's retry-after if given, else jittered exponential backoff"""
+    if retry_after:
+        try:
+            return float(retry_after) + random.uniform(0, 1)
+        except ValueError:
+            pass
+    delay = min(RATE_LIMIT_MAX_BACKOFF, RATE_LIMIT_BASE_BACKOFF * (2 ** attempt))
+    # Full jitter keeps concurrent cases from retrying in lockstep
+    return random.uniform(delay / 2, delay)
+
+def rate_limit_admission_delay(estimated_tokens, state, now):
+    """Seconds to wait before a request of estimated_tokens may be sent (0 if it can go now)"""
+    if state['blocked_until'] > now:
+        return state['blocked_until'] - now
+    
+    if state['requests_remaining'] is not None and state['requests_remaining'] <= 0 and state['requests_reset'] > now:
+        return state['requests_reset'] - now
+    
+    if state['tokens_remaining'] is not None and state['tokens_reset'] > now:
+        available = state['tokens_remaining'] - state['reserved_tokens']
+        # A request larger than the whole allowance is still admitted once nothing else is in flight
+        if available < estimated_tokens and state['reserved_tokens'] > 0:
+            return state['tokens_reset'] - now
+    
+    return 0
+
+async def acquire_rate_limit(estimated_tokens, state=None):
+    """Wait until the request and token budget admit a request, then reserve its tokens"""
+    if state is None:
+        state = RATE_LIMIT_STATE
+    while True:
+        delay = rate_limit_admission_delay(estimated_tokens, state, time.time())
+        if delay <= 0:
+            break
+        state['wait_seconds'] += delay
+        await asyncio.sleep(delay)
+    
+    state['reserved_tokens'] += estimated_tokens
+    if state['requests_remaining'] is not None:
+        state['requests_remaining'] -= 1
+    state['requests_sent'] += 1
+
+def release_rate_limit(estimated_tokens, state=None):
+    """Return a request's reserved tokens once the API has answered"""
+    if state is None:
+        state = RATE_LIMIT_STATE
+    state['reserved_tokens'] = max(0, state['reserved_tokens'] - estimated_tokens)
+
+def estimate_pdf_block_tokens(block):
+    """Rough input tokens for a PDF document block (base64 or uploaded file)"""
+    if block['source'].get('type') == 'file':
+        uploaded = UPLOADED_FILES.get(block['source']['file_id'], {})
+        if 'tokens' in uploaded:
+            return uploaded['tokens']
+        return estimate_brief_tokens(max(1, uploaded.get('pages', 1)))
+    
+    import base64
+    pdf_bytes = base64.b64decode(block['source']['data'])
+    page_count = max(1, len(re.findall(rb'/Type\s*/Page(?!s)', pdf_bytes)))
+    return estimate_brief_tokens(page_count)
+
+def estimate_request_tokens(request):
+    """Rough input tokens for a Messages API request, used to admit it against the token budget"""
+    total = 0
+    for message in request.get('messages', []):
+        content = message['content']
+        if isinstance(content, str):
+            total += estimate_tokens(content)
+            continue
+        for block in content:
+            if block.get('type') == 'text':
+                total += estimate_tokens(block['text'])
+            elif block.get('type') == 'document':
+                total += estimate_pdf_block_tokens(block)
+    return total
+
+async def send_claude_request(client, request, case_number, state=None):
+    """
+    Send a Messages API request through the rate limit scheduler. Rate limits, overloaded
+    servers and dropped connections are retried; the last error is raised if the API keeps
+    failing after RATE_LIMIT_MAX_RETRIES retries.
+    """
+    if state is None:
+        state = RATE_LIMIT_STATE
+    estimated_tokens = await asyncio.to_thread(estimate_request_tokens, request)
+    
+    for attempt in range(RATE_LIMIT_MAX_RETRIES + 1):
+        await acquire_rate_limit(estimated_tokens, state)
+        try:
+            with ANALYSIS_GATEWAY.timed('messages.create', case_number):
+                raw_response = await client.messages.with_raw_response.create(**request, **files_api_request_options(request))
+                update_rate_limits(raw_response.headers, state)
+                message = await raw_response.parse()
+            record_claude_usage(message, case_number)
+            return message
+        except anthropic.APIError as e:
+            error_kind = ANALYSIS_GATEWAY.classify_error(e)
+            if error_kind == 'not_found':
+                # An uploaded brief was deleted or expired - re-upload it on the next attempt
+                forget_uploaded_files(request)
+            if error_kind not in ('rate_limited', 'retryable'):
+                raise
+            
+            response = getattr(e, 'response', None)
+            headers = response.headers if response is not None else None
+            update_rate_limits(headers, state)
+            if attempt >= RATE_LIMIT_MAX_RETRIES:
+                raise
+            
+            delay = rate_limit_backoff_seconds(attempt, headers.get('retry-after') if headers is not None else None)
+            if error_kind == 'rate_limited':
+                state['rate_limited'] += 1
+                # Hold every request, not just this one - the limit is account-wide
+                state['blocked_until'] = max(state['blocked_until'], time.time() + delay)
+                print(f"    🛑 Rate limited on {case_number}, retrying in {delay:.1f}s (attempt {attempt + 1}/{RATE_LIMIT_MAX_RETRIES})")
+            else:
+                print(f"    ⚠️  API unavailable on {case_number} ({type(e).__name__}), retrying in {delay:.1f}s (attempt {attempt + 1}/{RATE_LIMIT_MAX_RETRIES})")
+            state['retries'] += 1
+            state['wait_seconds'] += delay
+            await asyncio.sleep(delay)
+        finally:
+            release_rate_limit(estimated_tokens, state)
+
+CLAUDE_CALL_USAGE = []
+
+# What the current analysis step is working on (purpose, batch, briefs...); every call
+# recorded while it is set is tagged with it. Each asyncio task sees its own value.
+CLAUDE_USAGE_TAGS = contextvars.ContextVar('claude_usage_tags', default={})
+ANALYSIS_BUDGET_STATE = {'reached': False}
+
+def model_pricing(model):
+    """(input, output) USD per million tokens for a model"""
+    for model_prefix, pricing in MODEL_PRICING_USD_PER_MTOK.items():
+        if model and model.startswith(model_prefix):
+            return pricing
+    return DEFAULT_MODEL_PRICING
+
+def claude_call_cost(call_usage):
+    """USD cost of one recorded call"""
+    input_price, output_price = model_pricing(call_usage['model'])
+    cost = (call_usage['input_tokens'] * input_price
+            + call_usage['cache_creation_input_tokens'] * input_price * CACHE_WRITE_PRICE_MULTIPLIER
+            + call_usage['cache_read_input_tokens'] * input_price * CACHE_READ_PRICE_MULTIPLIER
+            + call_usage['output_tokens'] * output_price) / 1_000_000
+    if call_usage.get('batch_api'):
+        cost *= BATCH_PRICE_MULTIPLIER
+    return cost
+
+def record_claude_usage(message, case_number, tags=None):
+    """Record a response's token usage (including prompt cache reads and writes) and cost in the run's ledger"""
+    usage = message.usage
+    call_usage = {
+        'case_number': case_number,
+        'at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'model': message.model,
+        'input_tokens': usage.input_tokens,
+        'output_tokens': usage.output_tokens,
+        'cache_creation_input_tokens': getattr(usage, 'cache_creation_input_tokens', None) or 0,
+        'cache_read_input_tokens': getattr(usage, 'cache_read_input_tokens', None) or 0
+    }
+    call_usage.update(CLAUDE_USAGE_TAGS.get())
+    call_usage.update(tags or {})
+    call_usage['cost_usd'] = round(claude_call_cost(call_usage), 6)
+    CLAUDE_CALL_USAGE.append(call_usage)
+    return call_usage
+
+def claude_run_cost():
+    """USD spent on Claude calls so far this run"""
+    return sum(call['cost_usd'] for call in CLAUDE_CALL_USAGE)
+
+def analysis_budget_reached():
+    """True once this run has spent ANALYSIS_BUDGET_USD (announced the first time)"""
+    if ANALYSIS_BUDGET_USD is None or claude_run_cost() < ANALYSIS_BUDGET_USD:
+        return False
+    if not ANALYSIS_BUDGET_STATE['reached']:
+        ANALYSIS_BUDGET_STATE['reached'] = True
+        print(f"💸 Analysis budget of ${ANALYSIS_BUDGET_USD:.2f} reached (${claude_run_cost():.2f} spent) - "
+              f"not starting new requests; remaining briefs stay pending for the next run")
+    return True
+
+def add_usage_to_cases(cases):
+    """
+    Append this run's recorded calls to each case's analysis_usage ledger and update its
+    analysis_cost_usd. A call shared by several cases (a packed request) is split evenly.
+    """
+    cases_by_number = {case['case_number']: case for case in cases}
+    for call_usage in CLAUDE_CALL_USAGE:
+        if call_usage.get('ledgered'):
+            continue
+        case_numbers = call_usage.get('case_numbers') or [call_usage['case_number']]
+        for case_number in case_numbers:
+            case = cases_by_number.get(case_number)
+            if case is None:
+                continue
+            entry = {key: value for key, value in call_usage.items() if key not in ('case_number', 'case_numbers')}
+            if len(case_numbers) > 1:
+                entry['cost_usd'] = round(call_usage['cost_usd'] / len(case_numbers), 6)
+                entry['shared_with'] = len(case_numbers)
+            case.setdefault('analysis_usage', []).append(entry)
+            case['analysis_cost_usd'] = round(sum(call['cost_usd'] for call in case['analysis_usage']), 6)
+        call_usage['ledgered'] = True
+
+def claude_usage_summary_lines(all_case_details=None):
+    """Summary lines for this run's Claude usage by model and purpose (plus all-time cost from the case store)"""
+    lines = []
+    if CLAUDE_CALL_USAGE:
+        totals = {field: sum(call[field] for call in CLAUDE_CALL_USAGE)
+                  for field in ('input_tokens', 'output_tokens', 'cache_creation_input_tokens', 'cache_read_input_tokens')}
+        budget = f" of ${ANALYSIS_BUDGET_USD:.2f} budget" if ANALYSIS_BUDGET_USD is not None else ""
+        lines.append(f"Claude Calls This Run: {len(CLAUDE_CALL_USAGE)} (${claude_run_cost():.4f}{budget})")
+        lines.append(f"  Tokens: {totals['input_tokens']:,} input, {totals['output_tokens']:,} output, "
+                     f"{totals['cache_creation_input_tokens']:,} cache write, {totals['cache_read_input_tokens']:,} cache read")
+        for field, label in (('model', 'Model'), ('purpose', 'Purpose')):
+            groups = {}
+            for call in CLAUDE_CALL_USAGE:
+                group = groups.setdefault(call.get(field) or 'analysis', [0, 0.0])
+                group[0] += 1
+                group[1] += call['cost_usd']
+            for name, (calls, cost) in sorted(groups.items()):
+                lines.append(f"  {label} {name}: {calls} call(s), ${cost:.4f}")
+    if all_case_details:
+        total_cost = sum(case.get('analysis_cost_usd', 0) for case in all_case_details)
+        lines.append(f"Claude Analysis Cost To Date (all runs): ${total_cost:.4f}")
+    return lines
+
+def print_prompt_cache_metrics():
+    """Print how much input was written to and read from the prompt cache"""
+    if not CLAUDE_CALL_USAGE:
+        return
+    uncached = sum(call['input_tokens'] for call in CLAUDE_CALL_USAGE)
+    written = sum(call['cache_creation_input_tokens'] for call in CLAUDE_CALL_USAGE)
+    read = sum(call['cache_read_input_tokens'] for call in CLAUDE_CALL_USAGE)
+    hits = sum(1 for call in CLAUDE_CALL_USAGE if call['cache_read_input_tokens'])
+    print(f"🗄️  Prompt cache: {hits}/{len(CLAUDE_CALL_USAGE)} calls hit, {read:,} tokens read, "
+          f"{written:,} written, {uncached:,} uncached input tokens")
+
+def print_rate_limit_metrics(state=None):
+    """Print how much the rate limit scheduler had to hold requests back"""
+    if state is None:
+        state = RATE_LIMIT_STATE
+    print(f"📈 Claude requests: {state['requests_sent']} sent, {state['rate_limited']} rate limited, "
+          f"{state['retries']} retried, {state['wait_seconds']:.1f}s waiting")
+
+def analysis_cache_key(request):
+    """SHA-256 of a Messages API request and PROMPT_VERSION (uploaded briefs count by content, not file_id)"""
+    def content_key(value):
+        if isinstance(value, dict):
+            if value.get('type') == 'file' and value.get('file_id') in UPLOADED_FILES:
+                return {'type': 'file', 'sha256': UPLOADED_FILES[value['file_id']]['sha256']}
+            return {key: content_key(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [content_key(item) for item in value]
+        return value
+    
+    digest = hashlib.sha256()
+    digest.update(f"prompt-v{PROMPT_VERSION}\n".encode('utf-8'))
+    digest.update(json.dumps(content_key(request), sort_keys=True).encode('utf-8'))
+    return digest.hexdigest()
+
+def analysis_cache_path(cache_key):
+    """Path of the cache entry for a request key"""
+    return os.path.join(ANALYSIS_CACHE_FOLDER, f"{cache_key}.json")
+
+def load_cached_analysis(cache_key):
+    """Return the cached {'response_text', 'issues', ...} entry for a request key, or None"""
+    cache_path = analysis_cache_path(cache_key)
+    if not os.path.exists(cache_path):
+        return None
+    try:
+        with open(cache_path, 'r') as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+    # Touch the entry so eviction drops the least recently used first
+    try:
+        os.utime(cache_path)
+    except OSError:
+        pass
+    return entry
+
+def evict_analysis_cache(max_bytes=None):
+    """Delete the least recently used cache entries until the cache fits in max_bytes"""
+    if max_bytes is None:
+        max_bytes = ANALYSIS_CACHE_MAX_BYTES
+    
+    entries = []
+    total_bytes = 0
+    for entry in os.scandir(ANALYSIS_CACHE_FOLDER):
+        if entry.is_file() and entry.name.endswith('.json'):
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total_bytes += stat.st_size
+    
+    if total_bytes <= max_bytes:
+        return
+    
+    for _, size, path in sorted(entries):
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total_bytes -= size
+        if total_bytes <= max_bytes:
+            break
+
+def store_cached_analysis(cache_key, request, response_text, issues, case_number):
+    """Save a Claude response and its parsed issues under a request key"""
+    os.makedirs(ANALYSIS_CACHE_FOLDER, exist_ok=True)
+    entry = {
+        'case_number': case_number,
+        'prompt_version': PROMPT_VERSION,
+        'model': request.get('model'),
+        'max_tokens': request.get('max_tokens'),
+        'cached_at': datetime.now().isoformat(),
+        'response_text': response_text,
+        'issues': issues
+    }
+    cache_path = analysis_cache_path(cache_key)
+    temp_path = f"{cache_path}.tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(entry, f, indent=2)
+    os.replace(temp_path, cache_path)
+    evict_analysis_cache()
+
+def issue_schema_problems(issue):
+    """List how an issue entry breaks ISSUES_TOOL's schema (empty if it's valid)"""
+    if not isinstance(issue, dict):
+        return ["entry is not an object"]
+    problems = []
+    for field in ('description', 'legal_area'):
+        if not isinstance(issue.get(field), str) or not issue.get(field).strip():
+            problems.append(f"'{field}' must be a non-empty string")
+    source_briefs = issue.get('source_briefs')
+    if source_briefs is not None and not (isinstance(source_briefs, list) and all(isinstance(brief, str) for brief in source_briefs)):
+        problems.append("'source_briefs' must be a list of strings")
+    status = issue.get('status')
+    if status is not None and status not in ISSUE_STATUSES:
+        problems.append(f"'status' must be one of {', '.join(ISSUE_STATUSES)}")
+    return problems
+
+def validate_issues_payload(payload):
+    """Split a record_legal_issues payload into (valid issues, [(invalid issue, problems)])"""
+    issues = payload.get('issues') if isinstance(payload, dict) else None
+    if not isinstance(issues, list):
+        return [], [(payload, ["payload must be an object with an 'issues' array"])]
+    
+    valid = []
+    invalid = []
+    for issue in issues:
+        problems = issue_schema_problems(issue)
+        if problems:
+            invalid.append((issue, problems))
+        else:
+            valid.append(issue)
+    return valid, invalid
+
+def issues_from_message(message, case_number):
+    """
+    Pull the issues out of an analysis response. Returns (valid issues, invalid entries,
+    raw response text); valid issues is None when the reply didn't call the tool.
+    """
+    for block in message.content:
+        if block.type == 'tool_use' and block.name == ISSUES_TOOL['name']:
+            valid, invalid = validate_issues_payload(block.input)
+            return valid, invalid, json.dumps(block.input)
+    
+    response_text = "".join(block.text for block in message.content if block.type == 'text')
+    print(f"    ⚠️  Response for {case_number} didn't record its issues with the tool: {response_text[:200]}")
+    return None, [], response_text
+
+def build_issue_repair_request(invalid, case_number):
+    """Build a small request asking Claude to fix only the schema-invalid issue entries"""
+    entries = json.dumps([issue for issue, _ in invalid], indent=2)
+    problems = "\n".join(
+        f"- Entry {position}: {'; '.join(entry_problems)}"
+        for position, (_, entry_problems) in enumerate(invalid, 1)
+    )
+    return {
+        "model": ANALYSIS_MODEL,
+        "max_tokens": 2000,
+        "system": analysis_system_prompt(),
+        "tools": [ISSUES_TOOL],
+        "tool_choice": ISSUES_TOOL_CHOICE,
+        "messages": [
+            {
+                "role": "user",
+                "content": f"""These legal issue entries for case {case_number} don't match the required format:
+
+{entries}
+
+Problems:
+{problems}
+
+Record the corrected entries with the record_legal_issues tool. Fix only the listed problems and keep each issue's meaning."""
+            }
+        ]
+    }
+
+async def repair_issue_entries_async(client, invalid, case_number):
+    """Ask Claude to fix schema-invalid issue entries; returns the entries that come back valid"""
+    print(f"    🔧 Repairing {len(invalid)} malformed issue(s) for {case_number}")
+    usage_tags = CLAUDE_USAGE_TAGS.set({**CLAUDE_USAGE_TAGS.get(), 'purpose': 'repair'})
+    try:
+        message, _ = await send_until_complete(client, build_issue_repair_request(invalid, case_number), case_number)
+    except Exception as e:
+        print(f"    ⚠️  Issue repair failed for {case_number}: {e}")
+        return []
+    finally:
+        CLAUDE_USAGE_TAGS.reset(usage_tags)
+    
+    if message is None:
+        print(f"    ⚠️  Dropping {len(invalid)} issue(s) for {case_number} that couldn't be repaired")
+        return []
+    repaired, still_invalid, _ = issues_from_message(message, case_number)
+    if repaired is None:
+        print(f"    ⚠️  Dropping {len(invalid)} issue(s) for {case_number} that couldn't be repaired")
+        return []
+    if still_invalid:
+        print(f"    ⚠️  Dropping {len(still_invalid)} issue(s) for {case_number} that couldn't be repaired")
+    return repaired
+
+async def send_until_complete(client, request, case_number):
+    """
+    Send a request, doubling max_tokens (up to ANALYSIS_MAX_OUTPUT_TOKENS) while the response
+    is cut off. Returns (message, request sent); message is None if the response never fit.
+    """
+    message = await send_claude_request(client, request, case_number)
+    while message.stop_reason == 'max_tokens':
+        if request['max_tokens'] >= ANALYSIS_MAX_OUTPUT_TOKENS:
+            print(f"    ✂️  Response for {case_number} still cut off at {request['max_tokens']} output tokens")
+            return None, request
+        request = {**request, 'max_tokens': min(request['max_tokens'] * 2, ANALYSIS_MAX_OUTPUT_TOKENS)}
+        print(f"    ✂️  Response for {case_number} cut off, retrying with max_tokens={request['max_tokens']}")
+        message = await send_claude_request(client, request, case_number)
+    return message, request
+
+async def request_issues_from_claude(client, request, case_number):
+    """
+    Send an analysis request (or reuse its cached response) and return the parsed issues;
+    None if the response was cut off even at ANALYSIS_MAX_OUTPUT_TOKENS or didn't call the tool
+    """
+    cache_key = await asyncio.to_thread(analysis_cache_key, request)
+    cached = load_cached_analysis(cache_key)
+    if cached is not None:
+        print(f"    💾 Using cached analysis for {case_number}")
+        return cached['issues']
+    
+    message, request = await send_until_complete(client, request, case_number)
+    if message is None:
+        return None  # A partial answer is neither cached nor recorded
+    
+    issues, invalid, response_text = issues_from_message(message, case_number)
+    if issues is None:
+        return None  # Retried like any other failed request
+    if invalid:
+        issues = issues + await repair_issue_entries_async(client, invalid, case_number)
+    
+    store_cached_analysis(cache_key, request, response_text, issues, case_number)
+    return issues
+
+def run_with_async_client(analysis_function, *args):
+    """Run an async analysis function to completion with the analysis gateway's AsyncAnthropic client"""
+    if not ANALYSIS_GATEWAY.api_key:
+        print("❌ ANTHROPIC_API_KEY not found in .env file")
+        return []
+    
+    return ANALYSIS_GATEWAY.run(analysis_function, *args)
+
+async def analyze_briefs_with_claude_async(client, brief_paths_and_descriptions, case_number, prior_issues=None):
+    """Analyze multiple legal brief PDFs with Claude to extract legal issues"""
+    try:
+        # Reading and encoding PDFs is blocking work - keep it off the event loop
+        request = await asyncio.to_thread(build_briefs_request, brief_paths_and_descriptions, case_number, prior_issues)
+        if request is None:
+            print(f"    ⚠️  No valid briefs to analyze for {case_number}")
+            return []
         
         # Create message with all PDF attachments
-        message = client.messages.create(
-            model="claude-3-5-sonnet-20241022",
-            max_tokens=4000,
-            messages=[
-                {
-                    "role": "user",
-                    "content": content
-                }
-            ]
-        )
-        
-        response_text = message.content[0].text
-        
-        # Parse JSON response using enhanced parser
-        return parse_claude_json_response(response_text, case_number)
+        issues = await request_issues_from_claude(client, request, case_number)
+        if issues is None and len(brief_paths_and_descriptions) > 1:
+            print(f"    🔄 No usable response for the batch, will try individual briefs...")
+            return "PROCESS_INDIVIDUALLY"
+        return issues
             
     except Exception as e:
-        error_msg = str(e)
-        print(f"    ⚠️  Error analyzing briefs with Claude for {case_number}: {error_msg}")
-        
-        # Check if it's a rate limit error
-        if "429" in error_msg or "rate_limit_error" in error_msg.lower() or "rate limit" in error_msg.lower():
-            print(f"    🛑 Rate limit exceeded for {case_number}. Backing off...")
-            import time
-            # Wait 60 seconds before retrying
-            print(f"    ⏰ Waiting 60 seconds before continuing...")
-            time.sleep(60)
-            print(f"    🔄 Resuming analysis after rate limit backoff...")
+        error_kind = ANALYSIS_GATEWAY.classify_error(e)
+        if error_kind == 'rate_limited':
+            print(f"    🛑 Still rate limited for {case_number} after {RATE_LIMIT_MAX_RETRIES} retries")
             return None  # Signal to retry or skip for now
+        print(f"    ⚠️  Error analyzing briefs with Claude for {case_number}: {e}")
         
-        # Check if it's a PDF processing error
-        if "could not process pdf" in error_msg.lower() or "pdf" in error_msg.lower():
+        # A brief the API (or PyPDF2) couldn't process
+        if error_kind in ('pdf', 'local'):
             print(f"    🔄 PDF processing error for batch, will try individual briefs...")
             return "PROCESS_INDIVIDUALLY"  # Signal to process briefs individually
         
-        # Check if it's a size limit error (various error messages)
-        size_limit_keywords = ["too large", "limit", "size", "100 pdf pages", "maximum", "exceeded"]
-        if any(keyword in error_msg.lower() for keyword in size_limit_keywords):
+        if error_kind == 'too_large':
             print(f"    🔄 Input too large, falling back to smaller groups...")
             return None  # Signal to fallback to smaller processing
         
+        if error_kind in ('retryable', 'not_found'):
+            return None  # Signal to retry (expired uploads are re-uploaded)
+        
         return []
 
+def analyze_briefs_with_claude(brief_paths_and_descriptions, case_number, prior_issues=None):
+    """Analyze multiple legal brief PDFs with Claude to extract legal issues"""
+    return run_with_async_client(analyze_briefs_with_claude_async, brief_paths_and_descriptions, case_number, prior_issues)
+
 def estimate_tokens(text):
     """Rough token estimation: ~1.3 tokens per word"""
     words = len(text.split())
@@ -1458,7 +3358,7 @@ def estimate_tokens(text):
 
 def truncate_text_to_tokens(text, max_tokens=40000):
     """Truncate text to stay within token limit"""
-    estimated_tokens = estimate_tokens(text)
+    estimated_tokens = count_text_tokens(text)
     
     if estimated_tokens <= max_tokens:
         return text
@@ -1473,323 +3373,1044 @@ def truncate_text_to_tokens(text, max_tokens=40000):
     if last_space > 0:
         truncated = truncated[:last_space]
     
-    print(f"    ✂️  Truncated text from ~{estimated_tokens} to ~{estimate_tokens(truncated)} tokens")
+    # Scale the count we already have rather than counting the truncated text again
+    print(f"    ✂️  Truncated text from ~{estimated_tokens} to ~{round(estimated_tokens * len(truncated) / len(text))} tokens")
     return truncated
 
-def analyze_brief_text_with_claude(text_content, case_number, brief_description):
+def build_brief_text_request(text_content, case_number, brief_description):
+    """Build the Messages API request analyzing a brief's extracted text"""
+    # Truncate text to fit within token limits
+    truncated_text = truncate_text_to_tokens(text_content, max_tokens=40000)
+    
+    return {
+        "model": ANALYSIS_MODEL,
+        "max_tokens": 4000,
+        "system": analysis_system_prompt(),
+        "tools": [ISSUES_TOOL],
+        "tool_choice": ISSUES_TOOL_CHOICE,
+        "messages": [
+            {
+                "role": "user",
+                "content": [
+                    # Brief text first so retries reuse it from the prompt cache
+                    cache_breakpoint({
+                        "type": "text",
+                        "text": f"BRIEF TEXT:\n{truncated_text}"
+                    }),
+                    {
+                        "type": "text",
+                        "text": f"""You are a legal expert analyzing a criminal appellate brief from Texas courts. Please analyze the brief text above from case {case_number} ({brief_description}) and identify the distinct legal issues raised.
+
+For each legal issue, provide:
+1. A concise description of the issue (1-2 sentences)
+2. The specific legal area (e.g., "Fourth Amendment Search and Seizure", "Ineffective Assistance of Counsel", "Sufficiency of Evidence", etc.)
+
+Focus on substantive legal arguments, not procedural matters. Record the issues using the record_legal_issues tool (use an empty issues list when the brief raises none)."""
+                    }
+                ]
+            }
+        ]
+    }
+
+async def analyze_brief_text_with_claude_async(client, text_content, case_number, brief_description):
     """Analyze extracted text from a legal brief with Claude"""
     try:
-        # Get API key from environment variable
-        api_key = os.getenv('ANTHROPIC_API_KEY')
-        if not api_key:
-            print("❌ ANTHROPIC_API_KEY not found in .env file")
-            return []
-        
-        client = anthropic.Anthropic(api_key=api_key)
-        
-        # Truncate text to fit within token limits
-        truncated_text = truncate_text_to_tokens(text_content, max_tokens=40000)
+        # Counting the text's tokens is a blocking API call - keep it off the event loop
+        request = await asyncio.to_thread(build_brief_text_request, text_content, case_number, brief_description)
         
         # Create message with text content
-        message = client.messages.create(
-            model="claude-3-5-sonnet-20241022",
-            max_tokens=4000,
-            messages=[
-                {
-                    "role": "user",
-                    "content": f"""You are a legal expert analyzing a criminal appellate brief from Texas courts. Please analyze this brief text from case {case_number} ({brief_description}) and identify the distinct legal issues raised.
+        return await request_issues_from_claude(client, request, case_number)
+            
+    except Exception as e:
+        error_kind = ANALYSIS_GATEWAY.classify_error(e)
+        if error_kind == 'rate_limited':
+            print(f"    🛑 Still rate limited for {case_number} after {RATE_LIMIT_MAX_RETRIES} retries")
+            return None  # Signal to retry or skip for now
+        print(f"    ⚠️  Error analyzing brief text with Claude for {case_number}: {e}")
+        
+        if error_kind == 'retryable':
+            return None
+        return []
+
+def analyze_brief_text_with_claude(text_content, case_number, brief_description):
+    """Analyze extracted text from a legal brief with Claude"""
+    return run_with_async_client(analyze_brief_text_with_claude_async, text_content, case_number, brief_description)
+
+def page_limited_brief_blocks(brief_path, brief_description):
+    """Content blocks for a brief analyzed on its own, cut down to the page/token limit if needed (None on failure)"""
+    # Check if PDF is too large and truncate if necessary
+    page_count = count_pdf_pages(brief_path)
+    page_limit = brief_page_limit(brief_path, page_count)
+    if page_count <= page_limit:
+        return brief_content_blocks(brief_path, brief_description)
+    
+    sections = brief_sections(brief_path) if SECTION_BRIEFS and not TEXT_FIRST_ANALYSIS else None
+    if sections and len(sections[1]) <= page_limit:
+        # Send the pages holding the argument sections instead of the first page_limit pages
+        print(f"    📑 PDF has {page_count} pages, sending the {len(sections[1])} page(s) with argument sections")
+        return [pdf_pages_document_block(brief_path, sections[1])]
+    print(f"    ✂️  PDF has {page_count} pages, truncating to first {page_limit} pages")
+    return brief_content_blocks(brief_path, brief_description, page_limit)
 
-BRIEF TEXT:
-{truncated_text}  
+def build_brief_request(brief_path, case_number, brief_description):
+    """Build the Messages API request analyzing a single brief PDF (None if the PDF couldn't be truncated)"""
+    brief_blocks = page_limited_brief_blocks(brief_path, brief_description)
+    if brief_blocks is None:
+        return None
+    
+    return {
+        "model": ANALYSIS_MODEL,
+        "max_tokens": 4000,
+        "system": analysis_system_prompt(),
+        "tools": [ISSUES_TOOL],
+        "tool_choice": ISSUES_TOOL_CHOICE,
+        "messages": [
+            {
+                "role": "user",
+                "content": mark_brief_cache_breakpoints([brief_blocks]) + [
+                    {
+                        "type": "text",
+                        "text": f"""You are a legal expert analyzing a criminal appellate brief from Texas courts. Please analyze this brief from case {case_number} ({brief_description}) and identify the distinct legal issues raised.
 
 For each legal issue, provide:
 1. A concise description of the issue (1-2 sentences)
 2. The specific legal area (e.g., "Fourth Amendment Search and Seizure", "Ineffective Assistance of Counsel", "Sufficiency of Evidence", etc.)
 
-Focus on substantive legal arguments, not procedural matters. Return your analysis in JSON format with an array of issues:
+Focus on substantive legal arguments, not procedural matters. Record the issues using the record_legal_issues tool (use an empty issues list when the brief raises none)."""
+                    }
+                ]
+            }
+        ]
+    }
 
-{{
-  "issues": [
-    {{
-      "description": "Brief description of the legal issue",
-      "legal_area": "Specific area of law"
-    }}
-  ]
-}}"""
-                }
-            ]
-        )
-        
-        response_text = message.content[0].text
+async def analyze_brief_text_fallback_async(client, brief_path, case_number, brief_description):
+    """Fall back to analyzing a brief's extracted text when its PDF can't be used"""
+    text_content = await asyncio.to_thread(extract_brief_analysis_text, brief_path, 30)
+    if text_content:
+        return await analyze_brief_text_with_claude_async(client, text_content, case_number, brief_description)
+    print(f"    ⚠️  Text extraction also failed for {brief_path}")
+    return []
+
+async def analyze_brief_with_claude_async(client, brief_path, case_number, brief_description):
+    """Analyze a single legal brief PDF with Claude to extract legal issues"""
+    try:
+        request = await asyncio.to_thread(build_brief_request, brief_path, case_number, brief_description)
+        if request is None:
+            # Fallback to text extraction if truncation fails
+            print(f"    🔄 PDF truncation failed, extracting text instead...")
+            return await analyze_brief_text_fallback_async(client, brief_path, case_number, brief_description)
         
-        # Parse JSON response using enhanced parser
-        return parse_claude_json_response(response_text, case_number)
+        # Create message with PDF attachment
+        return await request_issues_from_claude(client, request, case_number)
             
     except Exception as e:
-        error_msg = str(e)
-        print(f"    ⚠️  Error analyzing brief text with Claude for {case_number}: {error_msg}")
-        
-        # Check if it's a rate limit error
-        if "429" in error_msg or "rate_limit_error" in error_msg.lower() or "rate limit" in error_msg.lower():
-            print(f"    🛑 Rate limit exceeded for {case_number}. Backing off...")
-            import time
-            # Wait 60 seconds before retrying
-            print(f"    ⏰ Waiting 60 seconds before continuing...")
-            time.sleep(60)
-            print(f"    🔄 Resuming analysis after rate limit backoff...")
+        error_kind = ANALYSIS_GATEWAY.classify_error(e)
+        if error_kind == 'rate_limited':
+            print(f"    🛑 Still rate limited for {case_number} after {RATE_LIMIT_MAX_RETRIES} retries")
             return None  # Signal to retry or skip for now
+        print(f"    ⚠️  Error analyzing brief with Claude for {case_number}: {e}")
+        
+        # The PDF couldn't be processed (or is too big even truncated) - fallback to text extraction
+        if error_kind in ('pdf', 'local', 'too_large'):
+            print(f"    🔄 PDF processing failed, extracting text instead...")
+            return await analyze_brief_text_fallback_async(client, brief_path, case_number, brief_description)
+        
+        if error_kind in ('retryable', 'not_found'):
+            return None  # Signal to retry (expired uploads are re-uploaded)
         
         return []
 
 def analyze_brief_with_claude(brief_path, case_number, brief_description):
     """Analyze a single legal brief PDF with Claude to extract legal issues"""
-    try:
-        # Get API key from environment variable
-        api_key = os.getenv('ANTHROPIC_API_KEY')
-        if not api_key:
-            print("❌ ANTHROPIC_API_KEY not found in .env file")
-            return []
+    return run_with_async_client(analyze_brief_with_claude_async, brief_path, case_number, brief_description)
+
+def collect_valid_briefs(case_details):
+    """Return (path, description) for each downloaded brief whose file exists"""
+    valid_briefs = []
+    for brief in case_details.get('briefs_downloaded', []):
+        # Handle both 'filepath' and 'file_path' keys for compatibility
+        brief_path = brief_file_path(brief)
+        brief_description = brief['description']
         
-        client = anthropic.Anthropic(api_key=api_key)
+        if not brief_path:
+            print(f"    ⚠️  No file path found in brief data: {brief}")
+            continue
         
-        # Check if PDF is too large and truncate if necessary
-        page_count = count_pdf_pages(brief_path)
-        if page_count > 100:
-            print(f"    ✂️  PDF has {page_count} pages, truncating to first 100 pages")
-            pdf_content, actual_pages = truncate_pdf_to_pages(brief_path, 100)
-            if pdf_content is None:
-                # Fallback to text extraction if truncation fails
-                print(f"    🔄 PDF truncation failed, extracting text instead...")
-                text_content = extract_pdf_text(brief_path, 30)
-                if text_content:
-                    return analyze_brief_text_with_claude(text_content, case_number, brief_description)
-                else:
-                    print(f"    ⚠️  Text extraction also failed for {brief_path}")
-                    return []
-        else:
-            # Read the PDF file as binary and encode as base64
-            import base64
-            with open(brief_path, 'rb') as f:
-                pdf_content = base64.b64encode(f.read()).decode('utf-8')
+        # Check if file exists
+        if not os.path.exists(brief_path):
+            print(f"    ⚠️  File not found: {brief_path}")
+            continue
         
-        # Create message with PDF attachment
-        message = client.messages.create(
-            model="claude-3-5-sonnet-20241022",
-            max_tokens=4000,
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "document",
-                            "source": {
-                                "type": "base64",
-                                "media_type": "application/pdf",
-                                "data": pdf_content
-                            }
-                        },
-                        {
-                            "type": "text",
-                            "text": f"""You are a legal expert analyzing a criminal appellate brief from Texas courts. Please analyze this brief from case {case_number} ({brief_description}) and identify the distinct legal issues raised.
+        valid_briefs.append((brief_path, brief_description))
+    
+    return valid_briefs
 
-For each legal issue, provide:
-1. A concise description of the issue (1-2 sentences)
-2. The specific legal area (e.g., "Fourth Amendment Search and Seizure", "Ineffective Assistance of Counsel", "Sufficiency of Evidence", etc.)
+def brief_file_path(brief):
+    """File path of a briefs_downloaded entry ('filepath' or the older 'file_path')"""
+    return brief.get('filepath') or brief.get('file_path')
 
-Focus on substantive legal arguments, not procedural matters. Return your analysis in JSON format with an array of issues:
+def brief_content_hash(brief_path):
+    """SHA-256 of a brief file (cached in the brief manifest)"""
+    return brief_manifest_entry(brief_path)[1]['sha256']
 
-{{
-  "issues": [
-    {{
-      "description": "Brief description of the legal issue",
-      "legal_area": "Specific area of law"
-    }}
-  ]
-}}"""
-                        }
-                    ]
-                }
-            ]
-        )
-        
-        response_text = message.content[0].text
-        
-        # Parse JSON response using enhanced parser
-        return parse_claude_json_response(response_text, case_number)
-            
+def migrate_brief_analysis_state(case_details):
+    """
+    Cases analyzed before per-brief tracking: mark as analyzed only the briefs their
+    existing issues name as a source (source_brief / source_briefs). Other briefs may
+    have been downloaded after the analysis, so they are left to be analyzed.
+    """
+    briefs_downloaded = case_details.get('briefs_downloaded', [])
+    if not case_details.get('legal_issues') or any('analyzed_sha256' in brief for brief in briefs_downloaded):
+        return
+    
+    source_names = set()
+    for issue in case_details['legal_issues']:
+        sources = [issue.get('source_brief')] + list(issue.get('source_briefs') or [])
+        source_names.update(source.strip().lower() for source in sources if isinstance(source, str))
+    
+    analyzed_paths = [
+        brief_file_path(brief) for brief in briefs_downloaded
+        if str(brief.get('description', '')).strip().lower() in source_names
+    ]
+    if analyzed_paths:
+        mark_briefs_analyzed(case_details, analyzed_paths)
+
+def brief_is_analyzed(brief):
+    """True if this exact brief file has already been analyzed"""
+    brief_path = brief_file_path(brief)
+    if not brief.get('analyzed_sha256') or not brief_path or not os.path.exists(brief_path):
+        return False
+    return brief['analyzed_sha256'] == brief_content_hash(brief_path)
+
+def unanalyzed_briefs(case_details, valid_briefs=None):
+    """(path, description) of the case's briefs that haven't been analyzed yet"""
+    if valid_briefs is None:
+        valid_briefs = collect_valid_briefs(case_details)
+    analyzed_paths = {
+        brief_file_path(brief)
+        for brief in case_details.get('briefs_downloaded', [])
+        if brief_is_analyzed(brief)
+    }
+    return [(path, desc) for path, desc in valid_briefs if path not in analyzed_paths]
+
+def case_needs_analysis(case_details):
+    """True if the case has downloaded briefs that haven't been analyzed"""
+    return bool(unanalyzed_briefs(case_details))
+
+def brief_content_hashes(brief_paths):
+    """{path: SHA-256} of the given brief files that exist (blocking - run it off the event loop)"""
+    return {path: brief_content_hash(path) for path in set(brief_paths) if path and os.path.exists(path)}
+
+def mark_briefs_analyzed(case_details, brief_paths, content_hashes=None):
+    """
+    Record that these brief files have been analyzed (by content hash, so a replaced file
+    counts as new). Async callers hash with brief_content_hashes in a worker thread and
+    pass content_hashes, so case dicts are only changed on the event loop thread while
+    save_case_details may be writing them.
+    """
+    if content_hashes is None:
+        content_hashes = brief_content_hashes(brief_paths)
+    analyzed_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    for brief in case_details.get('briefs_downloaded', []):
+        content_hash = content_hashes.get(brief_file_path(brief))
+        if content_hash:
+            brief['analyzed_sha256'] = content_hash
+            brief['analyzed_at'] = analyzed_at
+
+def merge_brief_analysis_state(previous_briefs, briefs):
+    """Carry per-brief analysis state over when a case's briefs_downloaded list is rebuilt"""
+    previous_by_path = {brief_file_path(brief): brief for brief in previous_briefs or []}
+    for brief in briefs:
+        previous = previous_by_path.get(brief_file_path(brief))
+        if previous and previous.get('analyzed_sha256'):
+            brief['analyzed_sha256'] = previous['analyzed_sha256']
+            brief['analyzed_at'] = previous.get('analyzed_at')
+        if previous and previous.get('document_type'):
+            brief['document_type'] = previous['document_type']
+            brief['issues_presented'] = previous.get('issues_presented', [])
+    return briefs
+
+def build_triage_request(brief_path, brief_description):
+    """Build a triage request with a brief's first TRIAGE_MAX_PAGES pages (as text, or as PDF if any are scanned)"""
+    pages = score_pdf_pages(brief_path, os.path.getmtime(brief_path))[:TRIAGE_MAX_PAGES]
+    if any(is_scanned for _, is_scanned in pages):
+        document = pdf_pages_document_block(brief_path, list(range(len(pages))))
+    else:
+        document = {"type": "text", "text": "\n\n".join(text for text, _ in pages)}
+    
+    return {
+        "model": TRIAGE_MODEL,
+        "max_tokens": 1000,
+        "tools": [TRIAGE_TOOL],
+        "tool_choice": TRIAGE_TOOL_CHOICE,
+        "messages": [
+            {
+                "role": "user",
+                "content": [
+                    document,
+                    {
+                        "type": "text",
+                        "text": f"The document above is the beginning of \"{brief_description}\", filed in a Texas criminal appeal. "
+                                "Classify it and list the issues it presents with the classify_brief tool."
+                    }
+                ]
+            }
+        ]
+    }
+
+def triage_from_message(message):
+    """The classify_brief result of a triage response, or None if it's missing or malformed"""
+    for block in message.content:
+        if block.type == 'tool_use' and block.name == TRIAGE_TOOL['name'] and isinstance(block.input, dict):
+            if block.input.get('document_type') not in DOCUMENT_TYPES:
+                return None
+            issues_presented = block.input.get('issues_presented')
+            return {
+                'document_type': block.input['document_type'],
+                'issues_presented': [issue.strip() for issue in issues_presented if isinstance(issue, str) and issue.strip()]
+                                    if isinstance(issues_presented, list) else []
+            }
+    return None
+
+async def triage_brief_async(client, brief_path, brief_description, case_number):
+    """Classify a brief with TRIAGE_MODEL (kept in the brief manifest, so once per file and model); None on failure"""
+    briefs_folder, entry = await asyncio.to_thread(brief_manifest_entry, brief_path)
+    triage = entry.get('triage')
+    if triage and triage.get('model') == TRIAGE_MODEL:
+        return triage
+    
+    usage_tags = CLAUDE_USAGE_TAGS.set({'purpose': 'triage', 'briefs': [brief_description]})
+    try:
+        request = await asyncio.to_thread(build_triage_request, brief_path, brief_description)
+        message, _ = await send_until_complete(client, request, case_number)
     except Exception as e:
-        error_msg = str(e)
-        print(f"    ⚠️  Error analyzing brief with Claude for {case_number}: {error_msg}")
-        
-        # Check if it's a rate limit error
-        if "429" in error_msg or "rate_limit_error" in error_msg.lower() or "rate limit" in error_msg.lower():
-            print(f"    🛑 Rate limit exceeded for {case_number}. Backing off...")
-            import time
-            # Wait 60 seconds before retrying
-            print(f"    ⏰ Waiting 60 seconds before continuing...")
-            time.sleep(60)
-            print(f"    🔄 Resuming analysis after rate limit backoff...")
-            return None  # Signal to retry or skip for now
+        print(f"    ⚠️  Triage failed for {brief_description} ({case_number}): {e}")
+        return None
+    finally:
+        CLAUDE_USAGE_TAGS.reset(usage_tags)
+    
+    triage = triage_from_message(message) if message is not None else None
+    if triage is None:
+        print(f"    ⚠️  No usable triage result for {brief_description} ({case_number})")
+        return None
+    
+    triage['model'] = TRIAGE_MODEL
+    with BRIEF_MANIFEST_LOCK:
+        entry['triage'] = triage
+        save_brief_manifest(briefs_folder)
+    return triage
+
+async def triage_case_briefs_async(client, case_details):
+    """
+    Triage a case's new briefs and record each one's document_type and issues_presented.
+    Briefs that aren't substantive are marked analyzed so they never reach ANALYSIS_MODEL;
+    briefs that couldn't be triaged are analyzed as usual. Returns the document types found.
+    """
+    case_number = case_details['case_number']
+    new_briefs = await asyncio.to_thread(unanalyzed_briefs, case_details)
+    briefs_by_path = {brief_file_path(brief): brief for brief in case_details.get('briefs_downloaded', [])}
+    
+    document_types = []
+    skipped = []
+    for brief_path, brief_description in new_briefs:
+        if analysis_budget_reached():
+            break
+        triage = await triage_brief_async(client, brief_path, brief_description, case_number)
+        if triage is None:
+            continue
         
-        # Check if it's a PDF processing error - fallback to text extraction
-        if "could not process pdf" in error_msg.lower() or ("pdf" in error_msg.lower() and "process" in error_msg.lower()):
-            print(f"    🔄 PDF processing failed, extracting text instead...")
-            text_content = extract_pdf_text(brief_path, 30)
-            if text_content:
-                return analyze_brief_text_with_claude(text_content, case_number, brief_description)
-            else:
-                print(f"    ⚠️  Text extraction also failed for {brief_path}")
+        brief = briefs_by_path[brief_path]
+        brief['document_type'] = triage['document_type']
+        brief['issues_presented'] = triage['issues_presented']
+        document_types.append(triage['document_type'])
+        if triage['document_type'] not in SUBSTANTIVE_DOCUMENT_TYPES:
+            print(f"    ⏭️  {case_number}: {brief_description} is a {triage['document_type']}, skipping full analysis")
+            skipped.append(brief_path)
+    
+    if skipped:
+        content_hashes = await asyncio.to_thread(brief_content_hashes, skipped)
+        case_details.setdefault('legal_issues', [])
+        mark_briefs_analyzed(case_details, skipped, content_hashes)
+    
+    if 'anders_brief' in document_types:
+        # Same outcome as an Anders brief spotted on the case page during download
+        print(f"    ⏭️  {case_number}: contains an Anders brief, filtering the case out")
+        case_details['filtered_out'] = True
+        case_details['filter_reason'] = 'Anders brief'
+    return document_types
+
+async def triage_cases(client, cases, all_case_details, output_folder):
+    """Triage the new briefs of every case (ANALYSIS_CONCURRENCY cases at a time) before full analysis"""
+    semaphore = asyncio.Semaphore(max(1, ANALYSIS_CONCURRENCY))
+    
+    async def triage_one(case):
+        async with semaphore:
+            try:
+                return await triage_case_briefs_async(client, case)
+            except Exception as e:
+                print(f"    ⚠️  Error triaging briefs for {case['case_number']}: {e}")
                 return []
+    
+    results = await asyncio.gather(*(triage_one(case) for case in cases))
+    add_usage_to_cases(all_case_details)
+    save_case_details(all_case_details, output_folder)
+    
+    type_counts = {}
+    for document_type in (document_type for document_types in results for document_type in document_types):
+        type_counts[document_type] = type_counts.get(document_type, 0) + 1
+    if type_counts:
+        summary = ", ".join(f"{count} {document_type}" for document_type, count in sorted(type_counts.items()))
+        print(f"🏷️  Triaged {sum(type_counts.values())} brief(s) with {TRIAGE_MODEL}: {summary}")
+    else:
+        print("🏷️  No new briefs to triage")
+
+def plan_case_batches(case_number, valid_briefs, verbose=True):
+    """Count pages for a case's briefs and pack them into batches under the page limit"""
+    if verbose:
+        print(f"  📊 Counting pages for {len(valid_briefs)} briefs...")
+    briefs_with_pages = []
+    total_pages = 0
+    
+    for brief_path, brief_description in valid_briefs:
+        page_count = count_pdf_pages(brief_path)
+        briefs_with_pages.append((brief_path, brief_description, page_count))
+        total_pages += page_count
+        if verbose:
+            print(f"    📄 {brief_description}: {page_count} pages")
+    
+    batches = create_optimal_batches(briefs_with_pages)
+    if not verbose:
+        return batches
+    
+    print(f"  📊 Total pages: {total_pages}")
+    print(f"  📦 Created {len(batches)} batch(es) for analysis:")
+    for i, batch in enumerate(batches, 1):
+        batch_pages = sum(pages for _, _, pages in batch)
+        batch_descriptions = [desc for _, desc, _ in batch]
+        batch_tokens = sum(brief_token_count(path, pages) for path, _, pages in batch)
+        print(f"    Batch {i}: {len(batch)} brief(s), {batch_pages} pages, ~{batch_tokens:,} tokens")
+        for desc in batch_descriptions:
+            print(f"      - {desc}")
+    
+    return batches
+
+def report_analysis_plan(cases):
+    """Plan every case's batches up front and print the API calls and input tokens it will take"""
+    planned_cases = 0
+    planned_calls = 0
+    sequential_calls = 0
+    planned_tokens = 0
+    
+    briefs_by_case = [(case, unanalyzed_briefs(case)) for case in cases]
+    measure_briefs_tokens([path for _, valid_briefs in briefs_by_case for path, _ in valid_briefs])
+    
+    for case, valid_briefs in briefs_by_case:
+        if not valid_briefs:
+            continue
+        batches = plan_case_batches(case['case_number'], valid_briefs, verbose=False)
+        briefs_with_pages = [brief for batch in batches for brief in batch]
+        briefs_with_pages.sort(key=lambda brief: valid_briefs.index((brief[0], brief[1])))
         
+        planned_cases += 1
+        planned_calls += len(batches)
+        sequential_calls += next_fit_batch_count(briefs_with_pages)
+        for path, _, pages in briefs_with_pages:
+            planned_tokens += min(brief_token_count(path, pages), MAX_BRIEF_INPUT_TOKENS)
+    
+    print(f"📋 Analysis plan: {planned_cases} case(s), {planned_calls} API call(s) "
+          f"(sequential batching would need {sequential_calls}), ~{planned_tokens:,} document input tokens")
+    return planned_calls
+
+def deduplicate_issues(all_issues):
+    """Remove issues with the same description (for fallback individual analysis)"""
+    unique_issues = []
+    seen_descriptions = set()
+    
+    for issue in all_issues:
+        desc_key = issue['description'].lower().strip()
+        if desc_key not in seen_descriptions:
+            seen_descriptions.add(desc_key)
+            unique_issues.append(issue)
+    
+    return unique_issues
+
+def record_batch_issues(issues, batch_briefs, batch_number):
+    """Return the issues a completed batch adds to its case (single-brief issues are tagged with their brief)"""
+    if len(batch_briefs) > 1:
+        if issues:
+            print(f"    ✅ Found {len(issues)} new/expanded legal issues from batch {batch_number}")
+            return list(issues)
+        print(f"    ⚠️  No new issues found from batch {batch_number}")
+        return []
+    
+    brief_description = batch_briefs[0][1]
+    if not issues:
+        print(f"    ⚠️  No issues found from {brief_description}")
         return []
+    print(f"    ✅ Found {len(issues)} legal issues from {brief_description}")
+    for issue in issues:
+        issue['source_brief'] = brief_description
+    return list(issues)
 
-def analyze_case_briefs(case_details, output_folder):
-    """Analyze all briefs for a case and extract legal issues"""
+async def analyze_case_batch_async(client, case_number, batch_briefs, batch_number, prior_issues=None):
+    """Analyze one batch of a case's briefs; returns the issues it adds, or None if it should be retried"""
+    if len(batch_briefs) > 1 or prior_issues:
+        # Multiple briefs (or briefs following earlier ones) - analyze together with prior issues
+        issues = await analyze_briefs_with_claude_async(client, batch_briefs, case_number, prior_issues)
+        
+        if issues == "PROCESS_INDIVIDUALLY":
+            # PDF processing error - process each brief individually
+            print(f"    🔄 Processing briefs individually due to PDF error...")
+            batch_issues = []
+            for brief_path, brief_description in batch_briefs:
+                individual_issues = await analyze_brief_with_claude_async(client, brief_path, case_number, brief_description)
+                if individual_issues is None:
+                    return None  # Retry the batch rather than mark a brief that wasn't analyzed
+                if individual_issues and individual_issues != "PROCESS_INDIVIDUALLY":
+                    print(f"      ✅ Found {len(individual_issues)} issues from {brief_description}")
+                    for issue in individual_issues:
+                        issue['source_brief'] = brief_description
+                        batch_issues.append(issue)
+                else:
+                    print(f"      ⚠️  No issues found from {brief_description}")
+            
+            if batch_issues:
+                print(f"    ✅ Found {len(batch_issues)} total issues from individual processing")
+            else:
+                print(f"    ⚠️  No issues found from individual processing")
+            return batch_issues
+    else:
+        # Single brief in batch - use individual analysis (no prior issues context for single briefs)
+        brief_path, brief_description = batch_briefs[0]
+        issues = await analyze_brief_with_claude_async(client, brief_path, case_number, brief_description)
+    
+    if issues is None:
+        return None
+    return record_batch_issues(issues, batch_briefs, batch_number)
+
+async def analyze_case_batch_with_retries(client, case_number, batch_briefs, batch_number, prior_issues=None):
+    """Analyze a batch, retrying up to MAX_BATCH_RETRIES times; returns None if it never succeeded"""
+    # Tag the batch's calls in the usage ledger
+    usage_tags = CLAUDE_USAGE_TAGS.set({'purpose': 'analysis', 'batch': batch_number, 'briefs': [desc for _, desc in batch_briefs]})
+    try:
+        for attempt in range(MAX_BATCH_RETRIES + 1):
+            batch_issues = await analyze_case_batch_async(client, case_number, batch_briefs, batch_number, prior_issues)
+            if batch_issues is not None:
+                return batch_issues
+            if attempt < MAX_BATCH_RETRIES:
+                if analysis_budget_reached():
+                    return None
+                # Rate limit or other error that requires retry
+                print(f"    🔄 Retrying batch {batch_number} for {case_number} (attempt {attempt + 1}/{MAX_BATCH_RETRIES})...")
+    finally:
+        CLAUDE_USAGE_TAGS.reset(usage_tags)
+    
+    print(f"    ❌ Giving up on batch {batch_number} for {case_number} after {MAX_BATCH_RETRIES} retries")
+    return None
+
+async def analyze_case_briefs_async(client, case_details, output_folder):
+    """
+    Analyze a case's not-yet-analyzed briefs and merge their issues into the case's
+    legal_issues (batches run in order, each seeing the issues known so far)
+    """
     case_number = case_details['case_number']
     briefs_downloaded = case_details.get('briefs_downloaded', [])
     
     if not briefs_downloaded:
         print(f"⏭️  No briefs to analyze for {case_number}")
-        case_details['legal_issues'] = []
+        case_details.setdefault('legal_issues', [])
+        return
+    
+    # Prepare list of valid briefs for analysis
+    valid_briefs = collect_valid_briefs(case_details)
+    
+    if not valid_briefs:
+        print(f"    ⚠️  No valid briefs found for {case_number}")
+        case_details.setdefault('legal_issues', [])
+        return
+    
+    new_briefs = await asyncio.to_thread(unanalyzed_briefs, case_details, valid_briefs)
+    if not new_briefs:
+        print(f"🧠 All {len(valid_briefs)} briefs already analyzed for {case_number}")
         return
     
-    print(f"🔍 Analyzing {len(briefs_downloaded)} briefs for {case_number}")
+    # Issues from earlier runs are the starting point - new briefs are analyzed against them
+    all_issues = list(case_details.get('legal_issues', []))
+    if all_issues:
+        print(f"🔍 Analyzing {len(new_briefs)} new of {len(valid_briefs)} briefs for {case_number} against {len(all_issues)} known issues")
+    else:
+        print(f"🔍 Analyzing {len(new_briefs)} briefs for {case_number}")
+    
+    # Count pages for each brief and create optimal batches
+    batches = await asyncio.to_thread(plan_case_batches, case_number, new_briefs)
+    
+    # Analyze each batch with rate limit handling and incremental issue building
+    batch_index = 0
+    while batch_index < len(batches):
+        if analysis_budget_reached():
+            break
+        batch = batches[batch_index]
+        batch_briefs = [(path, desc) for path, desc, _ in batch]
+        batch_pages = sum(pages for _, _, pages in batch)
+        
+        # Prepare prior issues for this batch (all issues found so far)
+        prior_issues = all_issues.copy() if all_issues else None
+        prior_count = len(prior_issues) if prior_issues else 0
+        
+        if prior_issues:
+            print(f"  🔍 {case_number}: analyzing batch {batch_index + 1}/{len(batches)} ({len(batch_briefs)} brief(s), {batch_pages} pages) with {prior_count} prior issues...")
+        else:
+            print(f"  🔍 {case_number}: analyzing batch {batch_index + 1}/{len(batches)} ({len(batch_briefs)} brief(s), {batch_pages} pages)...")
+        
+        batch_issues = await analyze_case_batch_with_retries(client, case_number, batch_briefs, batch_index + 1, prior_issues)
+        if batch_issues is not None:
+            all_issues.extend(batch_issues)
+            batch_paths = [path for path, _ in batch_briefs]
+            content_hashes = await asyncio.to_thread(brief_content_hashes, batch_paths)
+            # Merge the issues before marking the briefs, with no await in between, so a
+            # save never records briefs as analyzed without the issues they produced
+            case_details['legal_issues'] = deduplicate_issues(all_issues)
+            mark_briefs_analyzed(case_details, batch_paths, content_hashes)
+        
+        batch_index += 1
+    
+    print(f"  📊 Total unique legal issues for {case_number}: {len(case_details.get('legal_issues', []))}")
+
+def analyze_case_briefs(case_details, output_folder):
+    """Analyze all briefs for a case and extract legal issues"""
+    migrate_brief_analysis_state(case_details)
+    return run_with_async_client(analyze_case_briefs_async, case_details, output_folder)
+
+def small_case_brief(case_details):
+    """The (path, description, pages) of a case's only new brief if the case can share a packed request, else None"""
+    if case_details.get('legal_issues'):
+        return None
+    new_briefs = unanalyzed_briefs(case_details)
+    if len(new_briefs) != 1:
+        return None
+
+    brief_path, brief_description = new_briefs[0]
+    page_count = count_pdf_pages(brief_path)
+    if page_count > SMALL_CASE_MAX_PAGES:
+        return None
+    return brief_path, brief_description, page_count
+
+def plan_case_packs(cases):
+    """Group small single-brief cases into packs of two or more that fit one request's page/token budget"""
+    candidates = []
+    for case in cases:
+        brief = small_case_brief(case)
+        if brief:
+            candidates.append((case, brief))
+
+    limits = (MAX_BATCH_PAGES, MAX_CASES_PER_PACK)
+    loads = [(pages, 1) for _, (_, _, pages) in candidates]
+    if BATCH_PACK_BY == "tokens":
+        limits += (MAX_BATCH_TOKENS,)
+        loads = [load + (brief_token_count(path, pages),) for load, (_, (path, _, pages)) in zip(loads, candidates)]
+
+    packs = pack_first_fit_decreasing(loads, limits)
+    return [[candidates[i] for i in sorted(items)] for items in packs if len(items) > 1]
+
+def build_case_pack_request(pack):
+    """Build one request analyzing the briefs of several small cases; returns (request or None, case numbers included)"""
+    brief_block_groups = []
+    case_list = []
+    for case, (brief_path, brief_description, _) in pack:
+        case_number = case['case_number']
+        try:
+            blocks = brief_content_blocks(brief_path, brief_description)
+        except Exception as e:
+            print(f"    ⚠️  Error reading {brief_path}: {e}")
+            continue
+        if blocks:
+            label = {"type": "text", "text": f"Case {case_number} - {brief_description}:"}
+            brief_block_groups.append([label] + blocks)
+            case_list.append((case_number, brief_description))
+
+    if not brief_block_groups:
+        return None, []
+
+    content = mark_brief_cache_breakpoints(brief_block_groups)
+    cases_text = "\n".join([f"- {case_number}: {desc}" for case_number, desc in case_list])
+
+    prompt_text = f"""You are a legal expert analyzing criminal appellate briefs from Texas courts. The briefs above come from {len(case_list)} different cases, each labeled with its case number:
+
+{cases_text}
+
+Analyze each case's brief on its own and identify the distinct legal issues it raises. For each legal issue, provide:
+1. A concise description of the issue (1-2 sentences)
+2. The specific legal area (e.g., "Fourth Amendment Search and Seizure", "Ineffective Assistance of Counsel", "Sufficiency of Evidence", etc.)
+
+Focus on substantive legal arguments, not procedural matters. Never attribute an issue to a case other than the one whose brief raised it. Record the results with the record_case_legal_issues tool, with one entry for every case number listed above (use an empty issues list when a brief raises none)."""
+
+    content.append({
+        "type": "text",
+        "text": prompt_text
+    })
+
+    request = {
+        "model": ANALYSIS_MODEL,
+        "max_tokens": 4000,
+        "system": analysis_system_prompt(),
+        "tools": [CASE_ISSUES_TOOL],
+        "tool_choice": CASE_ISSUES_TOOL_CHOICE,
+        "messages": [
+            {
+                "role": "user",
+                "content": content
+            }
+        ]
+    }
+    return request, [case_number for case_number, _ in case_list]
+
+def case_issues_from_message(message, case_numbers):
+    """
+    Split a packed analysis response into ({case_number: valid issues}, {case_number: invalid
+    entries}, raw response text). Cases the reply leaves out are missing from both.
+    """
+    valid_by_case = {}
+    invalid_by_case = {}
+    for block in message.content:
+        if block.type != 'tool_use' or block.name != CASE_ISSUES_TOOL['name']:
+            continue
+        entries = block.input.get('cases') if isinstance(block.input, dict) else None
+        for entry in entries if isinstance(entries, list) else []:
+            if not isinstance(entry, dict) or not isinstance(entry.get('issues'), list):
+                continue
+            case_number = str(entry.get('case_number', '')).strip()
+            if case_number not in case_numbers or case_number in valid_by_case:
+                continue
+            valid, invalid = validate_issues_payload(entry)
+            valid_by_case[case_number] = valid
+            if invalid:
+                invalid_by_case[case_number] = invalid
+        return valid_by_case, invalid_by_case, json.dumps(block.input)
+
+    # Without the tool call the issues can't be attributed to cases
+    return {}, {}, "".join(block.text for block in message.content if block.type == 'text')
+
+async def analyze_case_pack_async(client, pack):
+    """Analyze a pack of small cases with one request; returns {case_number: issues} for the cases it answered"""
+    request, case_numbers = await asyncio.to_thread(build_case_pack_request, pack)
+    if request is None:
+        return {}
+
+    pack_label = ", ".join(case_numbers)
+    cache_key = await asyncio.to_thread(analysis_cache_key, request)
+    cached = load_cached_analysis(cache_key)
+    if cached is not None:
+        print(f"    💾 Using cached analysis for {pack_label}")
+        return cached['issues']
+
+    usage_tags = CLAUDE_USAGE_TAGS.set({
+        'purpose': 'packed analysis',
+        'case_numbers': case_numbers,
+        'briefs': [desc for case, (_, desc, _) in pack if case['case_number'] in case_numbers]
+    })
+    try:
+        message, request = await send_until_complete(client, request, pack_label)
+    except Exception as e:
+        print(f"    ⚠️  Packed analysis failed for {pack_label}: {e}")
+        return {}
+    finally:
+        CLAUDE_USAGE_TAGS.reset(usage_tags)
+    if message is None:
+        return {}  # Each case is analyzed on its own instead
+
+    issues_by_case, invalid_by_case, response_text = case_issues_from_message(message, case_numbers)
+    for case_number, invalid in invalid_by_case.items():
+        issues_by_case[case_number] = issues_by_case[case_number] + await repair_issue_entries_async(client, invalid, case_number)
+
+    if issues_by_case:
+        store_cached_analysis(cache_key, request, response_text, issues_by_case, pack_label)
+    return issues_by_case
+
+async def analyze_small_cases_packed(client, cases, all_case_details, output_folder):
+    """
+    Analyze small single-brief cases several to a request and split each response back
+    into the cases' legal_issues. Cases a pack didn't answer keep their briefs unanalyzed,
+    so the per-case analysis that runs afterwards picks them up.
+    """
+    packs = await asyncio.to_thread(plan_case_packs, cases)
+    if not packs:
+        print("📦 No small cases to pack together")
+        return
+
+    print(f"📦 Packing {sum(len(pack) for pack in packs)} small case(s) into {len(packs)} request(s)")
+    semaphore = asyncio.Semaphore(max(1, ANALYSIS_CONCURRENCY))
+
+    async def analyze_pack(pack_number, pack):
+        async with semaphore:
+            if analysis_budget_reached():
+                return
+            pack_pages = sum(pages for _, (_, _, pages) in pack)
+            print(f"  🔍 Pack {pack_number}/{len(packs)}: {len(pack)} cases, {pack_pages} pages")
+            issues_by_case = await analyze_case_pack_async(client, pack)
+
+            for case, (brief_path, brief_description, _) in pack:
+                case_number = case['case_number']
+                if case_number not in issues_by_case:
+                    print(f"    ↩️  {case_number} was not answered in pack {pack_number}, it will be analyzed on its own")
+                    continue
+                print(f"    📁 {case_number}:")
+                issues = record_batch_issues(issues_by_case[case_number], [(brief_path, brief_description)], 1)
+                content_hashes = await asyncio.to_thread(brief_content_hashes, [brief_path])
+                # Issues and the analyzed mark change together, so every save holds both
+                case['legal_issues'] = deduplicate_issues(issues)
+                mark_briefs_analyzed(case, [brief_path], content_hashes)
+
+            add_usage_to_cases(all_case_details)
+            save_case_details(all_case_details, output_folder)
+
+    await asyncio.gather(*(analyze_pack(pack_number, pack) for pack_number, pack in enumerate(packs, 1)))
+
+def build_case_batch_request(case_number, batch_briefs, prior_issues=None):
+    """Build the same request the interactive path would send for one batch of a case's briefs"""
+    if len(batch_briefs) > 1 or prior_issues:
+        return build_briefs_request(batch_briefs, case_number, prior_issues)
+    brief_path, brief_description = batch_briefs[0]
+    return build_brief_request(brief_path, case_number, brief_description)
+
+def chunk_message_batch_requests(batch_requests, max_bytes=None):
+    """Split Message Batches requests into submissions that stay under the batch size limit"""
+    if max_bytes is None:
+        max_bytes = MESSAGE_BATCH_MAX_BYTES
+    
+    chunks = []
+    current = []
+    current_bytes = 0
+    for batch_request in batch_requests:
+        request_bytes = len(json.dumps(batch_request))
+        if current and current_bytes + request_bytes > max_bytes:
+            chunks.append(current)
+            current = []
+            current_bytes = 0
+        current.append(batch_request)
+        current_bytes += request_bytes
+    if current:
+        chunks.append(current)
+    return chunks
+
+def wait_for_message_batch(client, batch_id, poll_seconds=None):
+    """Poll a message batch until processing has ended"""
+    if poll_seconds is None:
+        poll_seconds = MESSAGE_BATCH_POLL_SECONDS
+    
+    while True:
+        message_batch = client.messages.batches.retrieve(batch_id)
+        counts = message_batch.request_counts
+        if message_batch.processing_status == "ended":
+            print(f"    ✅ Batch {batch_id} ended: {counts.succeeded} succeeded, {counts.errored} errored, "
+                  f"{counts.expired} expired, {counts.canceled} canceled")
+            return message_batch
+        print(f"    ⏳ Batch {batch_id}: {counts.processing} processing, {counts.succeeded} succeeded... "
+              f"checking again in {poll_seconds}s")
+        time.sleep(poll_seconds)
+
+def run_message_batch_wave(client, requests_by_case, tags_by_case=None):
+    """
+    Submit one request per case through the Message Batches API and return {case_number:
+    response message or None}; tags_by_case adds usage ledger tags to each case's call
+    """
+    if tags_by_case is None:
+        tags_by_case = {}
+    batch_requests = [
+        {"custom_id": case_number, "params": request}
+        for case_number, request in requests_by_case.items()
+    ]
+    
+    responses = {case_number: None for case_number in requests_by_case}
+    for chunk in chunk_message_batch_requests(batch_requests):
+        batch_options = {}
+        if any(request_file_ids(batch_request['params']) for batch_request in chunk):
+            batch_options = {'extra_headers': {'anthropic-beta': FILES_API_BETA}}
+        with ANALYSIS_GATEWAY.timed('messages.batches.create'):
+            message_batch = client.messages.batches.create(requests=chunk, **batch_options)
+        print(f"    📤 Submitted batch {message_batch.id} with {len(chunk)} request(s)")
+        wait_for_message_batch(client, message_batch.id)
+        
+        for entry in client.messages.batches.results(message_batch.id):
+            if entry.result.type == "succeeded":
+                record_claude_usage(entry.result.message, entry.custom_id, {'batch_api': True, **tags_by_case.get(entry.custom_id, {})})
+                responses[entry.custom_id] = entry.result.message
+            else:
+                print(f"    ⚠️  {entry.custom_id}: batch request {entry.result.type}")
     
-    # Prepare list of valid briefs for analysis
-    valid_briefs = []
-    for brief in briefs_downloaded:
-        # Handle both 'filepath' and 'file_path' keys for compatibility
-        brief_path = brief.get('filepath') or brief.get('file_path')
-        brief_description = brief['description']
+    return responses
+
+async def analyze_pending_batches_interactively(client, states):
+    """Run the current batch of each case interactively (used when its batch request failed)"""
+    for state in states:
+        if analysis_budget_reached():
+            return
+        case_number = state['case']['case_number']
+        batch_briefs = state['batches'][state['next']]
+        prior_issues = state['issues'].copy() if state['issues'] else None
         
-        if not brief_path:
-            print(f"    ⚠️  No file path found in brief data: {brief}")
+        batch_issues = await analyze_case_batch_with_retries(client, case_number, batch_briefs, state['next'] + 1, prior_issues)
+        complete_state_batch(state, batch_issues)
+
+def complete_state_batch(state, batch_issues):
+    """Record a finished batch of a Message Batches case state (batch_issues is None if it failed)"""
+    if batch_issues is not None:
+        state['issues'].extend(batch_issues)
+        # Merged issues go on the case before its briefs are marked, so each save holds both
+        state['case']['legal_issues'] = deduplicate_issues(state['issues'])
+        mark_briefs_analyzed(state['case'], [path for path, _ in state['batches'][state['next']]])
+    state['next'] += 1
+
+def analyze_cases_with_message_batches(cases, all_case_details, output_folder):
+    """
+    Analyze cases through the Message Batches API. Wave 1 submits every case's first
+    batch; each later wave submits the next batch of the cases that still have one, with
+    the issues found so far as prior issues. Requests that fail in a batch are retried
+    through the interactive path. Set ANTHROPIC_BASE_URL to run against a stub server.
+    """
+    client = ANALYSIS_GATEWAY.sync_client()
+    
+    # Plan every case's batches up front
+    states = {}
+    for case in cases:
+        case_number = case['case_number']
+        valid_briefs = collect_valid_briefs(case)
+        if not valid_briefs:
+            print(f"    ⚠️  No valid briefs found for {case_number}")
+            case.setdefault('legal_issues', [])
             continue
         
-        # Check if file exists
-        if not os.path.exists(brief_path):
-            print(f"    ⚠️  File not found: {brief_path}")
+        new_briefs = unanalyzed_briefs(case, valid_briefs)
+        if not new_briefs:
+            print(f"🧠 All {len(valid_briefs)} briefs already analyzed for {case_number}")
             continue
         
-        valid_briefs.append((brief_path, brief_description))
-    
-    if not valid_briefs:
-        print(f"    ⚠️  No valid briefs found for {case_number}")
-        case_details['legal_issues'] = []
-        return
-    
-    all_issues = []
-    
-    # Count pages for each brief and create optimal batches
-    print(f"  📊 Counting pages for {len(valid_briefs)} briefs...")
-    briefs_with_pages = []
-    total_pages = 0
-    
-    for brief_path, brief_description in valid_briefs:
-        page_count = count_pdf_pages(brief_path)
-        briefs_with_pages.append((brief_path, brief_description, page_count))
-        total_pages += page_count
-        print(f"    📄 {brief_description}: {page_count} pages")
-    
-    print(f"  📊 Total pages: {total_pages}")
-    
-    # Create optimal batches (max 100 pages per batch)
-    batches = create_optimal_batches(briefs_with_pages, max_pages=100)
-    
-    print(f"  📦 Created {len(batches)} batch(es) for analysis:")
-    for i, batch in enumerate(batches, 1):
-        batch_pages = sum(pages for _, _, pages in batch)
-        batch_descriptions = [desc for _, desc, _ in batch]
-        print(f"    Batch {i}: {len(batch)} brief(s), {batch_pages} pages")
-        for desc in batch_descriptions:
-            print(f"      - {desc}")
+        print(f"🔍 Planning {len(new_briefs)} new of {len(valid_briefs)} briefs for {case_number}")
+        batches = plan_case_batches(case_number, new_briefs)
+        states[case_number] = {
+            'case': case,
+            'batches': [[(path, desc) for path, desc, _ in batch] for batch in batches],
+            'next': 0,
+            'issues': list(case.get('legal_issues', []))
+        }
     
-    # Analyze each batch with rate limit handling and incremental issue building
-    batch_index = 0
-    while batch_index < len(batches):
-        batch = batches[batch_index]
-        batch_briefs = [(path, desc) for path, desc, _ in batch]
-        batch_pages = sum(pages for _, _, pages in batch)
-        
-        # Prepare prior issues for this batch (all issues found so far)
-        prior_issues = all_issues.copy() if batch_index > 0 else None
-        prior_count = len(prior_issues) if prior_issues else 0
-        
-        if prior_issues:
-            print(f"  🔍 Analyzing batch {batch_index + 1}/{len(batches)} ({len(batch_briefs)} brief(s), {batch_pages} pages) with {prior_count} prior issues...")
-        else:
-            print(f"  🔍 Analyzing batch {batch_index + 1}/{len(batches)} ({len(batch_briefs)} brief(s), {batch_pages} pages)...")
+    wave = 0
+    while True:
+        pending = [state for state in states.values() if state['next'] < len(state['batches'])]
+        if not pending or analysis_budget_reached():
+            break
+        wave += 1
         
-        if len(batch_briefs) > 1:
-            # Multiple briefs in batch - analyze together with prior issues
-            issues = analyze_briefs_with_claude(batch_briefs, case_number, prior_issues)
+        requests_by_case = {}
+        tags_by_case = {}
+        cache_keys = {}
+        interactive = []
+        for state in pending:
+            case_number = state['case']['case_number']
+            batch_briefs = state['batches'][state['next']]
+            prior_issues = state['issues'].copy() if state['issues'] else None
+            request = build_case_batch_request(case_number, batch_briefs, prior_issues)
+            if request is None:
+                interactive.append(state)
+                continue
             
-            if issues is None:
-                # Rate limit or other error that requires retry - don't advance batch_index
-                print(f"    🔄 Retrying batch {batch_index + 1} after backoff...")
+            cache_key = analysis_cache_key(request)
+            cached = load_cached_analysis(cache_key)
+            if cached is not None:
+                print(f"    💾 Using cached analysis for {case_number}")
+                complete_state_batch(state, record_batch_issues(cached['issues'], batch_briefs, state['next'] + 1))
                 continue
-            elif issues == "PROCESS_INDIVIDUALLY":
-                # PDF processing error - process each brief individually
-                print(f"    🔄 Processing briefs individually due to PDF error...")
-                batch_issues = []
-                for brief_path, brief_description in batch_briefs:
-                    individual_issues = analyze_brief_with_claude(brief_path, case_number, brief_description)
-                    if individual_issues and individual_issues != "PROCESS_INDIVIDUALLY":
-                        print(f"      ✅ Found {len(individual_issues)} issues from {brief_description}")
-                        for issue in individual_issues:
-                            issue['source_brief'] = brief_description
-                            batch_issues.append(issue)
-                    else:
-                        print(f"      ⚠️  No issues found from {brief_description}")
-                
-                if batch_issues:
-                    print(f"    ✅ Found {len(batch_issues)} total issues from individual processing")
-                    all_issues.extend(batch_issues)
-                else:
-                    print(f"    ⚠️  No issues found from individual processing")
-            elif issues:
-                print(f"    ✅ Found {len(issues)} new/expanded legal issues from batch {batch_index + 1}")
-                all_issues.extend(issues)
-            else:
-                print(f"    ⚠️  No new issues found from batch {batch_index + 1}")
-        else:
-            # Single brief in batch - use individual analysis (no prior issues context for single briefs)
-            brief_path, brief_description = batch_briefs[0]
-            issues = analyze_brief_with_claude(brief_path, case_number, brief_description)
             
+            requests_by_case[case_number] = request
+            tags_by_case[case_number] = {'purpose': 'analysis', 'batch': state['next'] + 1, 'briefs': [desc for _, desc in batch_briefs]}
+            cache_keys[case_number] = cache_key
+        
+        print(f"\n📦 Message batch wave {wave}: {len(requests_by_case)} request(s), {len(interactive)} interactive")
+        responses = run_message_batch_wave(client, requests_by_case, tags_by_case) if requests_by_case else {}
+        
+        for case_number, message in responses.items():
+            state = states[case_number]
+            if message is None:
+                interactive.append(state)
+                continue
+            if message.stop_reason == 'max_tokens':
+                # Retried interactively, where max_tokens is raised until the response fits
+                print(f"    ✂️  Batch response for {case_number} was cut off")
+                interactive.append(state)
+                continue
+            issues, invalid, response_text = issues_from_message(message, case_number)
             if issues is None:
-                # Rate limit or other error that requires retry - don't advance batch_index
-                print(f"    🔄 Retrying batch {batch_index + 1} after backoff...")
+                interactive.append(state)
                 continue
-            elif issues:
-                print(f"    ✅ Found {len(issues)} legal issues from {brief_description}")
-                for issue in issues:
-                    issue['source_brief'] = brief_description
-                    all_issues.append(issue)
-            else:
-                print(f"    ⚠️  No issues found from {brief_description}")
+            if invalid:
+                issues = issues + run_with_async_client(repair_issue_entries_async, invalid, case_number)
+            store_cached_analysis(cache_keys[case_number], requests_by_case[case_number], response_text, issues, case_number)
+            complete_state_batch(state, record_batch_issues(issues, state['batches'][state['next']], state['next'] + 1))
         
-        # Move to next batch only if current batch completed successfully
-        batch_index += 1
+        if interactive:
+            print(f"  🔄 Analyzing {len(interactive)} failed request(s) interactively...")
+            run_with_async_client(analyze_pending_batches_interactively, interactive)
         
-        # Add a small delay between batches to help prevent rate limiting
-        if batch_index < len(batches):
-            import time
-            print(f"    ⏸️  Pausing 2 seconds before next batch...")
-            time.sleep(2)
+        # Store finished cases and save so an interrupted run keeps their results
+        for state in pending:
+            if state['next'] >= len(state['batches']):
+                case = state['case']
+                case['legal_issues'] = deduplicate_issues(state['issues'])
+                print(f"  📊 Total unique legal issues for {case['case_number']}: {len(case['legal_issues'])}")
+        add_usage_to_cases(all_case_details)
+        save_case_details(all_case_details, output_folder)
+    
+    print_rate_limit_metrics()
+    print_prompt_cache_metrics()
+    print_latency_metrics()
+
+async def analyze_cases_concurrently(cases, all_case_details, output_folder, concurrency=None):
+    """
+    Analyze many cases at once with the gateway's AsyncAnthropic client, at most `concurrency`
+    cases in flight. Batches within a case still run in order so each one sees the
+    issues found by the batches before it. case_details.json is saved as each case finishes.
+    """
+    if concurrency is None:
+        concurrency = ANALYSIS_CONCURRENCY
     
-    # Remove duplicate issues (for fallback individual analysis)
-    unique_issues = []
-    seen_descriptions = set()
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    analysis_progress = tqdm(total=len(cases), desc="🤖 Analyzing with Claude", unit="case")
     
-    for issue in all_issues:
-        desc_key = issue['description'].lower().strip()
-        if desc_key not in seen_descriptions:
-            seen_descriptions.add(desc_key)
-            unique_issues.append(issue)
+    client = ANALYSIS_GATEWAY.async_client()
+    try:
+        async def analyze_one(case):
+            case_number = case['case_number']
+            async with semaphore:
+                try:
+                    if analysis_budget_reached():
+                        return
+                    
+                    # Check if every brief has already been analyzed
+                    if not await asyncio.to_thread(case_needs_analysis, case):
+                        analysis_progress.write(f"🧠 Legal issues already analyzed for {case_number}: {len(case.get('legal_issues', []))} issues")
+                        return
+                    
+                    await analyze_case_briefs_async(client, case, output_folder)
+                    
+                    # Save updated case details to JSON immediately after analysis
+                    add_usage_to_cases(all_case_details)
+                    save_case_details(all_case_details, output_folder)
+                    
+                    analysis_progress.set_postfix(last=case_number, issues=len(case.get('legal_issues', [])))
+                    
+                except Exception as e:
+                    # Keep the issues found so far - the briefs that produced them stay marked as analyzed
+                    analysis_progress.write(f"Error analyzing briefs for {case_number}: {str(e)}")
+                finally:
+                    analysis_progress.update(1)
+        
+        await asyncio.gather(*(analyze_one(case) for case in cases))
+    finally:
+        await ANALYSIS_GATEWAY.close_async_client()
     
-    case_details['legal_issues'] = unique_issues
-    print(f"  📊 Total unique legal issues for {case_number}: {len(unique_issues)}")
+    analysis_progress.close()
+    print_rate_limit_metrics()
+    print_prompt_cache_metrics()
+    print_latency_metrics()
 
 def generate_comprehensive_case_report(coa_cases_with_briefs, output_folder):
     """Generate a comprehensive PDF report of COA cases with legal issues"""
@@ -2066,119 +4687,267 @@ def case_needs_processing(case_number, existing_cases):
     
     return True, "Needs brief download"
 
-def briefs_already_downloaded(case_number, output_folder):
-    """Check if briefs for this case are already downloaded"""
-    briefs_folder = os.path.join(output_folder, "briefs")
-    if not os.path.exists(briefs_folder):
-        return False, []
-    
-    # Look for files that start with the case number
-    downloaded_briefs = []
-    for filename in os.listdir(briefs_folder):
-        if filename.startswith(case_number) and filename.endswith('.pdf'):
-            downloaded_briefs.append(filename)
-    
-    return len(downloaded_briefs) > 0, downloaded_briefs
+def build_case_indexes(all_cases, all_case_details=None):
+    """
+    Build in-memory lookup indexes once per run so phases don't rescan cases:
+    - case_bar_numbers: case number -> bar numbers whose search returned it
+    - case_spa_lawyers: case number -> SPA lawyers for those bar numbers
+    - pd_party_cases: normalized PD party name -> active PD case numbers
+    - pd_party_names: normalized PD party name -> party name as listed on TAMES
+    - county_cases / judge_cases: trial court county / judge -> case numbers
+    """
+    indexes = {
+        'case_bar_numbers': {},
+        'case_spa_lawyers': {},
+        'pd_party_cases': {},
+        'pd_party_names': {},
+        'county_cases': {},
+        'judge_cases': {},
+        'activity_date_index': [],   # Sorted (last activity ordinal, case number)
+    }
 
-def should_process_case_for_analysis(case, all_case_details, driver=None):
-    """Determine if a case should be processed for Claude analysis based on all filtering criteria"""
+    for bar_num, cases in all_cases.items():
+        for case_number in cases:
+            indexes['case_bar_numbers'].setdefault(case_number, []).append(bar_num)
+            if bar_num in SPA_LAWYERS:
+                indexes['case_spa_lawyers'].setdefault(case_number, []).append(SPA_LAWYERS[bar_num])
+
+    for case in all_case_details or []:
+        index_case_details(indexes, case)
+
+    return indexes
+
+def index_case_details(indexes, case):
+    """Add an extracted case's PD parties and trial court info to the run indexes"""
     case_number = case['case_number']
-    
-    # Only process COA cases
+
+    # Only active PD cases count toward the concurrent PD check
+    if case_number.startswith('PD-') and not case.get('filtered_out', False):
+        for party in case.get('parties', []):
+            if party.get('is_state_party', False):
+                continue
+            party_key = normalize_name_for_matching(party['name'])
+            pd_cases = indexes['pd_party_cases'].setdefault(party_key, [])
+            if case_number not in pd_cases:
+                pd_cases.append(case_number)
+            if party_key not in indexes['pd_party_names']:
+                indexes['pd_party_names'][party_key] = party['name']
+                # New PD party - the name match index and cached matches must be rebuilt
+                indexes.pop('pd_name_index', None)
+                indexes.pop('pd_fuzzy_index', None)
+                indexes.pop('pd_party_matches', None)
+                indexes.pop('pd_fuzzy_matches', None)
+
+    # Cases saved before activity dates were derived get them computed here
+    activity_dates = case.get('activity_dates') or compute_case_activity_dates(case)
+    if activity_dates.get('last_activity') is not None:
+        bisect.insort(indexes['activity_date_index'], (activity_dates['last_activity'], case_number))
+    
+    trial_court_info = case.get('trial_court_info', {})
+    if trial_court_info.get('county'):
+        indexes['county_cases'].setdefault(trial_court_info['county'], []).append(case_number)
+    if trial_court_info.get('judge'):
+        indexes['judge_cases'].setdefault(trial_court_info['judge'], []).append(case_number)
+
+def cases_inactive_since(indexes, days, today=None):
+    """Case numbers whose last activity is more than `days` days ago (range query on the date index)"""
+    today = today or date.today()
+    cutoff = today.toordinal() - days
+    end = bisect.bisect_left(indexes['activity_date_index'], (cutoff, ''))
+    return [case_number for ordinal, case_number in indexes['activity_date_index'][:end]]
+
+def get_pd_name_index(indexes):
+    """Return the name match index over active PD parties, building it on first use"""
+    if 'pd_name_index' not in indexes:
+        indexes['pd_name_index'] = build_name_match_index(indexes['pd_party_names'].values())
+    return indexes['pd_name_index']
+
+def precompute_pd_party_matches(indexes, coa_party_names):
+    """Match all COA party names against active PD parties in one match_all call and cache the results"""
+    cached_matches = indexes.setdefault('pd_party_matches', {})
+    pending = [name for name in dict.fromkeys(coa_party_names) if name not in cached_matches]
+    if not pending:
+        return cached_matches
+    
+    for coa_name, pd_name, reason in match_all(pending, indexes['pd_party_names'].values()):
+        cached_matches.setdefault(coa_name, []).append(pd_name)
+    for coa_name in pending:
+        cached_matches.setdefault(coa_name, [])
+    
+    return cached_matches
+
+def get_pd_fuzzy_index(indexes):
+    """Return the fuzzy (phonetic + edit distance) index over active PD parties, building it on first use"""
+    if 'pd_fuzzy_index' not in indexes:
+        indexes['pd_fuzzy_index'] = build_fuzzy_name_index(indexes['pd_party_names'].values())
+    return indexes['pd_fuzzy_index']
+
+def find_pd_party_matches(indexes, coa_party_name):
+    """
+    Return active PD party names matching a COA party, using precomputed matches
+    when available. With FUZZY_NAME_MATCHING on, a party with no strict match is
+    also looked up in the fuzzy index.
+    """
+    cached_matches = indexes.setdefault('pd_party_matches', {})
+    if coa_party_name in cached_matches:
+        matches = cached_matches[coa_party_name]
+    else:
+        matches = find_name_matches(get_pd_name_index(indexes), coa_party_name)
+        cached_matches[coa_party_name] = matches
+    
+    if matches or not FUZZY_NAME_MATCHING:
+        return matches
+    
+    fuzzy_matches = indexes.setdefault('pd_fuzzy_matches', {})
+    if coa_party_name not in fuzzy_matches:
+        fuzzy_matches[coa_party_name] = find_fuzzy_name_matches(get_pd_fuzzy_index(indexes), coa_party_name)
+        for pd_name, confidence in fuzzy_matches[coa_party_name]:
+            print(f"🔤 Fuzzy PD match: {coa_party_name} ~ {pd_name} (confidence {confidence:.2f})")
+    return [pd_name for pd_name, confidence in fuzzy_matches[coa_party_name]]
+
+def non_state_party_names(cases):
+    """Names of all non-state parties across the given cases"""
+    return [party['name'] for case in cases for party in case.get('parties', [])
+            if not party.get('is_state_party', False)]
+
+# Eligibility rule costs - rules run cheapest first and stop at the first rejection
+RULE_COST_FIELD = 0        # Reads fields already stored on the case
+RULE_COST_NAME_MATCH = 1   # Matches party names against the PD party index
+
+def rule_is_coa_case(case, context):
+    """Only COA cases (two-digit court prefix) are analyzed"""
     if not case.get('is_coa_case', False):
-        return False, "Not a COA case"
-    
-    # Must have briefs downloaded
+        return "Not a COA case", 'Not a COA case'
+
+def rule_has_briefs(case, context):
+    """Cases need downloaded briefs to analyze"""
     if not case.get('briefs_downloaded'):
-        return False, "No briefs downloaded"
-    
-    # Check if already marked as filtered out
+        return "No briefs downloaded", 'No briefs downloaded'
+
+def rule_not_already_filtered(case, context):
+    """Skip cases an earlier pass already filtered out"""
     if case.get('filtered_out', False):
-        return False, f"Already filtered: {case.get('filter_reason', 'Unknown')}"
-    
-    # Check for judgment
-    if case.get('has_judgment', False):
-        return False, "Case has judgment"
-    elif 'has_judgment' not in case and driver is not None:
-        # Field not set - this case was processed before judgment detection was added
-        # Perform real-time judgment check
-        try:
-            print(f"🔍 Checking judgment status for {case_number}...")
-            url = f"https://search.txcourts.gov/Case.aspx?cn={case_number}"
-            driver.get(url)
-            
-            # Wait for page to load
-            WebDriverWait(driver, 10).until(
-                EC.any_of(
-                    EC.presence_of_element_located((By.ID, "ctl00_ContentPlaceHolder1_grdEvents_ctl00")),
-                    EC.presence_of_element_located((By.CLASS_NAME, "panel-content"))
-                )
-            )
-            
-            soup = BeautifulSoup(driver.page_source, 'html.parser')
-            has_judgment_result = has_judgment(soup)
-            
-            # Update the case data with the judgment status
-            case['has_judgment'] = has_judgment_result
-            
-            if has_judgment_result:
-                return False, "Case has judgment (real-time check)"
-            
-        except Exception as e:
-            print(f"⚠️  Error checking judgment for {case_number}: {str(e)}")
-            # If we can't check, be conservative and skip
-            return False, "Judgment status check failed"
-    
-    # Check for mandate issued
+        return f"Already filtered: {case.get('filter_reason', 'Unknown')}", case.get('filter_reason')
+
+def rule_has_non_state_parties(case, context):
+    """Cases need at least one non-state party"""
+    if not any(not p.get('is_state_party', False) for p in case.get('parties', [])):
+        return "No non-state parties found", 'No non-state parties'
+
+def rule_no_judgment(case, context):
+    """Skip cases with a judgment, or whose judgment status couldn't be determined"""
+    if case.get('has_judgment') is None:
+        # Be conservative - a case is only analyzed once it's known to have no judgment
+        return "Judgment status unknown", None
+    if case['has_judgment']:
+        return "Case has a judgment", 'Judgment exists'
+
+def rule_mandate_not_issued(case, context):
+    """Skip cases where the mandate has issued"""
     if case.get('mandate_issued', False):
-        return False, "Mandate issued"
-    
-    # Check for non-state parties
-    non_state_parties = [p for p in case.get('parties', []) if not p.get('is_state_party', False)]
-    if not non_state_parties:
-        return False, "No non-state parties"
-    
-    # Check for concurrent PD cases
-    pd_cases = [c for c in all_case_details if c['case_number'].startswith('PD-')]
-    pd_non_state_parties = []
-    for pd_case in pd_cases:
-        if not pd_case.get('filtered_out', False):  # Only active PD cases
-            for party in pd_case.get('parties', []):
-                if not party.get('is_state_party', False):
-                    pd_non_state_parties.append(party['name'])
-    
-    # Check if any non-state parties have concurrent PD cases
-    for party in non_state_parties:
-        coa_party_name = party['name']
-        for pd_party_name in pd_non_state_parties:
-            if names_match(coa_party_name, pd_party_name):
-                return False, f"Concurrent PD case for {coa_party_name}"
-    
-    # Check for stale cases (>1 year)
-    calendar_events = case.get('calendar_events', [])
-    if calendar_events:
-        most_recent_date = None
-        for event in calendar_events:
-            event_date_str = event.get('date', '').strip()
-            if event_date_str:
-                try:
-                    event_date = datetime.strptime(event_date_str, '%m/%d/%Y')
-                    if most_recent_date is None or event_date > most_recent_date:
-                        most_recent_date = event_date
-                except ValueError:
-                    continue
-        
-        if most_recent_date:
-            one_year_ago = datetime.now() - timedelta(days=365)
-            if most_recent_date < one_year_ago:
-                return False, f"Stale case (last activity: {most_recent_date.strftime('%m/%d/%Y')})"
-    
-    # Check for Anders briefs in downloaded briefs
+        return "Mandate has been issued", 'Mandate issued'
+
+def rule_recent_activity(case, context):
+    """Skip stale cases (no docket, brief or calendar activity in over a year)"""
+    activity_dates = case.get('activity_dates') or compute_case_activity_dates(case)
+    last_activity = activity_dates.get('last_activity')
+    if last_activity is not None and last_activity < context['stale_cutoff']:
+        return (f"No activity in over a year (last activity: {format_ordinal_date(last_activity)})",
+                'Stale case (>1 year)')
+
+def rule_no_anders_brief(case, context):
+    """Skip cases with an Anders brief (by description, or as classified by triage)"""
     for brief in case.get('briefs_downloaded', []):
-        description = brief.get('description', '').lower()
-        if 'anders' in description:
-            return False, "Contains Anders brief"
+        if 'anders' in brief.get('description', '').lower() or brief.get('document_type') == 'anders_brief':
+            return "Contains Anders brief", 'Anders brief'
+
+def rule_no_concurrent_pd_case(case, context):
+    """Skip cases whose non-state parties also have an active PD case"""
+    parties_with_pd_cases = []
+    for party in case.get('parties', []):
+        if party.get('is_state_party', False):
+            continue
+        pd_matches = find_pd_party_matches(context['indexes'], party['name'])
+        if pd_matches:
+            parties_with_pd_cases.append(f"{party['name']} (matches PD: {pd_matches[0]})")
     
+    if parties_with_pd_cases:
+        return f"Parties have concurrent PD cases: {', '.join(parties_with_pd_cases)}", 'Concurrent PD cases'
+
+# Every eligibility rule, with its cost tier. Each check returns None when the case
+# passes, or (reason, filter_reason) when it should be filtered out.
+ELIGIBILITY_RULES = {
+    'coa_case': {'cost': RULE_COST_FIELD, 'check': rule_is_coa_case},
+    'has_briefs': {'cost': RULE_COST_FIELD, 'check': rule_has_briefs},
+    'not_filtered': {'cost': RULE_COST_FIELD, 'check': rule_not_already_filtered},
+    'non_state_parties': {'cost': RULE_COST_FIELD, 'check': rule_has_non_state_parties},
+    'no_judgment': {'cost': RULE_COST_FIELD, 'check': rule_no_judgment},
+    'mandate_not_issued': {'cost': RULE_COST_FIELD, 'check': rule_mandate_not_issued},
+    'recent_activity': {'cost': RULE_COST_FIELD, 'check': rule_recent_activity},
+    'no_anders_brief': {'cost': RULE_COST_FIELD, 'check': rule_no_anders_brief},
+    'no_concurrent_pd': {'cost': RULE_COST_NAME_MATCH, 'check': rule_no_concurrent_pd_case},
+}
+
+# Rules applied before downloading briefs (Anders briefs are checked on the case page during download)
+BRIEF_DOWNLOAD_RULES = ['non_state_parties', 'no_concurrent_pd', 'recent_activity', 'no_judgment', 'mandate_not_issued']
+
+# Rules applied before sending a case's briefs to Claude
+ANALYSIS_RULES = ['coa_case', 'has_briefs', 'not_filtered', 'no_judgment', 'mandate_not_issued',
+                  'non_state_parties', 'no_concurrent_pd', 'recent_activity', 'no_anders_brief']
+
+# Cases with no activity for longer than this are considered stale
+STALE_CASE_DAYS = 365
+
+def build_eligibility_context(indexes):
+    """Shared state for an eligibility pass: run indexes, stale cutoff and per-rule metrics"""
+    return {
+        'indexes': indexes,
+        'stale_cutoff': date.today().toordinal() - STALE_CASE_DAYS,
+        'metrics': {},
+    }
+
+def evaluate_eligibility(case, rule_names, context):
+    """
+    Run the named rules cheapest-first, stopping at the first rejection.
+    Returns (eligible, rule_name, (reason, filter_reason)) and records per-rule
+    evaluation counts, rejections and time spent in context['metrics'].
+    """
+    rules = sorted(rule_names, key=lambda name: ELIGIBILITY_RULES[name]['cost'])
+    for rule_name in rules:
+        start = time.perf_counter()
+        result = ELIGIBILITY_RULES[rule_name]['check'](case, context)
+        elapsed = time.perf_counter() - start
+        
+        stats = context['metrics'].setdefault(rule_name, {'evaluated': 0, 'rejected': 0, 'seconds': 0.0})
+        stats['evaluated'] += 1
+        stats['seconds'] += elapsed
+        if result:
+            stats['rejected'] += 1
+            return False, rule_name, result
+    
+    return True, None, None
+
+def print_rule_metrics(context, title):
+    """Print how often each eligibility rule ran, rejected a case, and how long it took"""
+    metrics = context['metrics']
+    if not metrics:
+        return
+    print(f"⏱️  {title} rule metrics:")
+    for rule_name in sorted(metrics, key=lambda name: (ELIGIBILITY_RULES[name]['cost'], name)):
+        stats = metrics[rule_name]
+        print(f"   • {rule_name}: {stats['evaluated']} checked, {stats['rejected']} rejected, "
+              f"{stats['seconds'] * 1000:.1f} ms")
+
+def should_process_case_for_analysis(case, all_case_details, indexes=None, context=None):
+    """Determine if a case should be processed for Claude analysis based on all filtering criteria"""
+    if context is None:
+        if indexes is None:
+            indexes = build_case_indexes({}, all_case_details)
+        context = build_eligibility_context(indexes)
+    
+    eligible, rule_name, result = evaluate_eligibility(case, ANALYSIS_RULES, context)
+    if not eligible:
+        return False, result[0]
     return True, "Eligible for processing"
 
 def scrape_attorney_cases(analysis_only=False):
@@ -2236,6 +5005,7 @@ def scrape_attorney_cases(analysis_only=False):
             
             # Create empty all_cases for consistency
             all_cases = {}
+            indexes = build_case_indexes(all_cases, all_case_details)
             
             # Jump directly to Claude analysis phase
             print("\n" + "="*60)
@@ -2243,7 +5013,7 @@ def scrape_attorney_cases(analysis_only=False):
             print("="*60)
             
             # Run Claude analysis
-            eligible_coa_cases = run_claude_analysis(all_case_details, output_folder, analysis_only=True)
+            eligible_coa_cases = run_claude_analysis(all_case_details, output_folder, analysis_only=True, indexes=indexes)
             
             # Create case breakdown for summary
             coa_cases = [case for case in all_case_details if case.get('is_coa_case', False)]
@@ -2296,14 +5066,12 @@ def scrape_attorney_cases(analysis_only=False):
                 f.write(f"Total Calendar Events Found: {total_calendar_events}\n")
                 f.write(f"Total Briefs Downloaded: {total_briefs}\n")
                 f.write(f"Total Legal Issues Identified: {total_legal_issues}\n")
+                for line in claude_usage_summary_lines(all_case_details):
+                    f.write(f"{line}\n")
+                f.write(f"Cases Inactive > {STALE_CASE_DAYS} Days: {len(cases_inactive_since(indexes, STALE_CASE_DAYS))}\n")
                 
                 # County statistics
-                counties = {}
-                for case in all_case_details:
-                    trial_court_info = case.get('trial_court_info', {})
-                    county = trial_court_info.get('county')
-                    if county:
-                        counties[county] = counties.get(county, 0) + 1
+                counties = {county: len(cases) for county, cases in indexes['county_cases'].items()}
                 
                 if counties:
                     f.write(f"\nCases by County:\n")
@@ -2367,6 +5135,9 @@ def scrape_attorney_cases(analysis_only=False):
             print(f"📈 Total unique cases: {len(all_unique_cases)}")
             print("=" * 40)
             
+            # Index case -> bar numbers / SPA lawyers once instead of rescanning per case
+            indexes = build_case_indexes(all_cases)
+            
             if not all_unique_cases:
                 print("❌ No cases found for any bar numbers. Exiting.")
                 return
@@ -2422,18 +5193,15 @@ def scrape_attorney_cases(analysis_only=False):
                         )
                         
                         # Parse page and extract details (WITHOUT downloading briefs)
-                        soup = BeautifulSoup(driver.page_source, 'html.parser')
+                        page_source = driver.page_source
+                        save_case_page(output_folder, case_number, page_source)
+                        soup = BeautifulSoup(page_source, 'html.parser')
                         
                         case_details = extract_case_details(driver, soup, case_number, output_folder=None, all_case_numbers=all_unique_cases)
                         
                         # Add which bar numbers this case is associated with and SPA lawyer
-                        case_details['associated_bar_numbers'] = []
-                        case_details['spa_lawyers'] = []
-                        for bar_num, cases in all_cases.items():
-                            if case_number in cases:
-                                case_details['associated_bar_numbers'].append(bar_num)
-                                if bar_num in SPA_LAWYERS:
-                                    case_details['spa_lawyers'].append(SPA_LAWYERS[bar_num])
+                        case_details['associated_bar_numbers'] = list(indexes['case_bar_numbers'].get(case_number, []))
+                        case_details['spa_lawyers'] = list(indexes['case_spa_lawyers'].get(case_number, []))
                         
                         # Add first analyzed timestamp for new cases
                         case_details['first_analyzed'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
@@ -2466,85 +5234,36 @@ def scrape_attorney_cases(analysis_only=False):
             print(f"   • PD cases: {len(pd_cases)}")
             print(f"   • Other cases: {len(all_case_details) - len(coa_cases) - len(pd_cases)}")
             
-            # Get all non-state parties from PD cases
-            pd_non_state_parties = []
-            for case in pd_cases:
-                if not case.get('filtered_out', False):  # Only active PD cases
-                    for party in case.get('parties', []):
-                        if not party.get('is_state_party', False):
-                            pd_non_state_parties.append(party['name'])
+            # Index PD parties and trial court info now that all case details are in
+            for case in all_case_details:
+                index_case_details(indexes, case)
+            
+            # Get all non-state parties from PD cases (deduplicated by normalized name)
+            pd_non_state_parties = list(indexes['pd_party_names'].values())
             
             print(f"🔍 Found {len(pd_non_state_parties)} unique non-state parties in active PD cases")
             
+            # Match every COA party against the PD parties in one bulk pass
+            precompute_pd_party_matches(indexes, non_state_party_names(coa_cases))
+            
             # Determine which COA cases should have briefs downloaded
+            eligibility_context = build_eligibility_context(indexes)
             eligible_coa_cases = []
             for case in coa_cases:
-                # Check for non-state parties first
-                non_state_parties = [p for p in case.get('parties', []) if not p.get('is_state_party', False)]
-                if not non_state_parties:
-                    case['brief_download_reason'] = "No non-state parties found"
-                    case['filtered_out'] = True
-                    case['filter_reason'] = 'No non-state parties'
-                    continue
-                
-                # Check if any non-state parties have concurrent PD cases (BEFORE mandate check)
-                parties_with_pd_cases = []
-                for party in non_state_parties:
-                    coa_party_name = party['name']
-                    # Check if this COA party matches any PD party
-                    for pd_party_name in pd_non_state_parties:
-                        if names_match(coa_party_name, pd_party_name):
-                            parties_with_pd_cases.append(f"{coa_party_name} (matches PD: {pd_party_name})")
-                            break  # Found a match, no need to check other PD parties
-                
-                if parties_with_pd_cases:
-                    case['brief_download_reason'] = f"Parties have concurrent PD cases: {', '.join(parties_with_pd_cases)}"
-                    case['filtered_out'] = True
-                    case['filter_reason'] = 'Concurrent PD cases'
-                    continue
-                
-                # Check if last calendar date was over a year ago
-                calendar_events = case.get('calendar_events', [])
-                if calendar_events:
-                    # Find the most recent calendar date
-                    most_recent_date = None
-                    for event in calendar_events:
-                        event_date_str = event.get('date', '').strip()
-                        if event_date_str:
-                            try:
-                                # Parse date in MM/DD/YYYY format
-                                event_date = datetime.strptime(event_date_str, '%m/%d/%Y')
-                                if most_recent_date is None or event_date > most_recent_date:
-                                    most_recent_date = event_date
-                            except ValueError:
-                                continue
-                    
-                    if most_recent_date:
-                        one_year_ago = datetime.now() - timedelta(days=365)
-                        if most_recent_date < one_year_ago:
-                            case['brief_download_reason'] = f"Last calendar date was over a year ago ({most_recent_date.strftime('%m/%d/%Y')})"
-                            case['filtered_out'] = True
-                            case['filter_reason'] = 'Stale case (>1 year)'
-                            continue
-                
-                # Check if there is a judgment (before mandate check)
-                if case.get('has_judgment', False):
-                    case['brief_download_reason'] = "Case has a judgment"
-                    case['filtered_out'] = True
-                    case['filter_reason'] = 'Judgment exists'
-                    continue
-                
-                # Check if mandate has been issued (after PD case check and date check)
-                if case.get('mandate_issued', False):
-                    case['brief_download_reason'] = "Mandate has been issued"
-                    case['filtered_out'] = True
-                    case['filter_reason'] = 'Mandate issued'
+                eligible, rule_name, result = evaluate_eligibility(case, BRIEF_DOWNLOAD_RULES, eligibility_context)
+                if not eligible:
+                    case['brief_download_reason'], case['filter_reason'] = result
+                    # Rules without a filter reason (e.g. unknown judgment status) skip the case for this run only
+                    case['filtered_out'] = result[1] is not None
                     continue
                 
                 # This case is eligible for brief download
+                non_state_parties = [p for p in case.get('parties', []) if not p.get('is_state_party', False)]
                 case['brief_download_reason'] = f"Eligible: COA case with {len(non_state_parties)} non-state parties, no concurrent PD cases, no judgment, mandate not issued, recent activity"
                 eligible_coa_cases.append(case)
             
+            print_rule_metrics(eligibility_context, "Brief download")
+            
             print(f"\n📥 BRIEF DOWNLOAD ANALYSIS:")
             print(f"   • Eligible COA cases: {len(eligible_coa_cases)}")
             print(f"   • Filtered COA cases: {len(coa_cases) - len(eligible_coa_cases)}")
@@ -2558,22 +5277,10 @@ def scrape_attorney_cases(analysis_only=False):
                     case_number = case['case_number']
                     brief_progress.set_description(f"Downloading briefs for {case_number}")
                     
+                    previous_briefs = case.get('briefs_downloaded') or existing_cases.get(case_number, {}).get('briefs_downloaded', [])
                     try:
-                        # Check if briefs are already downloaded
-                        already_downloaded, existing_briefs = briefs_already_downloaded(case_number, output_folder)
-                        if already_downloaded:
-                            brief_progress.write(f"📁 Briefs already downloaded for {case_number}: {len(existing_briefs)} files")
-                            # Create brief info from existing files
-                            case['briefs_downloaded'] = []
-                            for brief_file in existing_briefs:
-                                case['briefs_downloaded'].append({
-                                    'filepath': os.path.join(output_folder, "briefs", brief_file),
-                                    'description': brief_file.replace(case_number + "_", "").replace(".pdf", ""),
-                                    'case_number': case_number
-                                })
-                            brief_progress.set_postfix(briefs=len(existing_briefs))
-                            continue
-                        
+                        # Always revisit the case page so briefs filed since the last run are
+                        # picked up (briefs already on disk are not downloaded again)
                         # Navigate to case page
                         url = f"https://search.txcourts.gov/Case.aspx?cn={case_number}"
                         driver.get(url)
@@ -2588,7 +5295,9 @@ def scrape_attorney_cases(analysis_only=False):
                         )
                         
                         # Parse page and download briefs
-                        soup = BeautifulSoup(driver.page_source, 'html.parser')
+                        page_source = driver.page_source
+                        save_case_page(output_folder, case_number, page_source)
+                        soup = BeautifulSoup(page_source, 'html.parser')
                         print(f"📥 Downloading briefs for {case_number}: {case['brief_download_reason']}")
                         
                         # Check for Anders briefs BEFORE downloading
@@ -2615,13 +5324,14 @@ def scrape_attorney_cases(analysis_only=False):
                             continue
                         
                         briefs_downloaded = download_briefs_for_case(driver, soup, case_number, output_folder)
-                        case['briefs_downloaded'] = briefs_downloaded
+                        case['briefs_downloaded'] = merge_brief_analysis_state(previous_briefs, briefs_downloaded)
                         
                         brief_progress.set_postfix(briefs=len(briefs_downloaded))
                         
                     except Exception as e:
                         brief_progress.write(f"Error downloading briefs for {case_number}: {str(e)}")
-                        case['briefs_downloaded'] = []
+                        # Keep the briefs from earlier runs that are still on disk
+                        case['briefs_downloaded'] = [brief for brief in previous_briefs if os.path.exists(brief_file_path(brief) or '')]
                         continue
                 
                 brief_progress.close()
@@ -2632,7 +5342,7 @@ def scrape_attorney_cases(analysis_only=False):
             print("="*60)
             
             # Run Claude analysis
-            eligible_coa_cases = run_claude_analysis(all_case_details, output_folder, analysis_only=False)
+            eligible_coa_cases = run_claude_analysis(all_case_details, output_folder, analysis_only=False, indexes=indexes)
         
         # Save results (common to both modes)
         details_file = os.path.join(output_folder, "case_details.json")
@@ -2648,9 +5358,13 @@ def scrape_attorney_cases(analysis_only=False):
             driver.quit()
             print("✅ Browser closed")
 
-def run_claude_analysis(all_case_details, output_folder, analysis_only=False):
+def run_claude_analysis(all_case_details, output_folder, analysis_only=False, indexes=None):
     """Run Claude analysis on cases with briefs"""
     
+    # Build the PD party index once for the whole filtering pass
+    if indexes is None:
+        indexes = build_case_indexes({}, all_case_details)
+    
     # Apply comprehensive filtering to determine which cases should be processed
     eligible_coa_cases = []
     skipped_cases = []
@@ -2659,26 +5373,22 @@ def run_claude_analysis(all_case_details, output_folder, analysis_only=False):
     coa_cases_with_briefs = [case for case in all_case_details if case.get('is_coa_case', False) and case.get('briefs_downloaded')]
     
     print(f"🔍 Filtering {len(coa_cases_with_briefs)} COA cases with briefs for analysis...")
+    precompute_pd_party_matches(indexes, non_state_party_names(coa_cases_with_briefs))
     
-    # Set up browser for real-time judgment checking if needed
-    driver = None
-    cases_needing_judgment_check = [case for case in coa_cases_with_briefs if 'has_judgment' not in case]
+    # Backfill judgment status up front (from cached pages, or parallel fetches outside
+    # analysis-only mode) so filtering never waits on the network mid-loop
+    backfill_case_fields(coa_cases_with_briefs, ['judgment', 'mandate'], output_folder,
+                         all_case_details=all_case_details, allow_network=not analysis_only)
     
-    if cases_needing_judgment_check:
-        print(f"🌐 Starting browser for real-time judgment checking of {len(cases_needing_judgment_check)} cases...")
-        driver = setup_browser(headless=True)
+    eligibility_context = build_eligibility_context(indexes)
+    for case in coa_cases_with_briefs:
+        should_process, reason = should_process_case_for_analysis(case, all_case_details, context=eligibility_context)
+        if should_process:
+            eligible_coa_cases.append(case)
+        else:
+            skipped_cases.append((case['case_number'], reason))
     
-    try:
-        for case in coa_cases_with_briefs:
-            should_process, reason = should_process_case_for_analysis(case, all_case_details, driver)
-            if should_process:
-                eligible_coa_cases.append(case)
-            else:
-                skipped_cases.append((case['case_number'], reason))
-    finally:
-        if driver:
-            print("🌐 Closing judgment check browser...")
-            driver.quit()
+    print_rule_metrics(eligibility_context, "Analysis")
     
     print(f"📊 Analysis filtering results:")
     print(f"   • Eligible for analysis: {len(eligible_coa_cases)}")
@@ -2693,46 +5403,39 @@ def run_claude_analysis(all_case_details, output_folder, analysis_only=False):
     print(f"\n🔍 Found {len(eligible_coa_cases)} cases eligible for analysis")
     
     # Check if API key is available
-    api_key = os.getenv('ANTHROPIC_API_KEY')
-    if not api_key:
+    if not ANALYSIS_GATEWAY.api_key:
         print("⚠️  ANTHROPIC_API_KEY environment variable not set")
         print("⚠️  Skipping Claude analysis. Set the API key to enable brief analysis.")
         print("⚠️  Export ANTHROPIC_API_KEY=your_api_key_here")
         return eligible_coa_cases
     
-    print(f"🤖 Analyzing briefs with Claude for {len(eligible_coa_cases)} cases...")
+    # Bring cases analyzed before per-brief tracking up to date here, before any analysis
+    # runs, so the async paths only read per-brief state
+    for case in eligible_coa_cases:
+        migrate_brief_analysis_state(case)
     
-    analysis_progress = tqdm(eligible_coa_cases, desc="🤖 Analyzing with Claude", unit="case")
+    if TRIAGE_BRIEFS:
+        run_with_async_client(triage_cases, eligible_coa_cases, all_case_details, output_folder)
+        # Cases triage found an Anders brief in are filtered out like at download
+        eligible_coa_cases = [case for case in eligible_coa_cases if not case.get('filtered_out', False)]
     
-    for case in analysis_progress:
-        case_number = case['case_number']
-        analysis_progress.set_description(f"Analyzing {case_number}")
-        
-        try:
-            # Check if legal issues are already analyzed
-            existing_issues = case.get('legal_issues', [])
-            if existing_issues:
-                analysis_progress.write(f"🧠 Legal issues already analyzed for {case_number}: {len(existing_issues)} issues")
-                analysis_progress.set_postfix(issues=len(existing_issues))
-                continue
-            
-            analyze_case_briefs(case, output_folder)
-            
-            # Save updated case details to JSON immediately after analysis
-            details_file = os.path.join(output_folder, "case_details.json")
-            with open(details_file, 'w') as f:
-                json.dump(all_case_details, f, indent=2)
-            
-            # Update progress with issue count
-            issue_count = len(case.get('legal_issues', []))
-            analysis_progress.set_postfix(issues=issue_count)
-            
-        except Exception as e:
-            analysis_progress.write(f"Error analyzing briefs for {case_number}: {str(e)}")
-            case['legal_issues'] = []
-            continue
+    report_analysis_plan(eligible_coa_cases)
     
-    analysis_progress.close()
+    if PACK_SMALL_CASES:
+        run_with_async_client(analyze_small_cases_packed, eligible_coa_cases, all_case_details, output_folder)
+    
+    if BATCH_ANALYSIS:
+        print(f"🤖 Analyzing briefs with Claude for {len(eligible_coa_cases)} cases via the Message Batches API...")
+        analyze_cases_with_message_batches(eligible_coa_cases, all_case_details, output_folder)
+    else:
+        print(f"🤖 Analyzing briefs with Claude for {len(eligible_coa_cases)} cases ({ANALYSIS_CONCURRENCY} at a time)...")
+        asyncio.run(analyze_cases_concurrently(eligible_coa_cases, all_case_details, output_folder))
+    
+    # Keep this run's token usage and cost with each case
+    add_usage_to_cases(all_case_details)
+    save_case_details(all_case_details, output_folder)
+    for line in claude_usage_summary_lines():
+        print(f"💵 {line.strip()}")
     
     # Generate comprehensive case report
     print(f"\n📄 GENERATING COMPREHENSIVE CASE REPORT")
@@ -2757,10 +5460,11 @@ def reprocess_eligible_cases():
     
     # Find eligible COA cases (ones that would be processed for analysis)
     eligible_cases = []
+    eligibility_context = build_eligibility_context(build_case_indexes({}, all_case_details))
     
     print("🔍 Finding eligible cases for reprocessing...")
     for case in all_case_details:
-        should_process, reason = should_process_case_for_analysis(case, all_case_details, driver=None)
+        should_process, reason = should_process_case_for_analysis(case, all_case_details, context=eligibility_context)
         if should_process:
             eligible_cases.append(case)
     
@@ -2770,114 +5474,138 @@ def reprocess_eligible_cases():
         print("ℹ️  No eligible cases found for reprocessing")
         return
     
-    # Set up browser
-    print("🌐 Starting browser for reprocessing...")
-    driver = setup_browser(headless=True)
-    
     try:
-        reprocess_progress = tqdm(eligible_cases, desc="🔄 Reprocessing cases", unit="case")
-        
-        for case in reprocess_progress:
-            case_number = case['case_number']
-            reprocess_progress.set_description(f"Reprocessing {case_number}")
-            
-            try:
-                # Check if trial court info already exists
-                existing_trial_court = case.get('trial_court_info', {})
-                if existing_trial_court.get('county'):
-                    reprocess_progress.write(f"✅ {case_number} already has trial court info")
-                    continue
-                
-                # Navigate to case page
-                url = f"https://search.txcourts.gov/Case.aspx?cn={case_number}"
-                driver.get(url)
-                
-                # Wait for page to load
-                WebDriverWait(driver, 30).until(
-                    EC.any_of(
-                        EC.presence_of_element_located((By.ID, "ctl00_ContentPlaceHolder1_grdEvents_ctl00")),
-                        EC.presence_of_element_located((By.CLASS_NAME, "panel-content"))
-                    )
-                )
-                
-                # Extract trial court information
-                soup = BeautifulSoup(driver.page_source, 'html.parser')
-                trial_court_info = extract_trial_court_info(soup, case_number)
-                
-                # Update case with trial court info
-                case['trial_court_info'] = trial_court_info
-                
-                if trial_court_info.get('county'):
-                    reprocess_progress.write(f"✅ Updated {case_number} with county: {trial_court_info['county']}")
-                else:
-                    reprocess_progress.write(f"⚠️  No county found for {case_number}")
-                
-            except Exception as e:
-                reprocess_progress.write(f"❌ Error reprocessing {case_number}: {str(e)}")
-                continue
-        
-        reprocess_progress.close()
-        
-        # Save updated case data
-        print("💾 Saving updated case data...")
-        details_file = os.path.join(output_folder, "case_details.json")
-        with open(details_file, 'w') as f:
-            json.dump(all_case_details, f, indent=2)
-        print(f"✅ Saved updated case data to {details_file}")
+        # Only cases without trial court info are fetched (page cache first, then in parallel)
+        backfill_case_fields(eligible_cases, ['trial_court'], output_folder, all_case_details=all_case_details)
         
         # Regenerate comprehensive report with updated information
         print("📄 Regenerating comprehensive case report...")
-        
-        # Apply the same filtering logic as the main analysis
-        coa_cases_with_briefs = [case for case in all_case_details 
-                                if case.get('is_coa_case', False) and case.get('briefs_downloaded')]
-        
-        # Filter to only eligible cases (same logic as run_claude_analysis)
-        eligible_for_report = []
-        skipped_for_report = []
-        
-        print(f"🔍 Filtering {len(coa_cases_with_briefs)} COA cases for report...")
-        
-        for case in coa_cases_with_briefs:
-            should_process, reason = should_process_case_for_analysis(case, all_case_details, driver=None)
-            if should_process:
-                eligible_for_report.append(case)
-            else:
-                skipped_for_report.append((case['case_number'], reason))
-        
-        print(f"📊 Report filtering results:")
-        print(f"   • Eligible for report: {len(eligible_for_report)}")
-        print(f"   • Skipped: {len(skipped_for_report)}")
-        
-        # Debug: Show which cases are being skipped and why
-        if skipped_for_report:
-            print(f"\n🔍 DEBUG - Cases being skipped for report:")
-            for case_number, reason in skipped_for_report:
-                print(f"   • {case_number}: {reason}")
-        
-        generate_comprehensive_case_report(eligible_for_report, output_folder)
+        generate_comprehensive_case_report(eligible_cases, output_folder)
         
     except Exception as e:
         print(f"❌ Error during reprocessing: {str(e)}")
-    finally:
-        if driver:
-            print("🌐 Closing browser...")
-            driver.quit()
+
+def run_field_backfill(fields):
+    """Backfill the given extracted fields for every saved case that is missing them"""
+    output_folder = os.path.join(BASE_DIR, "data")
+    
+    unknown_fields = [field for field in fields if field not in BACKFILL_EXTRACTORS]
+    if unknown_fields:
+        print(f"❌ Unknown backfill field(s): {', '.join(unknown_fields)}")
+        print(f"   Available fields: {', '.join(BACKFILL_EXTRACTORS)}")
+        return
+    
+    existing_cases = load_existing_case_data(output_folder)
+    if not existing_cases:
+        print("❌ No existing case data found. Run the main script first.")
+        return
+    
+    all_case_details = list(existing_cases.values())
+    updated = backfill_case_fields(all_case_details, fields, output_folder, all_case_details=all_case_details)
+    print(f"✅ Backfilled {updated} cases")
+
+def generate_synthetic_party_names(count, distinct=5000, seed=0):
+    """Generate a synthetic party roster in TAMES formats with repeated names, for benchmarks"""
+    rng = random.Random(seed)
+    first_names = ['John', 'Maria', 'James', 'Linda', 'Robert', 'Ana', 'Michael', 'Emily', 'David', 'Sarah']
+    last_names = ['Smith', 'Garcia', 'Johnson', 'Martinez', 'Brown', 'Lee', 'Nguyen', 'Davis', 'Lopez', 'Wilson']
+    middles = ['', 'A.', 'Lee', 'J', 'Marie']
+    suffixes = ['', '', '', 'Jr.', 'Sr', 'III']
+    
+    distinct_names = []
+    for i in range(distinct):
+        first = rng.choice(first_names)
+        last = f"{rng.choice(last_names)}{i % 97}"
+        middle = rng.choice(middles)
+        suffix = rng.choice(suffixes)
+        if rng.random() < 0.5:
+            name = f"{last.upper()}, {first.upper()} {middle} {suffix}"
+        else:
+            name = f"{first} {middle} {last} {suffix}"
+        distinct_names.append(' '.join(name.split()))
+    
+    return [rng.choice(distinct_names) for _ in range(count)]
+
+def benchmark_name_normalization(count=100000):
+    """Time uncached vs. memoized name normalization over a synthetic party roster"""
+    names = generate_synthetic_party_names(count)
+    print(f"⏱️  Benchmarking name normalization over {len(names)} synthetic names "
+          f"({len(set(names))} distinct)")
+    
+    uncached_normalize = normalize_name_cached.__wrapped__
+    uncached_components = name_match_components.__wrapped__
+    
+    start = time.perf_counter()
+    for name in names:
+        uncached_components(uncached_normalize(name))
+    uncached_seconds = time.perf_counter() - start
+    
+    normalize_name_cached.cache_clear()
+    name_match_components.cache_clear()
+    start = time.perf_counter()
+    for normalized in normalize_names_for_matching(names):
+        name_match_components(normalized)
+    cached_seconds = time.perf_counter() - start
+    
+    print(f"   • Uncached: {uncached_seconds:.3f}s")
+    print(f"   • Memoized: {cached_seconds:.3f}s ({uncached_seconds / max(cached_seconds, 1e-9):.1f}x faster)")
+    print(f"   • Cache: {normalize_name_cached.cache_info()}")
 
 def main():
     """Main function with argument parsing"""
+    global FUZZY_NAME_MATCHING, FUZZY_NAME_MIN_CONFIDENCE, ANALYSIS_CONCURRENCY, BATCH_ANALYSIS, TEXT_FIRST_ANALYSIS, SECTION_BRIEFS, BATCH_PACK_BY, PACK_SMALL_CASES, TRIAGE_BRIEFS, ANALYSIS_BUDGET_USD
+    
     parser = argparse.ArgumentParser(description='Texas Court of Appeals Case Scraper')
     parser.add_argument('--analysis-only', action='store_true', 
                        help='Run only Claude analysis on existing cases (skip search and brief download)')
     parser.add_argument('--reprocess-eligible', action='store_true',
                        help='Reprocess eligible cases to update with trial court information')
+    parser.add_argument('--backfill', metavar='FIELD[,FIELD]',
+                       help=f'Fill in missing extracted fields for saved cases ({", ".join(BACKFILL_EXTRACTORS)})')
+    parser.add_argument('--benchmark-names', type=int, metavar='COUNT',
+                       help='Benchmark name normalization over COUNT synthetic party names and exit')
+    parser.add_argument('--analysis-concurrency', type=int, default=ANALYSIS_CONCURRENCY,
+                       help=f'Number of cases to analyze with Claude at the same time (default: {ANALYSIS_CONCURRENCY})')
+    parser.add_argument('--batch-analysis', action='store_true',
+                       help='Analyze briefs through the Message Batches API (cheaper, not interactive)')
+    parser.add_argument('--text-first', action='store_true',
+                       help='Send extracted brief text instead of PDFs (scanned pages are still sent as PDF)')
+    parser.add_argument('--section-briefs', action='store_true',
+                       help='Send only the issues and argument sections of briefs when they can be found')
+    parser.add_argument('--triage', action='store_true',
+                       help=f'Classify new briefs with {TRIAGE_MODEL} first and fully analyze only substantive ones')
+    parser.add_argument('--pack-by', choices=('pages', 'tokens'), default=BATCH_PACK_BY,
+                       help=f'Pack briefs into requests by page count, or by page count and input tokens (default: {BATCH_PACK_BY})')
+    parser.add_argument('--pack-small-cases', action='store_true',
+                       help=f'Analyze cases with a single short brief (up to {SMALL_CASE_MAX_PAGES} pages) several to a request')
+    parser.add_argument('--budget-usd', type=float, default=ANALYSIS_BUDGET_USD,
+                       help='Stop starting new Claude requests once this run has spent this many USD')
+    parser.add_argument('--fuzzy-names', action='store_true',
+                       help='Also treat phonetic/typo/hyphenation variants of PD party names as concurrent PD cases')
+    parser.add_argument('--fuzzy-min-confidence', type=float, default=FUZZY_NAME_MIN_CONFIDENCE,
+                       help=f'Minimum confidence for a fuzzy PD party match (default: {FUZZY_NAME_MIN_CONFIDENCE})')
     
     args = parser.parse_args()
     
-    if args.analysis_only:
+    FUZZY_NAME_MATCHING = args.fuzzy_names
+    FUZZY_NAME_MIN_CONFIDENCE = args.fuzzy_min_confidence
+    ANALYSIS_CONCURRENCY = args.analysis_concurrency
+    BATCH_ANALYSIS = args.batch_analysis
+    TEXT_FIRST_ANALYSIS = args.text_first
+    SECTION_BRIEFS = args.section_briefs
+    BATCH_PACK_BY = args.pack_by
+    PACK_SMALL_CASES = args.pack_small_cases
+    TRIAGE_BRIEFS = args.triage
+    ANALYSIS_BUDGET_USD = args.budget_usd
+    
+    if args.benchmark_names:
+        benchmark_name_normalization(args.benchmark_names)
+    elif args.analysis_only:
         scrape_attorney_cases(analysis_only=True)
     elif args.reprocess_eligible:
         reprocess_eligible_cases()
+    elif args.backfill:
+        run_field_backfill([field.strip() for field in args.backfill.split(',') if field.strip()])
     else:
         scrape_attorney_cases(analysis_only=False)
 